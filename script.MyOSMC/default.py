@@ -19,9 +19,9 @@
 #  http://www.gnu.org/copyleft/gpl.html
 #
 
-import xbmc
+# xbmcgui and the addon modules are imported on first use, keeping start up quick.
+# tests/test_import_time.py holds the start up import budget.
 import xbmcaddon
-import xbmcgui
 
 
 __addon__        = xbmcaddon.Addon()
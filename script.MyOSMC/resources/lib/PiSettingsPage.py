@@ -1,57 +1,92 @@
 
 # XBMC Modules
-import xbmc
 import xbmcaddon
-import xbmcgui
 
 # STANDARD Modules
-import subprocess
-import sys
-import os
 import threading
-import traceback
 
-from piconfig import ConfigFileInterface, MASTER_SETTINGS
-from CommonTools import *
+# This module is on the addon start up path, so only light modules are imported here.
+# xbmcgui, the piconfig package (with the MASTER_SETTINGS literal) and OpenWithBackup are
+# imported on first use. tests/test_import_time.py holds the start up import budget.
+from common.language import Translator
+from common.logger import Logger, LOGERROR
+from common.profiling import profiled
 
 __addon__  = xbmcaddon.Addon()
-DIALOG     = xbmcgui.Dialog()
 
 
-lang = language(__addon__=__addon__).lang
-log  = logger(whodisis='PiConfig').log
+lang = Translator(__addon__).lang
+log  = Logger('PiConfig').log
+
+# the number of times the new config is written before giving up, when other writers get in first
+WRITE_ATTEMPTS = 5
+
+
+def get_dialog():
+
+	import xbmcgui
+
+	return xbmcgui.Dialog()
+
 
 class PageLauncher(threading.Thread):
 
 
 	def __init__(self, gui, location='/boot/config.txt'):
 
+		from piconfig import ConfigFileInterface
+
 		self.config_interface = ConfigFileInterface(location)
 		self.gui = gui
 
+	@profiled('PageLauncher.run')
 	def run(self):
 
-		# get the settings as they are in the config.txt
-		self.configfile = self.config_interface.read_config_txt()
-		config_settings = self.config_interface.extract_settings_from_doc(self.configfile)
+		try:
+			# get the settings as they are in the config.txt
+			self.configfile = self.config_interface.read_config_txt()
+			config_settings = self.config_interface.extract_settings_from_doc(self.configfile)
+
+			# Launch the page, populating the settings with the values that have been retrieved
 
-		# Launch the page, populating the settings with the values that have been retrieved
 
+			# on close of that page, get the new settings
+			new_settings = """{something or other}"""
 
-		# on close of that page, get the new settings
-		new_settings = """{something or other}"""
+			# update all the settings with their new values.
+			self.configfile = self.config_interface.update_settings(self.configfile, new_settings)
 
-		# update all the settings with their new values.
-		self.configfile = self.config_interface.update_settings(self.configfile, new_settings)
+			# write the new config
+			from common.filelock import LockTimeout
+			from common.openwithbackup import OpenWithBackup
+			from piconfig.ConfigFileInterface import ConfigChanged
 
-		# write the new config
-		self.config_interface.write_config_txt(self.configfile, OpenWithBackup=OpenWithBackup)
+			for _ in range(WRITE_ATTEMPTS):
+				try:
+					self.config_interface.write_config_txt(self.configfile, OpenWithBackup=OpenWithBackup)
+					break
+				except ConfigChanged as conflict:
+					# the config.txt was changed while the page was open, the changes made here are made on top of it
+					self.configfile = self.config_interface.rebase(self.configfile, conflict)
+					failure = conflict
+				except LockTimeout as timeout:
+					# another process held the config.txt for the whole timeout, the write is tried again
+					failure = timeout
+			else:
+				log('The config.txt was not written after %s attempts: %s', WRITE_ATTEMPTS, failure, level=LOGERROR)
+
+		finally:
+			# Kodi does not run atexit in its interpreters, so what the page recorded is written now
+			from common import metrics
+			metrics.flush()
 
 
 
 	def get_defaults(self):
 
-		return {key: value[default] for key, value in MASTER_SETTINGS.iteritems()}
+		from piconfig.CompiledSettings import load_master_settings
+
+		return {name: default for name, typ, stub, default, valid, patterns, suppress in load_master_settings()}
 
 
 
@@ -0,0 +1,168 @@
+
+# STANDARD Modules
+import os
+import threading
+
+from common import metrics
+from common.filewatcher import FileWatcher
+from common.logger import Logger, LOGINFO, LOGERROR
+from common.profiling import PROFILE_ENV, PROFILE_DB_KEY
+from database import DBInterface
+from piconfig.ConfigFileInterface import ConfigFileInterface, NOT_SETTINGS
+
+log = Logger('SettingsService').log
+
+# the settings of the addon, only the settings it declares are pushed to Kodi
+SETTINGS_XML = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'settings.xml')
+
+
+def declared_settings(path=SETTINGS_XML):
+	''' Returns the ids of the settings declared in the addon's settings.xml. '''
+
+	# deferred, the settings.xml is only read when the service starts
+	import xml.etree.ElementTree as ET
+
+	try:
+		tree = ET.parse(path)
+	except (IOError, ET.ParseError) as e:
+		log('Could not read the declared settings from %s: %s', path, e, level=LOGERROR)
+		return set()
+
+	return set(x.get('id') for x in tree.iter('setting') if x.get('id'))
+
+
+class SettingsService(object):
+	''' Keeps the Kodi settings in step with the config.txt and the preferences database.
+
+	One DBInterface and one ConfigFileInterface are kept for the life of the service.
+	The service sleeps on a FileWatcher until one of the files changes, then re-parses
+	only that file and pushes only the values that differ from the last parse. Only the settings the addon
+	declares are pushed, the internal keys of the database, e.g. myosmc_profile, stay out of Kodi's settings.
+
+	A refresh that fails, e.g. when the database stays locked, is logged and the service carries on; the
+	file is parsed again when it next changes.
+	'''
+
+	def __init__(self, push, location='/boot/config.txt', db=None, watcher=None, declared=None):
+		'''
+		Arguments:
+			push (callable): called with (key, value) for every declared value that changed, e.g. __addon__.setSetting
+			location (str): the config.txt to watch.
+			db (DBInterface, optional): the preferences database, a new DBInterface by default.
+			watcher (FileWatcher, optional): for tests, a FileWatcher on the config.txt and the database by default.
+			declared (set, optional): the ids of the settings that are pushed, those in the settings.xml by default.
+		'''
+
+		self.push = push
+		self.declared = declared_settings() if declared is None else set(declared)
+
+		self.db = DBInterface() if db is None else db
+		self.config_interface = ConfigFileInterface(location)
+
+		self.config_path = os.path.abspath(location)
+		self.db_path = os.path.abspath(self.db.dbpath)
+
+		self.watcher = FileWatcher([self.config_path, self.db_path]) if watcher is None else watcher
+
+		self.config_settings = {}
+		self.db_settings = {}
+
+		self.parses = {'config': 0, 'db': 0}
+
+	def refresh_config(self):
+
+		self.parses['config'] += 1
+
+		try:
+			final_doc = self.config_interface.read_config_txt()
+		except IOError:
+			return {}
+
+		settings = self.config_interface.extract_settings_from_doc(final_doc)
+
+		settings = dict((k, str(v)) for k, v in settings.iteritems() if k not in NOT_SETTINGS)
+
+		changed = self._push_changes(self.config_settings, settings)
+		self.config_settings = settings
+
+		return changed
+
+	def refresh_db(self):
+
+		self.parses['db'] += 1
+
+		settings = dict((k, str(v)) for k, v in self.db.all_pairs().iteritems())
+
+		changed = self._push_changes(self.db_settings, settings)
+		self.db_settings = settings
+
+		if PROFILE_DB_KEY in changed:
+			self._set_profiling(changed[PROFILE_DB_KEY])
+
+		return changed
+
+	def _set_profiling(self, value):
+
+		# the scripts Kodi starts from now on inherit the environment, and profile if it is set
+		os.environ[PROFILE_ENV] = value
+
+		log('Profiling switched to %s', value, level=LOGINFO)
+
+	def _push_changes(self, old, new):
+
+		changed = dict((k, v) for k, v in new.iteritems() if old.get(k) != v)
+
+		pushed = [(k, v) for k, v in sorted(changed.iteritems()) if k in self.declared]
+
+		for key, value in pushed:
+			self.push(key, value)
+
+		if pushed:
+			log('Pushed %s changed settings', len(pushed), level=LOGINFO)
+
+		return changed
+
+	def run(self, monitor=None):
+		''' Runs until stop() is called, or the Kodi monitor reports an abort. '''
+
+		if monitor is not None:
+			abort_watcher = threading.Thread(target=self._wait_for_abort, args=(monitor,), name='AbortWatcher')
+			abort_watcher.daemon = True
+			abort_watcher.start()
+
+		self._refresh(self.refresh_config)
+		self._refresh(self.refresh_db)
+
+		while not self.watcher.stopped:
+
+			changed = self.watcher.wait()
+
+			if self.config_path in changed:
+				self._refresh(self.refresh_config)
+
+			if self.db_path in changed:
+				self._refresh(self.refresh_db)
+
+		self.watcher.close()
+
+		# Kodi does not run atexit in its interpreters, so what the service recorded is written now
+		metrics.flush()
+
+	def _refresh(self, refresh):
+
+		# the service outlives any one failure, a dead service would never sync the settings again
+		try:
+			refresh()
+		except Exception as e:
+			log('%s failed: %r', refresh.__name__, e, level=LOGERROR)
+
+	def _wait_for_abort(self, monitor):
+
+		# blocks inside Kodi, so the service itself does not wake up to check for an abort
+		monitor.waitForAbort()
+
+		self.stop()
+
+	def stop(self):
+
+		self.watcher.stop()
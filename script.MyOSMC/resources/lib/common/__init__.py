@@ -1,6 +1,7 @@
 from logger import Logger
 from language import Translator
-from hardware_version import hardware_version
+from hardwareversion import hardware_version
 from string_manipulation import sanitize_string
-from openwithbackup import OpenWithBackup
+from openwithbackup import OpenWithBackup, flush_pending_backups, wait_for_backups, list_backups, restore, \
+    backup_content
 __all__ = ['hardware_version', 'sanitize_string','language','logger','OpenWithBackup']
@@ -0,0 +1,113 @@
+
+import os
+
+
+class BackupIndex(object):
+    ''' Metadata for the backups of a single golden file, stored alongside the backups.
+
+    Each entry records the version (the stamp at the end of the backup filename),
+    the time of the backup in seconds since the epoch, the size of the content and
+    its sha1 hash. Listing backups, pruning and deduplication are all answered from
+    here, without globbing the backup folder or opening the backup files.
+
+    Entries are kept ordered oldest to newest.
+    '''
+
+    def __init__(self, backup_path, golden_name):
+
+        self.backup_path = backup_path
+        self.golden_name = golden_name
+
+        self.index_file = os.path.join(backup_path, golden_name + '.index')
+
+        self.entries = None
+
+    def load(self, rebuild):
+        ''' Reads the index file. When it is missing or unreadable, the index is rebuilt
+            from the backups provided by the rebuild callable.
+
+        Arguments:
+            rebuild (callable): returns a list of (filename, timestamp) tuples for the existing backups.
+        '''
+
+        # deferred, along with hashlib, to keep them off the addon start up path
+        import json
+
+        try:
+            with open(self.index_file, 'r') as f:
+                self.entries = json.load(f)['entries']
+        except (IOError, ValueError, KeyError):
+            self.entries = [self._describe(fn, timestamp) for fn, timestamp in rebuild()]
+            self.entries = [x for x in self.entries if x is not None]
+            self.save()
+
+        return self
+
+    def save(self):
+
+        import json
+
+        tmp_file = self.index_file + '.tmp'
+
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump({'entries': self.entries}, f)
+
+            os.rename(tmp_file, self.index_file)
+        except (IOError, OSError):
+            pass
+
+    def filename(self, version):
+
+        return os.path.join(self.backup_path, self.golden_name + '_backup' + version)
+
+    def get(self, version):
+
+        for entry in self.entries:
+            if entry['version'] == version:
+                return entry
+
+        raise KeyError(version)
+
+    def find_hash(self, sha1):
+        ''' Returns the newest entry with the provided hash, or None. '''
+
+        for entry in reversed(self.entries):
+            if entry['hash'] == sha1:
+                return entry
+
+        return None
+
+    def add(self, version, timestamp, content):
+
+        entry = {'version': version, 'timestamp': timestamp, 'size': len(content), 'hash': content_hash(content)}
+
+        self.entries = [x for x in self.entries if x['version'] != version]
+        self.entries.append(entry)
+
+        return entry
+
+    def remove(self, versions):
+
+        versions = set(versions)
+
+        self.entries = [x for x in self.entries if x['version'] not in versions]
+
+    def _describe(self, fn, timestamp):
+
+        try:
+            with open(fn, 'r') as f:
+                content = f.read()
+        except IOError:
+            return None
+
+        version = fn[fn.rindex('_backup') + 7:]
+
+        return {'version': version, 'timestamp': timestamp, 'size': len(content), 'hash': content_hash(content)}
+
+
+def content_hash(content):
+
+    import hashlib
+
+    return hashlib.sha1(content).hexdigest()
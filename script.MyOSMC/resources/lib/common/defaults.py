@@ -3,14 +3,17 @@
 #
 # Example usage:
 #
-# from defaults import DEFAULT_DICT
+# from defaults import DefaultsResolver
 # from dbinterface import DBInterface
 #
-# db = DBInterface()
-# try:
-#     setting = db.getsetting('unknownKey')
-# except KeyError:
-#     setting = DEFAULT_DICT.get('unknownKey', None)
+# resolver = DefaultsResolver(db=DBInterface())
+# setting = resolver.get('unknownKey')
+#
+# The resolver looks in the preferences database first, then in the defaults for the hardware.
+
+from collections import Mapping
+
+from hardwareversion import hardware_version, HARDWARE_IDS
 
 
 DEFAULT_DICT = {
@@ -28,9 +31,128 @@ DEFAULT_DICT = {
     # i.e. to accomodate hardware specific values.
     # This example shows how the 'standard value', can be replaced with the
     # special rPi3 value:
-    #     >>> from defaults import DEFAULT_DICT
-    #     >>> DEFAULT_DICT.update( DEFAULT_DICT.get(common.getHardwareID(), {} )
+    #     >>> from defaults import flat_defaults
+    #     >>> flat_defaults('rPi3')['a']
+    #     'rPi3 special value'
     'rPi3': {
         'a': 'rPi3 special value'
     },
 }
+
+
+class FrozenDict(Mapping):
+    ''' A read-only dict. '''
+
+    def __init__(self, *args, **kwargs):
+
+        self._dict = dict(*args, **kwargs)
+
+    def __getitem__(self, key):
+
+        return self._dict[key]
+
+    def __iter__(self):
+
+        return iter(self._dict)
+
+    def __len__(self):
+
+        return len(self._dict)
+
+    def __repr__(self):
+
+        return 'FrozenDict(%r)' % self._dict
+
+
+# the flattened defaults for each hardware id, computed on first use
+_flattened = {}
+
+
+def flat_defaults(hardware_id=None):
+    ''' Returns DEFAULT_DICT with the overlay for the hardware applied, as a read-only mapping.
+        The hardware overlays themselves are left out. The mapping is only built once for each
+        hardware id; clear_cache() discards them after DEFAULT_DICT has been changed.
+
+    Arguments:
+        hardware_id (str, optional): the hardware overlay to apply, defaults to the detected hardware.
+    '''
+
+    if hardware_id is None:
+        hardware_id = hardware_version()
+
+    try:
+        return _flattened[hardware_id]
+    except KeyError:
+        pass
+
+    merged = dict((k, v) for k, v in DEFAULT_DICT.iteritems() if k not in HARDWARE_IDS)
+    merged.update(DEFAULT_DICT.get(hardware_id, {}))
+
+    flattened = _flattened[hardware_id] = FrozenDict(merged)
+
+    return flattened
+
+
+def clear_cache():
+
+    _flattened.clear()
+
+
+class DefaultsResolver(object):
+    ''' Resolves settings through three layers: the values in the preferences database, then the
+    hardware overlay, then the base defaults.
+
+    The defaults and the overlay are flattened once per hardware id, see flat_defaults, and only when a
+    lookup first needs them, so that a setting found in the database does not detect the hardware. The
+    database values are read in a single query on first use, and kept until refresh() is called, so that
+    every lookup after that is a dict lookup.
+    '''
+
+    def __init__(self, db=None, hardware_id=None, defaults=None):
+        '''
+        Arguments:
+            db (DBInterface, optional): the preferences database, without one only the defaults are used.
+            hardware_id (str, optional): the hardware overlay to apply, defaults to the detected hardware.
+            defaults (mapping, optional): the defaults to use instead of flat_defaults(hardware_id).
+        '''
+
+        self.db = db
+        self.hardware_id = hardware_id
+
+        self._defaults = defaults
+        self._user = None
+
+    @property
+    def defaults(self):
+
+        if self._defaults is None:
+            self._defaults = flat_defaults(self.hardware_id)
+
+        return self._defaults
+
+    def _user_values(self):
+
+        if self._user is None:
+            self._user = {} if self.db is None else self.db.all_pairs()
+
+        return self._user
+
+    def refresh(self):
+        ''' Discards the database values, so they are read again on the next lookup. '''
+
+        self._user = None
+
+    def get(self, key, default=None):
+
+        user = self._user_values()
+
+        # the database stores its keys in lowercase
+        try:
+            return user[key.lower()]
+        except KeyError:
+            return self.defaults.get(key, default)
+
+    def resolve_many(self, keys, default=None):
+        ''' Returns {key: value} for each of the keys, reading the database at most once. '''
+
+        return dict((key, self.get(key, default)) for key in keys)
@@ -0,0 +1,128 @@
+'''
+Advisory locks between the processes that read and write a golden file, e.g. the config.txt, which the
+settings page, the service and the shell tools can all write.
+
+The lock is an fcntl lock on a lockfile next to the golden file, <golden file>.lock, so that it outlives
+the golden file being replaced by a rename. Readers take shared locks, which any number can hold at once,
+and writers take an exclusive lock, which waits for the readers and other writers to finish. The locks are
+advisory: only the processes that take them are kept out.
+'''
+
+import errno
+import os
+import time
+
+import metrics
+
+LOCK_SUFFIX = '.lock'
+
+# seconds to wait for a lock before giving up, None waits for as long as it takes
+LOCK_TIMEOUT = 5
+
+# seconds between attempts to take a lock that is held
+POLL_INTERVAL = 0.02
+
+
+class LockTimeout(IOError):
+    ''' Raised when a lock on a golden file cannot be taken within the timeout. '''
+
+
+class FileLock(object):
+    ''' Context manager holding a shared or exclusive lock on a golden file.
+
+    The lock is held by the open lockfile, so it is released when the lock is, or when the process ends.
+    Two FileLocks on the same file exclude each other even in the same process.
+
+    When the lockfile does not exist and cannot be created, because the folder is read only to this
+    process or does not exist, there is no lock to take and the FileLock holds nothing.
+    '''
+
+    def __init__(self, golden_file, shared=False, timeout=LOCK_TIMEOUT):
+        '''
+        Arguments:
+            golden_file (str): the file being locked; the lock is taken on golden_file.lock.
+            shared (bool): a read lock, rather than an exclusive write lock.
+            timeout (float, optional): seconds to wait for the lock; 0 tries once, None waits indefinitely.
+        '''
+
+        self.golden_file = golden_file
+        self.lock_file = golden_file + LOCK_SUFFIX
+        self.shared = shared
+        self.timeout = timeout
+
+        self.fd = None
+
+    def acquire(self):
+        ''' Takes the lock, raising LockTimeout when it is not free within the timeout. '''
+
+        # deferred, the locks are only needed when the golden file is read or written
+        import fcntl
+
+        try:
+            # a lock can be taken on a file opened for reading, which is all a reader may be allowed
+            self.fd = os.open(self.lock_file, os.O_RDONLY | os.O_CREAT, 0o666)
+        except OSError as e:
+            if e.errno in (errno.EACCES, errno.EROFS, errno.ENOENT):
+                return self
+            raise
+
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+
+        if self.timeout is None:
+            fcntl.flock(self.fd, mode)
+            return self
+
+        started = None
+
+        while True:
+            try:
+                fcntl.flock(self.fd, mode | fcntl.LOCK_NB)
+                break
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    self.release()
+                    raise
+
+            # only contended locks are timed, an uncontended one costs nothing extra
+            now = time.time()
+            if started is None:
+                started = now
+
+            if now - started >= self.timeout:
+                self.release()
+                metrics.increment('file_lock_timeouts')
+                raise LockTimeout('Timed out waiting for the lock on %s' % self.golden_file)
+
+            time.sleep(POLL_INTERVAL)
+
+        if started is not None:
+            metrics.observe('file_lock_wait_seconds', time.time() - started)
+
+        return self
+
+    def release(self):
+
+        if self.fd is not None:
+            # closing the lockfile releases the lock
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+
+        return self.acquire()
+
+    def __exit__(self, *args):
+
+        self.release()
+
+
+def read_lock(golden_file, timeout=LOCK_TIMEOUT):
+    ''' Returns a shared lock on the golden file, for reading it. '''
+
+    return FileLock(golden_file, shared=True, timeout=timeout)
+
+
+def write_lock(golden_file, timeout=LOCK_TIMEOUT):
+    ''' Returns an exclusive lock on the golden file, for writing it. '''
+
+    return FileLock(golden_file, shared=False, timeout=timeout)
@@ -0,0 +1,212 @@
+
+import os
+import select
+import struct
+import time
+
+# inotify event masks, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# seconds between checks when inotify is unavailable
+POLL_INTERVAL = 30
+
+
+class FileWatcher(object):
+    ''' Blocks until one of the watched files changes.
+
+    The parent folders of the files are watched with inotify, so that files replaced by a
+    rename are still picked up, and the thread sleeps in select() until there is an event.
+    Where inotify is unavailable, the files are polled for changes to their mtime instead.
+
+    Either way, a file is only reported as changed when its (mtime, size, inode) signature
+    differs from the last time it was reported, so spurious events do not cause a re-parse.
+
+    Attributes:
+        wakeups: the number of times the watching thread woke up, for measuring idle cost.
+        inotify: whether inotify is in use, rather than polling.
+    '''
+
+    def __init__(self, paths, poll_interval=POLL_INTERVAL, use_inotify=True):
+
+        self.paths = [os.path.abspath(x) for x in paths]
+        self.poll_interval = poll_interval
+
+        self.signatures = dict((x, self._signature(x)) for x in self.paths)
+
+        self.wakeups = 0
+        self.started = time.time()
+
+        self.stopped = False
+
+        # stop() writes to this pipe, waking the watching thread without any polling
+        self._stop_read, self._stop_write = os.pipe()
+
+        self._fd = None
+        self._watches = {}
+
+        if use_inotify:
+            self._start_inotify()
+
+        self.inotify = self._fd is not None
+
+    def _start_inotify(self):
+
+        try:
+            import ctypes
+            import ctypes.util
+
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                return
+
+            for folder in set(os.path.dirname(x) for x in self.paths):
+                wd = libc.inotify_add_watch(fd, folder, WATCH_MASK)
+                if wd < 0:
+                    os.close(fd)
+                    return
+                self._watches[wd] = folder
+
+        except (OSError, AttributeError):
+            return
+
+        self._fd = fd
+
+    def _signature(self, path):
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        return st.st_mtime, st.st_size, st.st_ino
+
+    def _read_events(self):
+        ''' Returns the watched paths named in the pending inotify events. '''
+
+        touched = set()
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError:
+            return touched
+
+        offset = 0
+
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, check everything
+                return set(self.paths)
+
+            path = os.path.join(self._watches.get(wd, ''), name)
+
+            if path in self.signatures:
+                touched.add(path)
+
+        return touched
+
+    def _changed(self, candidates):
+
+        changed = set()
+
+        for path in candidates:
+            signature = self._signature(path)
+
+            if signature != self.signatures[path]:
+                self.signatures[path] = signature
+                changed.add(path)
+
+        return changed
+
+    def wait(self, timeout=None):
+        ''' Waits for changes to the watched files.
+
+        Arguments:
+            timeout (float, optional): the most seconds to wait, None waits until there is a change or stop() is called.
+
+        Returns:
+            set of the paths that changed, empty if the wait timed out or the watcher was stopped.
+        '''
+
+        deadline = None if timeout is None else time.time() + timeout
+
+        while not self.stopped:
+
+            remaining = None if deadline is None else max(0, deadline - time.time())
+
+            if self.inotify:
+                wait_for = remaining
+                readable = [self._fd, self._stop_read]
+            else:
+                wait_for = self.poll_interval if remaining is None else min(self.poll_interval, remaining)
+                readable = [self._stop_read]
+
+            try:
+                ready, _, _ = select.select(readable, [], [], wait_for)
+            except select.error:
+                ready = []
+
+            self.wakeups += 1
+
+            if self._stop_read in ready:
+                break
+
+            if self.inotify:
+                candidates = self._read_events() if self._fd in ready else set()
+            else:
+                candidates = self.paths
+
+            changed = self._changed(candidates)
+
+            if changed:
+                return changed
+
+            if deadline is not None and time.time() >= deadline:
+                break
+
+        return set()
+
+    def wakeups_per_hour(self):
+
+        elapsed = max(time.time() - self.started, 1e-6)
+
+        return self.wakeups * 3600.0 / elapsed
+
+    def stop(self):
+
+        self.stopped = True
+
+        try:
+            os.write(self._stop_write, 'x')
+        except OSError:
+            pass
+
+    def close(self):
+
+        self.stop()
+
+        for fd in (self._fd, self._stop_read, self._stop_write):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+        self._fd = None
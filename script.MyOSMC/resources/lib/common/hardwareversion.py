@@ -1,3 +1,138 @@
+
+import threading
+
+CPUINFO = '/proc/cpuinfo'
+DEVICE_TREE_MODEL = '/proc/device-tree/model'
+
+# board types from the new style revision codes (bits 4-11)
+# https://www.raspberrypi.org/documentation/hardware/raspberrypi/revision-codes/
+REVISION_TYPES = {
+    0x00: 'rPi1',  # A
+    0x01: 'rPi1',  # B
+    0x02: 'rPi1',  # A+
+    0x03: 'rPi1',  # B+
+    0x04: 'rPi2',  # 2B
+    0x06: 'rPi1',  # CM1
+    0x08: 'rPi3',  # 3B
+    0x09: 'rPi0',  # Zero
+    0x0a: 'rPi3',  # CM3
+    0x0c: 'rPi0',  # Zero W
+    0x0d: 'rPi3',  # 3B+
+    0x0e: 'rPi3',  # 3A+
+    0x10: 'rPi3',  # CM3+
+    0x11: 'rPi4',  # 4B
+}
+
+# substrings of the device-tree model, checked in order
+MODEL_TYPES = [
+    ('Raspberry Pi Zero', 'rPi0'),
+    ('Raspberry Pi Compute Module 3', 'rPi3'),
+    ('Raspberry Pi 4', 'rPi4'),
+    ('Raspberry Pi 3', 'rPi3'),
+    ('Raspberry Pi 2', 'rPi2'),
+    ('Raspberry Pi', 'rPi1'),
+    ('Vero', 'vero'),
+]
+
+# every hardware_id a profile can have
+HARDWARE_IDS = frozenset(list(REVISION_TYPES.values()) + [x[1] for x in MODEL_TYPES] + ['unknown'])
+
+
+class HardwareProfile(object):
+    ''' Description of the board the addon is running on.
+
+    Attributes:
+        model: the model string from the device-tree, empty if there is none.
+        revision: the Revision code from /proc/cpuinfo, empty if there is none.
+        cores: the number of processors listed in /proc/cpuinfo.
+        hardware_id: the board family, e.g. 'rPi3'. This is the key used for hardware overlays in DEFAULT_DICT.
+        pi_version: 'PiB' for single core boards and 'Pi2' otherwise, including when no processors are
+                    listed. This is the key used for hardware dependent defaults in MASTER_SETTINGS.
+    '''
+
+    def __init__(self, model='', revision='', cores=0):
+
+        self.model = model
+        self.revision = revision
+        self.cores = cores
+
+        self.hardware_id = self._identify()
+        self.pi_version = 'PiB' if self.cores == 1 else 'Pi2'
+
+    def __repr__(self):
+
+        return 'HardwareProfile(model=%r, revision=%r, cores=%r)' % (self.model, self.revision, self.cores)
+
+    def _identify(self):
+
+        # new style revision codes have bit 23 set, and the board type in bits 4-11
+        try:
+            code = int(self.revision, 16)
+        except ValueError:
+            code = None
+
+        if code is not None:
+            if code & (1 << 23):
+                board = REVISION_TYPES.get((code >> 4) & 0xff)
+                if board is not None:
+                    return board
+
+            elif 'Raspberry' in self.model or not self.model:
+                # old style revision codes are only used by the original Pi
+                return 'rPi1'
+
+        for substring, board in MODEL_TYPES:
+            if substring in self.model:
+                return board
+
+        if self.cores > 1:
+            return 'rPi2'
+
+        return 'unknown'
+
+    @classmethod
+    def detect(cls):
+        ''' Builds the profile from the device-tree model and /proc/cpuinfo. '''
+
+        try:
+            with open(DEVICE_TREE_MODEL, 'r') as f:
+                model = f.read().strip('\x00\n ')
+        except IOError:
+            model = ''
+
+        revision, cores = '', 0
+
+        try:
+            with open(CPUINFO, 'r') as f:
+                for line in f:
+                    if line.startswith('processor'):
+                        cores += 1
+                    elif line.startswith('Revision'):
+                        revision = line.partition(':')[2].strip()
+        except IOError:
+            pass
+
+        return cls(model=model, revision=revision, cores=cores)
+
+
+_profile = None
+_profile_lock = threading.Lock()
+
+
+def hardware_profile():
+    ''' Returns the HardwareProfile for this board. Detection only happens once per process. '''
+
+    global _profile
+
+    with _profile_lock:
+
+        if _profile is None:
+            _profile = HardwareProfile.detect()
+
+        return _profile
+
+
 def hardware_version():
+    ''' Returns the hardware_id of the board, e.g. 'rPi3'. '''
 
-    pass
+    return hardware_profile().hardware_id
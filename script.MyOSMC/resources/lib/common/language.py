@@ -1,10 +1,113 @@
+import os
+import re
+
+# the English strings are the fallback when there is no Kodi to ask, e.g. in tests and command line tools
+STRINGS_PO = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                          'language', 'English', 'strings.po')
+
+# localized strings are cached for the life of the process, keyed by string id
+_cache = {}
+
+_po_strings = {}
+
+_PO_LINE = re.compile(r'^(msgctxt|msgid|msgstr)?\s*"(.*)"\s*$')
+_PO_ESCAPES = re.compile(r'\\(.)')
+_PO_ESCAPED = {'n': '\n', 't': '\t', '"': '"', '\\': '\\'}
 
 
 class Translator(object):
+    ''' Looks up the localized strings of the addon.
 
-    def __init__(self, __addon__):
+    Each string is only requested from Kodi once per process. When no addon is
+    provided, the strings are read from the English strings.po instead.
+    '''
+
+    def __init__(self, __addon__=None):
 
         self.__addon__ = __addon__
 
     def lang(self, id):
-        return self.__addon__.getLocalizedString(id).encode('utf-8', 'ignore')
+
+        try:
+            return _cache[id]
+        except KeyError:
+            pass
+
+        if self.__addon__ is None:
+            value = load_strings_po().get(id, '')
+        else:
+            value = self.__addon__.getLocalizedString(id).encode('utf-8', 'ignore')
+
+        _cache[id] = value
+
+        return value
+
+
+def clear_cache():
+
+    _cache.clear()
+
+
+def load_strings_po(po_file=STRINGS_PO):
+    ''' Returns the strings in the po file as a dict of {id: string}, parsing the file only once.
+        As in Kodi, the msgid is used where the msgstr is empty.
+    '''
+
+    try:
+        return _po_strings[po_file]
+    except KeyError:
+        pass
+
+    strings = {}
+
+    try:
+        with open(po_file, 'r') as f:
+            lines = f.readlines()
+    except IOError:
+        lines = []
+
+    entry, field = {}, None
+
+    for line in lines + ['']:
+
+        matched = _PO_LINE.match(line.strip())
+
+        if matched is None:
+            # a blank line (or comment) ends the entry
+            if line.strip().startswith('#') and not entry:
+                continue
+            _store_po_entry(strings, entry)
+            entry, field = {}, None
+            continue
+
+        keyword, text = matched.groups()
+        text = _PO_ESCAPES.sub(lambda x: _PO_ESCAPED.get(x.group(1), x.group(1)), text)
+
+        if keyword is not None:
+            if keyword == 'msgctxt' and 'msgid' in entry:
+                _store_po_entry(strings, entry)
+                entry = {}
+            field = keyword
+            entry[field] = text
+        elif field is not None:
+            # continuation of a multiline string
+            entry[field] += text
+
+    _po_strings[po_file] = strings
+
+    return strings
+
+
+def _store_po_entry(strings, entry):
+
+    context = entry.get('msgctxt', '')
+
+    if not context.startswith('#'):
+        return
+
+    try:
+        id = int(context[1:])
+    except ValueError:
+        return
+
+    strings[id] = entry.get('msgstr') or entry.get('msgid', '')
@@ -1,16 +1,238 @@
+import os
+import threading
+import time
+
 from string_manipulation import sanitize_string
 
-import xbmc
+try:
+    import xbmc
+except ImportError:
+    # command line tools and tests without the xbmc mocks log to a file instead
+    xbmc = None
+
+
+# Kodi's log levels
+LOGDEBUG = 0
+LOGINFO = 1
+LOGNOTICE = 2
+LOGWARNING = 3
+LOGERROR = 4
+LOGSEVERE = 5
+LOGFATAL = 6
+LOGNONE = 7
+
+LOG_FILE = '/home/osmc/.myosmc/myosmc.log'
+
+# the buffered mode holds at most this many messages, further messages are dropped
+BUFFER_SIZE = 1000
+
+# seconds Kodi's debug logging setting is kept before it is checked again, so that a long running
+# process, e.g. the settings service, follows the user turning it on or off
+LEVEL_TTL = 30
+
+# counters of messages written, dropped (buffer full or unwritable) and filtered (below the level)
+LOG_STATS = {'emitted': 0, 'dropped': 0, 'filtered': 0}
+_stats_lock = threading.Lock()
+
+# the level set with set_level, which takes the place of Kodi's
+_override = None
+
+# the level below which messages are discarded before any formatting, None until first checked
+_min_level = None
+_checked = 0.0
+
+
+def get_level():
+    ''' Returns the effective log level. Kodi only writes debug and info messages when debug logging is on,
+        which is checked at most once every LEVEL_TTL seconds.
+    '''
+
+    global _min_level, _checked
+
+    if _override is not None:
+        return _override
+
+    if xbmc is None:
+        return LOGNOTICE
+
+    now = time.time()
+
+    if _min_level is None or now - _checked >= LEVEL_TTL:
+        try:
+            debugging = xbmc.getCondVisibility('System.GetBool(debug.showloginfo)')
+        except Exception:
+            debugging = True
+        _min_level = LOGDEBUG if debugging else LOGNOTICE
+        _checked = now
+
+    return _min_level
+
+
+def set_level(level):
+    ''' Overrides the effective log level, None returns to checking Kodi. '''
+
+    global _override, _min_level
+
+    _override = level
+    _min_level = None
+
+
+def _count(name, number=1):
+
+    # the counters are updated by every thread that logs, and the buffer's
+    with _stats_lock:
+        LOG_STATS[name] += number
 
 
 class Logger(object):
+    ''' Logs messages prefixed with the name of the module doing the logging.
+
+    Messages below the effective level are discarded before they are sanitized or
+    formatted. Arguments for %-style formatting can be passed after the message, so
+    that formatting only happens for messages that are logged:
+
+        log('Read %s settings from %s', len(settings), location)
 
-    def __init__(self, whodisis):
+    With buffered set, messages are handed to a background thread that writes them
+    in batches.
+    '''
+
+    def __init__(self, whodisis, buffered=False):
 
         self.whodisis = whodisis
+        self.buffered = buffered
+
+    def isEnabledFor(self, level):
+
+        return level >= get_level()
+
+    def log(self, raw_message, *args, **kwargs):
+
+        level = kwargs.get('level', LOGDEBUG)
+
+        if level < get_level():
+            _count('filtered')
+            return
+
+        if self.buffered:
+            _get_buffer().put(self.whodisis, raw_message, args, level)
+        else:
+            _emit([(self.whodisis, raw_message, args, level)])
+
 
-    def log(self, raw_message, level=xbmc.LOGDEBUG):
+def log_stats():
+    ''' Returns a copy of the counters of emitted, dropped (buffer full) and filtered (below level) messages. '''
 
+    with _stats_lock:
+        return dict(LOG_STATS)
+
+
+def _format(whodisis, raw_message, args):
+
+    # the arguments are formatted as they are, so that numeric specifiers such as %d work, and only the
+    # result is sanitized
+    if args:
+        try:
+            message = sanitize_string(raw_message % tuple(args))
+        except (TypeError, ValueError):
+            message = ' '.join(sanitize_string(x) for x in (raw_message,) + tuple(args))
+    else:
         message = sanitize_string(raw_message)
 
-        xbmc.log(self.whodisis + ' ' + message, level=level)
+    return whodisis + ' ' + message
+
+
+def _emit(records):
+
+    if xbmc is not None:
+        # consecutive messages at the same level go to Kodi in a single call
+        batch, batch_level = [], None
+
+        for whodisis, raw_message, args, level in records:
+            if batch and level != batch_level:
+                xbmc.log('\n'.join(batch), level=batch_level)
+                batch = []
+            batch.append(_format(whodisis, raw_message, args))
+            batch_level = level
+
+        if batch:
+            xbmc.log('\n'.join(batch), level=batch_level)
+
+    else:
+        lines = [_format(whodisis, raw_message, args) + '\n' for whodisis, raw_message, args, level in records]
+
+        log_file = os.environ.get('MYOSMC_LOG', LOG_FILE)
+
+        try:
+            with open(log_file, 'a') as f:
+                f.writelines(lines)
+        except IOError:
+            _count('dropped', len(records))
+            return
+
+    _count('emitted', len(records))
+
+
+class LogBuffer(threading.Thread):
+    ''' Daemon thread that writes buffered log messages in batches. '''
+
+    def __init__(self, size=BUFFER_SIZE):
+
+        super(LogBuffer, self).__init__(name='LogBuffer')
+
+        import Queue
+
+        self.daemon = True
+        self.queue = Queue.Queue(maxsize=size)
+        self.Full = Queue.Full
+        self.Empty = Queue.Empty
+
+    def put(self, whodisis, raw_message, args, level):
+
+        try:
+            self.queue.put_nowait((whodisis, raw_message, args, level))
+        except self.Full:
+            _count('dropped')
+
+    def run(self):
+
+        while True:
+            batch = [self.queue.get()]
+
+            # collect whatever else is waiting, so it is written in one go
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except self.Empty:
+                    break
+
+            try:
+                _emit(batch)
+            except Exception:
+                _count('dropped', len(batch))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def _get_buffer():
+
+    global _buffer
+
+    with _buffer_lock:
+        if _buffer is None or not _buffer.is_alive():
+            _buffer = LogBuffer()
+            _buffer.start()
+
+    return _buffer
+
+
+def flush():
+    ''' Blocks until every buffered message has been written. '''
+
+    if _buffer is not None:
+        _buffer.queue.join()
@@ -0,0 +1,323 @@
+
+# Runtime metrics of the addon: counters and histograms from all of its parts, collected in one place.
+#
+# Each process keeps a registry in memory, recording a value is a dict update under a lock. What a
+# process records is added to the totals in METRICS_PATH by a flush. The first value recorded once
+# FLUSH_INTERVAL seconds have passed since the first value after the last flush runs one, in the thread
+# recording it; no thread is started for it, as Kodi waits for the threads of a script before it ends.
+# Scripts run by Kodi flush when they finish, as atexit does not run in Kodi's interpreters; command line
+# processes also flush when they exit. The file therefore holds the totals of every process, the service
+# and the scripts alike, and is printed by
+#
+#     osmc_getprefs --metrics
+#
+# When the environment variable MYOSMC_PROMETHEUS names a file, e.g. in the textfile collector folder of
+# the node_exporter, the totals are also written there in the Prometheus text format on every flush.
+#
+# This module only uses the standard library and no imports from the addon, so that osmcprefs can load
+# it when it is run as a script.
+
+import atexit
+import bisect
+import functools
+import os
+import threading
+import time
+
+METRICS_PATH = '/home/osmc/.myosmc/metrics.json'
+
+PROMETHEUS_ENV = 'MYOSMC_PROMETHEUS'
+PROMETHEUS_PREFIX = 'myosmc_'
+
+# seconds from the first value recorded to the flush that writes it to METRICS_PATH, which runs when
+# the next value is recorded after that
+FLUSH_INTERVAL = 60
+
+# the upper bounds of the histogram buckets, chosen by the unit at the end of the histogram's name
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def metrics_path():
+
+    # test modules set the env variable METRICSPATH, which is used if it is present
+    return os.environ.get('METRICSPATH', METRICS_PATH)
+
+
+def buckets_for(name):
+
+    return SIZE_BUCKETS if name.endswith('_bytes') else TIME_BUCKETS
+
+
+def empty_totals():
+
+    return {'counters': {}, 'histograms': {}}
+
+
+class Registry(object):
+    ''' The counters and histograms recorded by this process since its last flush. '''
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._values = empty_totals()
+
+        # when the first value since the last flush was recorded
+        self._started = None
+        self._exit_flush = False
+
+    def increment(self, name, amount=1):
+
+        with self._lock:
+            counters = self._values['counters']
+            counters[name] = counters.get(name, 0) + amount
+
+            due = self._recorded()
+
+        if due:
+            self.flush()
+
+    def observe(self, name, value):
+
+        with self._lock:
+            histogram = self._values['histograms'].get(name)
+
+            if histogram is None:
+                bounds = list(buckets_for(name))
+                histogram = {'bounds': bounds, 'counts': [0] * (len(bounds) + 1), 'sum': 0, 'count': 0}
+                self._values['histograms'][name] = histogram
+
+            # the last count is of the values above every bound
+            histogram['counts'][bisect.bisect_left(histogram['bounds'], value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+            due = self._recorded()
+
+        if due:
+            self.flush()
+
+    def timed(self, name):
+        ''' Observes the seconds taken into the histogram name, used either as a context manager
+            or as a decorator.
+        '''
+
+        return _Timed(self, name)
+
+    def _recorded(self):
+
+        # called with the lock held, returns whether the values are due to be flushed
+        if not self._exit_flush:
+            atexit.register(self.flush)
+            self._exit_flush = True
+
+        if self.flush_interval is None:
+            return False
+
+        now = time.time()
+
+        if self._started is None:
+            self._started = now
+
+        return now - self._started >= self.flush_interval
+
+    def take(self):
+        ''' Returns the values recorded since the last take, and starts again from nothing. '''
+
+        with self._lock:
+            values, self._values = self._values, empty_totals()
+            self._started = None
+
+        return values
+
+    def restore(self, values):
+        ''' Adds values that were taken but could not be flushed back into the registry. '''
+
+        with self._lock:
+            merge(self._values, values)
+
+    def flush(self, path=None):
+        ''' Adds the values recorded since the last flush to the totals in the metrics file.
+
+            Returns the new totals, or None when there was nothing to flush or the file could not be written.
+        '''
+
+        values = self.take()
+
+        if not values['counters'] and not values['histograms']:
+            return None
+
+        # metrics that cannot be written must not break what was being measured, they are tried again later
+        try:
+            return add_to_file(values, metrics_path() if path is None else path)
+        except (IOError, OSError):
+            self.restore(values)
+            return None
+
+
+class _Timed(object):
+
+    def __init__(self, registry, name):
+
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+
+        self.registry.observe(self.name, time.time() - self.start)
+
+    def __call__(self, func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Timed(self.registry, self.name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+def merge(totals, values):
+    ''' Adds the counters and histograms in values to totals. '''
+
+    counters = totals['counters']
+    for name, amount in values['counters'].iteritems():
+        counters[name] = counters.get(name, 0) + amount
+
+    histograms = totals['histograms']
+    for name, histogram in values['histograms'].iteritems():
+        total = histograms.get(name)
+
+        # a histogram whose buckets have changed since the totals were written starts again
+        if total is None or total['bounds'] != histogram['bounds']:
+            histograms[name] = {'bounds': list(histogram['bounds']), 'counts': list(histogram['counts']),
+                                'sum': histogram['sum'], 'count': histogram['count']}
+            continue
+
+        total['counts'] = [a + b for a, b in zip(total['counts'], histogram['counts'])]
+        total['sum'] += histogram['sum']
+        total['count'] += histogram['count']
+
+    return totals
+
+
+def load(path=None):
+    ''' Returns the totals in the metrics file, which are empty if there is no file. '''
+
+    # deferred, json is only needed when the metrics are flushed or read
+    import json
+
+    try:
+        with open(metrics_path() if path is None else path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return empty_totals()
+
+
+def add_to_file(values, path):
+    ''' Adds values to the totals in the metrics file at path, returning the new totals. The file is
+        locked while it is updated, so that processes flushing at the same time do not lose values.
+    '''
+
+    # deferred, only needed when the metrics are flushed
+    import fcntl
+    import json
+
+    folder = os.path.dirname(path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        totals = merge(load(path), values)
+
+        _replace(path, lambda f: json.dump(totals, f, sort_keys=True))
+
+        prometheus = os.environ.get(PROMETHEUS_ENV)
+        if prometheus:
+            _replace(prometheus, lambda f: f.write(prometheus_text(totals)))
+
+    return totals
+
+
+def _replace(path, write):
+
+    # readers only ever see a complete file
+    temp = '%s.%s.tmp' % (path, os.getpid())
+
+    with open(temp, 'w') as f:
+        write(f)
+
+    os.rename(temp, path)
+
+
+def prometheus_text(totals):
+    ''' Returns the totals in the Prometheus text exposition format. '''
+
+    lines = []
+
+    for name, value in sorted(totals['counters'].iteritems()):
+        name = '%s%s_total' % (PROMETHEUS_PREFIX, name)
+        lines.append('# TYPE %s counter' % name)
+        lines.append('%s %s' % (name, _number(value)))
+
+    for name, histogram in sorted(totals['histograms'].iteritems()):
+        name = PROMETHEUS_PREFIX + name
+        lines.append('# TYPE %s histogram' % name)
+
+        # the buckets of the format are cumulative
+        cumulative = 0
+        for bound, count in zip(histogram['bounds'] + ['+Inf'], histogram['counts']):
+            cumulative += count
+            lines.append('%s_bucket{le="%s"} %s' % (name, _number(bound), cumulative))
+
+        lines.append('%s_sum %s' % (name, _number(histogram['sum'])))
+        lines.append('%s_count %s' % (name, histogram['count']))
+
+    return '\n'.join(lines) + '\n'
+
+
+def format_metrics(totals):
+    ''' Returns the totals as lines of text for osmc_getprefs --metrics. '''
+
+    response = []
+
+    response.append('%-32s %s' % ('\n Counter', ' Value'))
+    response.append('-------------------------------- --------------------')
+    for name, value in sorted(totals['counters'].iteritems()):
+        response.append('%-32s %s' % (name, _number(value)))
+
+    response.append('%-32s %s' % ('\n Histogram', ' Count      Mean         Sum'))
+    response.append('-------------------------------- ------------------------------------')
+    for name, histogram in sorted(totals['histograms'].iteritems()):
+        count = histogram['count']
+        mean = histogram['sum'] / float(count) if count else 0
+        response.append('%-32s %-10s %-12.6g %.6g' % (name, count, mean, histogram['sum']))
+
+    response.append('\n-----------------------------------------------------')
+
+    return response
+
+
+def _number(value):
+
+    if isinstance(value, float):
+        return repr(value) if value != int(value) else str(int(value))
+
+    return str(value)
+
+
+# the registry of this process
+registry = Registry()
+
+increment = registry.increment
+observe = registry.observe
+timed = registry.timed
+flush = registry.flush
@@ -1,11 +1,24 @@
 
+import errno
 import os
-import subprocess
+import threading
 import time
 
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from glob import glob
 
+import metrics
+from backupindex import BackupIndex, content_hash
+from filelock import LockTimeout, write_lock
+from retention import policy_for
+
+
+BACKUP_PATH = '/home/osmc/.myosmc/backup_files'
+
+# snapshots handed to the background worker are spooled here until their backup is written
+PENDING_FOLDER = 'pending'
+
 
 class OpenWithBackup(object):
 
@@ -14,11 +27,21 @@ class OpenWithBackup(object):
         self.golden_file = golden_file
 
         self.golden_path = os.path.dirname(self.golden_file)
+        self.golden_name = os.path.basename(self.golden_file)
 
-        self.backup_path = '/home/osmc/.myosmc/backup_files'
+        # test modules set the env variable BACKUPPATH, which is used if it is present
+        self.backup_path = os.environ['BACKUPPATH'] if 'BACKUPPATH' in os.environ else BACKUP_PATH
         self._touchbackupfolder()
 
-        self.max_backups = 50
+        # the retention policy can be provided directly, otherwise the one registered
+        # for the golden file (or the default policy) is used
+        retention = kwargs.pop('retention', None)
+        self.retention = policy_for(self.golden_file) if retention is None else retention
+
+        # with background set, the backup is written and pruned by the backup worker
+        # rather than on the caller's thread
+        self.background = kwargs.pop('background', False)
+
         self.tmp_content = None
         self.file_object = None
 
@@ -27,8 +50,11 @@ class OpenWithBackup(object):
 
     def __enter__(self):
 
-        with open(self.tmp_content, 'r') as f:
-            self.tmp_content = f.readlines()
+        try:
+            with open(self.golden_file, 'r') as f:
+                self.tmp_content = f.readlines()
+        except IOError:
+            self.tmp_content = None
 
         self.file_object = open(self.golden_file, *self.args, **self.kwargs)
 
@@ -38,31 +64,164 @@ class OpenWithBackup(object):
 
         self.file_object.close()
 
-        self._create_backup()
+        if self.background:
+            self._hand_off_backup()
+        else:
+            self._create_backup()
 
     def _touchbackupfolder(self):
 
         if not os.path.isdir(self.backup_path):
             os.makedirs(self.backup_path)
 
-    def _create_backup(self):
+    def _hand_off_backup(self):
+        ''' Spools the snapshot of the pre-edit content to disk and queues it for the backup worker.
+            The spool file is what makes the handoff durable; if Kodi exits before the worker gets
+            to it, flush_pending_backups picks it up on the next start.
+        '''
+
+        if self.tmp_content is None:
+            return
+
+        spool_fn = self._spool_backup(self._get_now(None))
+
+        if spool_fn is not None:
+            _get_worker().put(spool_fn, self.retention)
+
+    def _spool_backup(self, stamp):
+
+        pending_path = os.path.join(self.backup_path, PENDING_FOLDER)
+
+        if not os.path.isdir(pending_path):
+            os.makedirs(pending_path)
+
+        spool_fn = os.path.join(pending_path, '%s_%s_%s_%s.pending' % (
+            self.golden_name, stamp, os.getpid(), threading.current_thread().ident))
 
-        backups = self._collect_backups()
-        backups = self._collate_backups(backups)
+        # the header holds the golden file and the time of the snapshot, the rest is the content
+        try:
+            with open(spool_fn + '.tmp', 'w') as f:
+                f.write(self.golden_file + '\n')
+                f.write(stamp + '\n')
+                f.writelines(self.tmp_content)
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.rename(spool_fn + '.tmp', spool_fn)
+        except (IOError, OSError):
+            return None
+
+        return spool_fn
+
+    def _create_backup(self, stamp=None):
+        ''' Stores the pre-edit content as a new backup, returning whether it was stored. '''
+
+        # there is nothing to back up when the golden file did not exist beforehand
+        if self.tmp_content is None:
+            return False
+
+        try:
+            with self._locked_index():
+                return self._add_backup(stamp)
+        except LockTimeout:
+            metrics.increment('backup_failures')
+            return False
+
+    def _add_backup(self, stamp):
+
+        # called with the index locked, from loading it to saving it, so that no other backup is lost
+        index = self._load_index()
+
+        last_backup = index.filename(index.entries[-1]['version']) if index.entries else None
 
-        self._drop_extras(backups)
+        if stamp is None:
+            stamp = self._get_now(last_backup)
 
-        last_backup = self.get_latest_backup()
+        stamp = self._unused_stamp(stamp, index)
 
         # create the new backup filename
-        new_fn = os.path.join(self.backup_path, self.golden_file + '_backup' + self._get_now(last_backup))
+        new_fn = index.filename(stamp)
+
+        content = ''.join(self.tmp_content)
+
+        if not self._store_backup(new_fn, content, index):
+            return False
+
+        index.add(stamp, self._backup_timestamp(new_fn), content)
+
+        self._drop_extras(index)
+
+        index.save()
+
+        return True
+
+    def _unused_stamp(self, stamp, index):
+        ''' Moves the stamp on by a second until it does not clash with an existing backup,
+            so that two backups within the same second do not overwrite each other.
+        '''
+
+        versions = set(x['version'] for x in index.entries)
+
+        while stamp in versions:
+            try:
+                stamp = (datetime.strptime(stamp, "%Y%m%d%H%M%S") + timedelta(seconds=1)).strftime("%Y%m%d%H%M%S")
+            except ValueError:
+                stamp = str(int(stamp) + 1)
+
+        return stamp
+
+    def _store_backup(self, new_fn, content, index):
+
+        # never write through an existing file, it may be a hard link shared with another version
+        if os.path.lexists(new_fn):
+            os.remove(new_fn)
+
+        # content identical to an existing backup is hard linked rather than written again
+        duplicate = index.find_hash(content_hash(content))
+
+        if duplicate is not None:
+            try:
+                os.link(index.filename(duplicate['version']), new_fn)
+                metrics.increment('backups_linked')
+                return True
+            except OSError:
+                pass
 
         # write the backup file contents
         try:
             with open(new_fn, 'w') as f:
-                f.writelines(self.tmp_content)
+                f.write(content)
         except IOError:
-            pass
+            metrics.increment('backup_failures')
+            return False
+
+        metrics.observe('backup_bytes', len(content))
+        return True
+
+    def _load_index(self):
+
+        return BackupIndex(self.backup_path, self.golden_name).load(rebuild=self._indexable_backups)
+
+    @contextmanager
+    def _locked_index(self):
+        ''' Holds the index of the golden file while it is loaded, changed and saved. The thread lock
+            keeps the threads of this process apart, the file lock other processes, e.g. the settings
+            page and the service backing up the same golden file.
+
+            Raises:
+                LockTimeout: when another process holds the index for longer than the lock timeout.
+        '''
+
+        with _index_lock:
+            with write_lock(BackupIndex(self.backup_path, self.golden_name).index_file):
+                yield
+
+    def _indexable_backups(self):
+        ''' Lists the backups on disk, used to build the index when there is none. '''
+
+        backups = self._collate_backups(self._collect_backups())
+
+        return [(fn, self._backup_timestamp(fn)) for fn in backups]
 
     def _get_now(self, last_backup):
         ''' Returns the current time as a string. If that cannot be determined,
@@ -95,7 +254,7 @@ class OpenWithBackup(object):
 
     def _collect_backups(self):
 
-        return glob(os.path.join(self.backup_path, self.golden_file) + '_backup*')
+        return glob(os.path.join(self.backup_path, self.golden_name) + '_backup*')
 
     def _collate_backups(self, backups):
 
@@ -105,14 +264,37 @@ class OpenWithBackup(object):
 
         return backups
 
-    def _drop_extras(self, backups):
-        # delete the extra backups
-        if len(backups) >= self.max_backups:
-            for fn in backups[:-self.max_backups]:
-                self._harddropbackup(fn)
+    def _backup_timestamp(self, fn):
+        ''' Returns the time a backup was taken, as seconds since the epoch, from its filename.
+            Backups named with the fallback integer rather than a date return None.
+        '''
+
+        stamp = fn[fn.rindex('_backup') + 7:]
+
+        try:
+            return time.mktime(datetime.strptime(stamp, "%Y%m%d%H%M%S").timetuple())
+        except ValueError:
+            return None
+
+    def _drop_extras(self, index):
+        # delete the backups that the retention policy does not keep
+        entries = [(x['timestamp'], x['version']) for x in index.entries]
+
+        keep, drop = self.retention.partition(entries)
+
+        for version in drop:
+            self._harddropbackup(index.filename(version))
+
+        index.remove(drop)
+
+        if drop:
+            metrics.increment('backups_pruned', len(drop))
 
     def _harddropbackup(self, fn):
 
+        # deferred, subprocess is only needed when pruning
+        import subprocess
+
         subprocess.call(['sudo', 'rm', fn])
 
     def get_latest_backup(self, backups):
@@ -120,3 +302,177 @@ class OpenWithBackup(object):
             return backups[-1]
         except IndexError:
             return None
+
+
+class BackupWorker(threading.Thread):
+    ''' Daemon thread that writes and prunes the backups handed off by OpenWithBackup. '''
+
+    def __init__(self):
+
+        super(BackupWorker, self).__init__(name='BackupWorker')
+
+        # deferred, the worker is only needed once a background backup is handed off
+        import Queue
+
+        self.daemon = True
+        self.queue = Queue.Queue()
+
+    def put(self, spool_fn, retention=None):
+
+        self.queue.put((spool_fn, retention))
+
+    def run(self):
+
+        while True:
+            spool_fn, retention = self.queue.get()
+
+            try:
+                _process_spooled_backup(spool_fn, retention)
+            except Exception:
+                # the spool file is left in place, and is retried on the next start
+                pass
+            finally:
+                self.queue.task_done()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+# serialises changes to the backup indexes within this process, see OpenWithBackup._locked_index
+_index_lock = threading.RLock()
+
+# serialises the processing of spool files between the worker and flush_pending_backups
+_spool_lock = threading.Lock()
+
+
+def _get_worker():
+
+    global _worker
+
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = BackupWorker()
+            _worker.start()
+
+    return _worker
+
+
+def _process_spooled_backup(spool_fn, retention=None):
+
+    # the lock on the pending folder keeps out the flushes of other processes, e.g. the service's on start up
+    with _spool_lock:
+        with write_lock(os.path.dirname(spool_fn)):
+
+            # another flush may have beaten us to it
+            try:
+                with open(spool_fn, 'r') as f:
+                    golden_file = f.readline().rstrip('\n')
+                    stamp = f.readline().rstrip('\n')
+                    content = f.readlines()
+            except IOError:
+                return
+
+            owb = OpenWithBackup(golden_file, retention=retention)
+            owb.tmp_content = content
+
+            # a backup that could not be stored, e.g. on a full disk, keeps its spool file to be retried
+            if not owb._create_backup(stamp):
+                return
+
+            try:
+                os.remove(spool_fn)
+            except OSError as e:
+                # already handled
+                if e.errno != errno.ENOENT:
+                    raise
+
+
+def flush_pending_backups():
+    ''' Writes any backups that were handed off but not completed before the last exit.
+        This runs on the caller's thread, and should be called once on start up.
+    '''
+
+    backup_path = os.environ['BACKUPPATH'] if 'BACKUPPATH' in os.environ else BACKUP_PATH
+
+    for spool_fn in sorted(glob(os.path.join(backup_path, PENDING_FOLDER, '*.pending'))):
+        try:
+            _process_spooled_backup(spool_fn)
+        except LockTimeout:
+            # another process is writing the pending backups, it is left to finish them
+            return
+
+
+def wait_for_backups():
+    ''' Blocks until every backup handed to the background worker has been written. '''
+
+    if _worker is not None:
+        _worker.queue.join()
+
+
+def list_backups(golden_file):
+    ''' Returns the backups of the golden file, oldest to newest, from its index.
+
+    Each backup is a dict with the version (used to restore it), the timestamp in
+    seconds since the epoch (None when unknown), the size of the content and its sha1 hash.
+    '''
+
+    owb = OpenWithBackup(golden_file)
+
+    # loading the index may rebuild and save it
+    with owb._locked_index():
+        return [dict(entry) for entry in owb._load_index().entries]
+
+
+def backup_content(golden_file, content, retention=None):
+    ''' Backs up content as a version of the golden file, for writers that replace the golden
+        file themselves, e.g. with a rename, rather than writing it through OpenWithBackup.
+    '''
+
+    owb = OpenWithBackup(golden_file, retention=retention)
+    owb.tmp_content = [content]
+    owb._create_backup()
+
+
+def restore(golden_file, version):
+    ''' Atomically replaces the golden file with the content of one of its backups.
+        The content being replaced is itself backed up, so a restore can be undone.
+
+        The golden file is write locked while it is replaced, see common.filelock.
+
+    Raises:
+        KeyError: when there is no backup with the provided version.
+        IOError: when the backup content does not match the hash in the index.
+        LockTimeout: when the golden file is locked for longer than the lock timeout.
+    '''
+
+    owb = OpenWithBackup(golden_file)
+
+    # the backup is read while the index is held, so that it cannot be pruned or replaced in between
+    with owb._locked_index():
+        index = owb._load_index()
+        entry = index.get(version)
+
+        with open(index.filename(version), 'r') as f:
+            content = f.read()
+
+        if content_hash(content) != entry['hash']:
+            raise IOError('Backup %s of %s does not match its index entry' % (version, golden_file))
+
+    tmp_file = golden_file + '.restore'
+
+    with open(tmp_file, 'w') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+
+    # the content backed up is the content replaced, no other writer can change it in between
+    with write_lock(golden_file):
+        try:
+            with open(golden_file, 'r') as f:
+                owb.tmp_content = f.readlines()
+        except IOError:
+            owb.tmp_content = None
+
+        os.rename(tmp_file, golden_file)
+
+    owb._create_backup()
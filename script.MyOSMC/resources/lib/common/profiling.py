@@ -0,0 +1,198 @@
+
+# Opt-in profiling of the slow paths of the addon.
+#
+# Profiling is switched on by setting MYOSMC_PROFILE in the environment before the addon's modules
+# are imported; 'sample' uses the sampling profiler, any other value except 0/false/off uses cProfile.
+# The SettingsService copies the preferences database key myosmc_profile into the environment, so
+# that it applies to the scripts Kodi starts after the key is set, e.g.
+#
+#     osmc_setprefs myosmc_profile sample
+#
+# Functions are marked with the profiled decorator, which returns the function itself when
+# profiling is off, so there is no cost at all unless it is on.
+#
+# Each profiled call writes a report to PROFILE_PATH, the newest PROFILE_KEEP reports are kept:
+#     .prof    cProfile stats, read with: python -m pstats <file>
+#     .folded  sampled stacks and their counts, one per line, the input format of flamegraph.pl
+
+import functools
+import itertools
+import os
+import sys
+import threading
+import time
+
+PROFILE_ENV = 'MYOSMC_PROFILE'
+PROFILE_DB_KEY = 'myosmc_profile'
+
+PROFILE_PATH = '/home/osmc/.myosmc/profiles'
+PROFILE_KEEP = 20
+
+MODES = ('cprofile', 'sample')
+
+# seconds between the samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+
+# only the outermost profiled call on a thread is profiled, the calls inside it are part of its report
+_local = threading.local()
+
+# numbers the reports of this process, so that reports written in the same second do not collide
+_report_numbers = itertools.count(1)
+
+
+def profiling_mode(value=None):
+    ''' Returns the profiler to use, 'cprofile' or 'sample', or None when profiling is off.
+
+    Arguments:
+        value (str, optional): the switch, the MYOSMC_PROFILE environment variable by default.
+    '''
+
+    value = os.environ.get(PROFILE_ENV, '') if value is None else str(value)
+    value = value.strip().lower()
+
+    if value in ('', '0', 'false', 'off', 'none'):
+        return None
+
+    return value if value in MODES else 'cprofile'
+
+
+def profile_path():
+
+    # test modules set the env variable PROFILEPATH, which is used if it is present
+    return os.environ.get('PROFILEPATH', PROFILE_PATH)
+
+
+def profiled(name):
+    ''' Decorator that profiles each call of the function when profiling is on, writing a report named
+        after name. When profiling is off the function is returned unchanged.
+    '''
+
+    mode = profiling_mode()
+
+    def decorate(func):
+
+        if mode is None:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            if getattr(_local, 'active', False):
+                return func(*args, **kwargs)
+
+            _local.active = True
+            try:
+                return _PROFILERS[mode](name, func, args, kwargs)
+            finally:
+                _local.active = False
+
+        return wrapper
+
+    return decorate
+
+
+def _run_cprofile(name, func, args, kwargs):
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        _save_report(name, 'prof', profiler.dump_stats)
+
+
+def _run_sampled(name, func, args, kwargs):
+
+    sampler = Sampler(threading.current_thread().ident)
+    sampler.start()
+
+    try:
+        return func(*args, **kwargs)
+    finally:
+        sampler.stop()
+        _save_report(name, 'folded', sampler.write)
+
+
+_PROFILERS = {'cprofile': _run_cprofile, 'sample': _run_sampled}
+
+
+class Sampler(threading.Thread):
+    ''' Samples the stack of another thread every interval, counting how often each stack is seen.
+        Much cheaper than cProfile for the profiled thread, as nothing runs on it.
+    '''
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+
+        super(Sampler, self).__init__(name='ProfileSampler')
+
+        self.daemon = True
+        self.thread_id = thread_id
+        self.interval = interval
+
+        self.counts = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+
+        while not self._stopped.wait(self.interval):
+
+            frame = sys._current_frames().get(self.thread_id)
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s:%s' % (os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+
+            if stack:
+                stack = ';'.join(reversed(stack))
+                self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    def stop(self):
+
+        self._stopped.set()
+        self.join()
+
+    def write(self, path):
+
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.counts.iteritems()):
+                f.write('%s %s\n' % (stack, count))
+
+
+def _save_report(name, extension, write):
+
+    # a report that cannot be written must not break what was being profiled
+    try:
+        folder = profile_path()
+
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        stamp = time.strftime('%Y%m%d%H%M%S')
+        path = os.path.join(folder, '%s_%s_%s_%s.%s' % (stamp, name, os.getpid(), next(_report_numbers), extension))
+
+        write(path)
+
+        rotate_reports(folder)
+
+    except (IOError, OSError):
+        pass
+
+
+def rotate_reports(folder=None, keep=None):
+    ''' Removes all but the newest keep (PROFILE_KEEP by default) reports. '''
+
+    folder = profile_path() if folder is None else folder
+    keep = PROFILE_KEEP if keep is None else keep
+
+    reports = [os.path.join(folder, x) for x in os.listdir(folder) if x.endswith(('.prof', '.folded'))]
+    reports.sort(key=os.path.getmtime)
+
+    for report in reports[:-keep] if keep else reports:
+        try:
+            os.remove(report)
+        except OSError:
+            pass
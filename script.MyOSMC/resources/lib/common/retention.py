@@ -0,0 +1,107 @@
+
+import time
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+
+class RetentionPolicy(object):
+    ''' Decides which backups of a golden file are kept and which are dropped.
+
+    The newest `keep_last` backups are always kept. Older backups are thinned
+    out by tiers; each tier is a (bucket_seconds, span_seconds) pair, and a backup
+    whose age falls inside the span of a tier is kept only if it is the oldest
+    backup in its bucket. Buckets are aligned to the epoch, so the survivor of a
+    bucket does not change as newer backups arrive. Backups older than the span
+    of the last tier are dropped, unless that span is None.
+
+    The default policy keeps the last 10 backups, one per hour for a day, one per day
+    for a month and one per week for a year; i.e. at most about 120 files, reaching
+    a full year back.
+    '''
+
+    def __init__(self, keep_last=10, tiers=None):
+
+        self.keep_last = keep_last
+
+        if tiers is None:
+            tiers = [(HOUR, DAY), (DAY, 31 * DAY), (WEEK, 52 * WEEK)]
+
+        self.tiers = sorted(tiers, key=lambda x: float('inf') if x[1] is None else x[1])
+
+    def partition(self, entries, now=None):
+        ''' Splits the backup entries into the ones to keep and the ones to drop.
+
+        Arguments:
+            entries (list): (timestamp, item) tuples, in any order. Timestamps are seconds
+                            since the epoch; a timestamp of None marks a backup of unknown age.
+            now (float, optional): the reference time, defaults to the current time.
+
+        Returns:
+            (keep, drop) lists of items, both ordered oldest to newest.
+        '''
+
+        now = time.time() if now is None else now
+
+        # oldest first, unknown ages sort as the oldest of all
+        ordered = sorted(entries, key=lambda x: -1 if x[0] is None else x[0])
+
+        protected = len(ordered) - self.keep_last
+
+        keep, drop = [], []
+        seen_buckets = set()
+
+        for position, (timestamp, item) in enumerate(ordered):
+
+            if position >= protected:
+                keep.append(item)
+                continue
+
+            bucket = self._bucket(timestamp, now)
+
+            if bucket is None or bucket in seen_buckets:
+                drop.append(item)
+            else:
+                seen_buckets.add(bucket)
+                keep.append(item)
+
+        return keep, drop
+
+    def _bucket(self, timestamp, now):
+
+        if timestamp is None:
+            return None
+
+        age = now - timestamp
+
+        for tier, (bucket_seconds, span_seconds) in enumerate(self.tiers):
+            if span_seconds is None or age < span_seconds:
+                return tier, int(timestamp // bucket_seconds)
+
+        return None
+
+
+class KeepLastPolicy(RetentionPolicy):
+    ''' Flat policy that keeps the newest `keep_last` backups and nothing else. '''
+
+    def __init__(self, keep_last=50):
+
+        super(KeepLastPolicy, self).__init__(keep_last=keep_last, tiers=[])
+
+
+DEFAULT_POLICY = RetentionPolicy()
+
+# Golden files that need a different retention policy are registered here,
+# keyed by the full path of the golden file.
+RETENTION_POLICIES = {}
+
+
+def register_policy(golden_file, policy):
+
+    RETENTION_POLICIES[golden_file] = policy
+
+
+def policy_for(golden_file):
+
+    return RETENTION_POLICIES.get(golden_file, DEFAULT_POLICY)
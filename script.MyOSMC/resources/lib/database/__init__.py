@@ -1 +1,2 @@
 from dbinterface import DBInterface
+from settings import Settings
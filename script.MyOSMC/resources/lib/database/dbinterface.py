@@ -24,36 +24,171 @@
 
 from __future__ import print_function
 
+import itertools
 import sqlite3
 import os
+import sys
 import time
 
+try:
+    from ..common.profiling import profiled
+    from ..common import metrics
+except (ImportError, ValueError):
+    # run as a script, e.g. osmc_getprefs, outside of the addon's packages
+    profiled = lambda name: lambda func: func
+
+    # the metrics module has no imports from the addon, so it is loaded from its file
+    import imp
+    metrics = imp.load_source('myosmc_metrics', os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common', 'metrics.py'))
+
 
 DATABASE_PATH = "/home/osmc/.myosmc/preferences.db"
 
+# the columns of OSMCSETTINGS that hold the value, and the type name of each in an export
+VALUE_COLUMNS = ('value_bool', 'value_int', 'value_float', 'value_str')
+EXPORT_TYPES = ('bool', 'int', 'float', 'str')
+
+# the binary export starts with this, followed by a row for each setting
+BINARY_MAGIC = 'OSMCPREFS\x01'
+
+# rows written per executemany in an import; in merge mode each batch is also committed
+IMPORT_BATCH = 10000
+
+IMPORT_MODES = ('merge', 'replace')
+EXPORT_FORMATS = ('jsonl', 'binary')
+
+# the change log keeps at most this many changes, the oldest are removed when it is compacted
+HISTORY_LIMIT = 10000
+
+# the change log is compacted once it holds this many changes over HISTORY_LIMIT, so that it is compacted in batches
+HISTORY_COMPACT_EVERY = 100
+
+# the number of changes the change log spans, read after each logged write
+HISTORY_SPAN = 'SELECT MAX(id) - MIN(id) + 1 FROM OSMCHISTORY'
+
+HISTORY_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS OSMCHISTORY (id INTEGER PRIMARY KEY AUTOINCREMENT, key VARCHAR(255),
+        old_bool INTEGER, old_int INTEGER, old_float REAL, old_str TEXT,
+        new_bool INTEGER, new_int INTEGER, new_float REAL, new_str TEXT,
+        timestamp REAL, source TEXT)''',
+    'CREATE INDEX IF NOT EXISTS OSMCHISTORY_key ON OSMCHISTORY (key, id)',
+    'CREATE INDEX IF NOT EXISTS OSMCHISTORY_timestamp ON OSMCHISTORY (timestamp)',
+]
+
+# logs the change a write is about to make, with the value it replaces; nothing is logged if the value is unchanged
+HISTORY_INSERT = '''INSERT INTO OSMCHISTORY (key, old_bool, old_int, old_float, old_str,
+        new_bool, new_int, new_float, new_str, timestamp, source)
+    SELECT ?1, s.value_bool, s.value_int, s.value_float, s.value_str, ?2, ?3, ?4, ?5, ?6, ?7
+    FROM (SELECT 1) LEFT JOIN OSMCSETTINGS s ON s.key = ?1
+    WHERE s.key IS NULL OR NOT (s.value_bool IS ?2 AND s.value_int IS ?3 AND s.value_float IS ?4 AND s.value_str IS ?5)
+'''
+
+# whether sqlite reads file: names as URIs, found on the first read only connection
+URI_FILENAMES = None
+
+# whether this process has reported that immutable connections take locks, see _connect_read_only
+_reported_immutable_locks = False
+
+HISTORY_COLUMNS = 'key, old_bool, old_int, old_float, old_str, new_bool, new_int, new_float, new_str, timestamp, source'
+
 
 class DatabaseConnection(object):
     ''' Context manager for database activity.
 
     Context managers ensure clean exiting of database interaction. The code
     in the __exit__ method always runs, even if the function throws an error.
+
+    A read only connection opens the database with mode=ro, so it cannot create the database or
+    take a write lock, and it never commits. An immutable one also takes no read locks, for
+    a database that no other process is writing. On python 2 both need a sqlite built with USE_URI;
+    without it the connection is made read only with PRAGMA query_only, and takes the usual locks.
     '''
 
-    def __init__(self, dbpath, *args, **kwargs):
+    def __init__(self, dbpath, read_only=False, immutable=False, *args, **kwargs):
         self.dbpath = dbpath
+        self.read_only = read_only or immutable
+        self.immutable = immutable
         self.con = None
 
     def __enter__(self, *args, **kwargs):
 
-        self.con = sqlite3.connect(self.dbpath, timeout=1)
+        if self.read_only:
+            self.con = _connect_read_only(self.dbpath, self.immutable)
+        else:
+            self.con = sqlite3.connect(self.dbpath, timeout=1)
 
         return self.con.cursor()
 
-    def __exit__(self, *args):
-        self.con.commit()
+    def __exit__(self, exc_type, *args):
+        # a failure part way through a transaction leaves the database as it was
+        if self.read_only:
+            pass
+        elif exc_type is None:
+            self.con.commit()
+        else:
+            self.con.rollback()
         self.con.close()
 
 
+def _uri_filenames():
+
+    # python 2 has no uri argument, a file: name is only read as a URI if sqlite was built with USE_URI
+    global URI_FILENAMES
+
+    if URI_FILENAMES is None:
+        con = sqlite3.connect(':memory:')
+        try:
+            URI_FILENAMES = 'USE_URI' in [x[0] for x in con.execute('PRAGMA compile_options')]
+        finally:
+            con.close()
+
+    return URI_FILENAMES
+
+
+def _connect_read_only(dbpath, immutable=False):
+
+    if not os.path.isfile(dbpath):
+        # mode=ro would refuse to create it too, this only saves opening it
+        raise sqlite3.OperationalError('unable to open database file')
+
+    try:
+        import urllib
+        quote = urllib.quote
+    except AttributeError:
+        from urllib.parse import quote
+
+    uri = 'file:%s?%s' % (quote(os.path.abspath(dbpath)), 'immutable=1' if immutable else 'mode=ro')
+
+    if sys.version_info[0] >= 3:
+        return sqlite3.connect(uri, timeout=1, uri=True)
+
+    if _uri_filenames():
+        return sqlite3.connect(uri, timeout=1)
+
+    # without URIs the database is opened as usual, and the connection refuses to write
+    con = sqlite3.connect(dbpath, timeout=1)
+    con.execute('PRAGMA query_only = 1')
+
+    if immutable:
+        _report_immutable_locks()
+
+    return con
+
+
+def _report_immutable_locks():
+
+    # immutable=1 is a URI parameter, without URIs the connection takes the usual read locks; the report goes
+    # to stderr, as the output of osmc_getprefs is read by scripts
+    global _reported_immutable_locks
+
+    metrics.increment('db_immutable_fallbacks')
+
+    if not _reported_immutable_locks:
+        _reported_immutable_locks = True
+        print('sqlite was built without USE_URI, the database is opened read only but with its locks', file=sys.stderr)
+
+
 class DBInterface(object):
     ''' Python Interface for the OSMC settings database.
 
@@ -64,32 +199,67 @@ class DBInterface(object):
 
     Keys are intended to be unique across all the standard tables.
 
+    Changes can be kept in an append-only change log, see enable_history. Once the log has been
+    enabled for a database, every DBInterface writing to it logs its changes.
+
     Attributes:
         errors: list of errors encountered during default import.
+        source: recorded in the change log with each change, the name of the running program by default.
+
+    A read only DBInterface, for processes that only look settings up, such as osmc_getprefs, opens the
+    database read only: it never creates the database or its tables, and never takes a write lock, so
+    it cannot hold up the processes writing to it.
 
     Raises:
         sqlite3.OperationalError: when the database is locked and unable to execute an action within 2.5 seconds.
     '''
 
-    def __init__(self, preload=None):
+    def __init__(self, preload=None, history=False, source=None, read_only=False, immutable=False):
         ''' The __init__ method checks for the existence of the database file. If
         the database is not found, a new file is created. The new database is pre-loaded with
         the default values of certain vital OSMC settings.
 
         Arguments:
             preload (dict): a dictionary containing the default values for a number of settings.
+            history (bool): enables the change log for the database, see enable_history.
+            source (str, optional): recorded in the change log with each change.
+            read_only (bool): opens the database read only; writes raise sqlite3.OperationalError.
+            immutable (bool): opens it read only and without locks, for a database that is not being written.
+                The locks are only skipped where sqlite reads URI filenames, see DatabaseConnection.
 
         Raises:
             AttributeError: when the preload argument is not a valid dictionary.
+            ValueError: when a read only DBInterface is given a preload or asked for history.
+            sqlite3.OperationalError: when a read only DBInterface is opened on a database that does not exist.
         '''
         self.errors = []
 
         # test modules set the env variable DBPATH, which is used if it is present
         self.dbpath = os.environ['DBPATH'] if 'DBPATH' in os.environ else DATABASE_PATH
 
-        if not self._check_schema():
+        self.read_only = read_only or immutable
+        self.immutable = immutable
+
+        if self.read_only:
+            if preload is not None or history:
+                raise ValueError('a read only database cannot be preloaded or have its history enabled')
+
+            if not os.path.isfile(self.dbpath):
+                raise sqlite3.OperationalError('unable to open database file')
+
+        elif not self._check_schema():
             self._create_schema()
 
+        self.source = os.path.basename(sys.argv[0]) if source is None else source
+
+        if history:
+            self.enable_history()
+        elif self.read_only:
+            # nothing is written, so nothing is logged
+            self.history_enabled = False
+        else:
+            self.history_enabled = self._check_history()
+
         self.preload = preload
 
         if preload is not None:
@@ -104,6 +274,7 @@ class DBInterface(object):
             except AttributeError:
                 raise AttributeError('preload not a dictionary')
 
+    @profiled('DBInterface.getsetting')
     def getsetting(self, key):
         ''' Retrieves the data associated with the key in the OSMC database.
 
@@ -126,6 +297,7 @@ class DBInterface(object):
 
         return self._fetch(key)
 
+    @profiled('DBInterface.setsetting')
     def setsetting(self, key, value, datatype=None):
         ''' Stores a single key:value pair in the OSMC database.
 
@@ -170,6 +342,7 @@ class DBInterface(object):
         else:
             return self._fling(key, None, None, None, str(value))
 
+    @profiled('DBInterface.all_pairs')
     def all_pairs(self):
         ''' Returns all the data stored in the database, as a python dictionary.'''
 
@@ -180,6 +353,197 @@ class DBInterface(object):
 
         return dict(r)
 
+    @profiled('DBInterface.export')
+    def export(self, stream, format='jsonl'):
+        ''' Writes every setting to the stream, one row at a time, so that memory use does not grow
+        with the size of the database.
+
+        Each row holds the key, the type and the value as stored. With the jsonl format each row is a
+        line of JSON, ["key", "int", 5]. The binary format is more compact, see _write_binary_row.
+
+        Arguments:
+            stream (file): opened for writing, in binary mode for the binary format.
+            format (str): 'jsonl' or 'binary'.
+
+        Returns:
+            the number of settings written.
+        '''
+
+        if format not in EXPORT_FORMATS:
+            raise ValueError('Unknown export format: %s' % format)
+
+        if format == 'jsonl':
+            import json
+            write_row = lambda key, typ, value: stream.write(json.dumps([key, typ, value]) + '\n')
+        else:
+            stream.write(BINARY_MAGIC)
+            write_row = lambda key, typ, value: self._write_binary_row(stream, key, typ, value)
+
+        count = 0
+
+        # the cursor is iterated rather than fetched, so only one row is held at a time
+        with DatabaseConnection(self.dbpath, self.read_only, self.immutable) as con:
+            for row in con.execute('SELECT key, %s FROM OSMCSETTINGS ORDER BY key' % ', '.join(VALUE_COLUMNS)):
+                typ, value = self._typed_value(row)
+                write_row(row[0], typ, value)
+                count += 1
+
+        return count
+
+    @profiled('DBInterface.import_')
+    def import_(self, stream, mode='merge', format='jsonl'):
+        ''' Reads settings written by export from the stream, and stores them.
+
+        Arguments:
+            stream (file): opened for reading, in binary mode for the binary format.
+            mode (str): 'merge' keeps the settings that are not in the stream, and commits every IMPORT_BATCH rows.
+                        'replace' removes them, in a single transaction, so the database is untouched if the import fails.
+            format (str): 'jsonl' or 'binary'.
+
+        Returns:
+            the number of settings read.
+
+        Raises:
+            ValueError: when the stream is not a valid export, or the mode or format are unknown.
+            sqlite3.OperationalError: when the database is locked, or read only.
+        '''
+
+        if self.read_only:
+            raise sqlite3.OperationalError('attempt to write a readonly database')
+
+        if mode not in IMPORT_MODES:
+            raise ValueError('Unknown import mode: %s' % mode)
+
+        if format not in EXPORT_FORMATS:
+            raise ValueError('Unknown export format: %s' % format)
+
+        rows = self._read_jsonl_rows(stream) if format == 'jsonl' else self._read_binary_rows(stream)
+
+        q = 'INSERT OR REPLACE INTO OSMCSETTINGS (key, %s) VALUES (?,?,?,?,?)' % ', '.join(VALUE_COLUMNS)
+
+        count = 0
+
+        con = sqlite3.connect(self.dbpath, timeout=1)
+
+        try:
+            if mode == 'replace':
+                con.execute('DELETE FROM OSMCSETTINGS')
+
+            while True:
+                batch = [self._column_values(key, typ, value) for key, typ, value in itertools.islice(rows, IMPORT_BATCH)]
+
+                if not batch:
+                    break
+
+                con.executemany(q, batch)
+                count += len(batch)
+
+                if mode == 'merge':
+                    con.commit()
+
+            con.commit()
+
+        except Exception:
+            con.rollback()
+            raise
+
+        finally:
+            con.close()
+
+        return count
+
+    def _typed_value(self, row):
+
+        for typ, value in zip(EXPORT_TYPES, row[1:5]):
+            if value is not None:
+                return typ, bool(value) if typ == 'bool' else value
+
+        return 'str', None
+
+    def _column_values(self, key, typ, value):
+
+        try:
+            column = EXPORT_TYPES.index(typ)
+        except ValueError:
+            raise ValueError('Unknown type %r for key %r' % (typ, key))
+
+        # None is stored as the string 'None', as setsetting stores it; a row of NULLs has no value to read back
+        if value is None:
+            column, value = EXPORT_TYPES.index('str'), 'None'
+
+        values = [None, None, None, None]
+        values[column] = value
+
+        return [key.lower()] + values
+
+    def _read_jsonl_rows(self, stream):
+
+        import json
+
+        for number, line in enumerate(stream, 1):
+
+            if not line.strip():
+                continue
+
+            try:
+                key, typ, value = json.loads(line)
+            except (TypeError, ValueError):
+                raise ValueError('Line %s is not a valid export row' % number)
+
+            if not isinstance(key, basestring):
+                raise ValueError('Line %s has a key that is not a string' % number)
+
+            yield key, typ, value
+
+    def _write_binary_row(self, stream, key, typ, value):
+        ''' Writes the type as one byte, then the key and the value. Strings are utf-8 with a length
+            prefix, integers are 8 bytes, floats are doubles and booleans one byte.
+        '''
+
+        import struct
+
+        code = typ[0]
+        key = key.encode('utf-8')
+
+        if code == 's':
+            value = (u'None' if value is None else value).encode('utf-8')
+            stream.write(struct.pack('<cH%ssI%ss' % (len(key), len(value)), code, len(key), key, len(value), value))
+        else:
+            fmt = {'b': '?', 'i': 'q', 'f': 'd'}[code]
+            stream.write(struct.pack('<cH%ss%s' % (len(key), fmt), code, len(key), key, value))
+
+    def _read_binary_rows(self, stream):
+
+        import struct
+
+        def read(size):
+            data = stream.read(size)
+            if len(data) != size:
+                raise ValueError('Binary export is truncated')
+            return data
+
+        if stream.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError('Not a binary export')
+
+        key_length = struct.Struct('<H')
+        str_length = struct.Struct('<I')
+        types = {'b': ('bool', struct.Struct('<?')), 'i': ('int', struct.Struct('<q')), 'f': ('float', struct.Struct('<d'))}
+
+        while True:
+            code = stream.read(1)
+            if not code:
+                return
+
+            key = read(key_length.unpack(read(2))[0]).decode('utf-8')
+
+            if code == 's':
+                yield key, 'str', read(str_length.unpack(read(4))[0]).decode('utf-8')
+            elif code in types:
+                typ, fmt = types[code]
+                yield key, typ, fmt.unpack(read(fmt.size))[0]
+            else:
+                raise ValueError('Unknown type %r in binary export' % code)
+
     def _extract_value(self, result_tuple):
 
         r = [(i, v) for i, v in enumerate(result_tuple[0])][1:5]
@@ -214,8 +578,99 @@ class DBInterface(object):
         q = '''INSERT OR REPLACE INTO OSMCSETTINGS (key, value_bool, value_int, value_float, value_str) VALUES (?,?,?,?,?)
             '''
         args = (key, value_bool, value_int, value_float, value_str,)
-        r = self._database_execution(q, args)
-        return r
+
+        if not self.history_enabled:
+            return self._database_execution(q, args)
+
+        # the change is logged in the same transaction as the write
+        history_args = args + (time.time(), self.source)
+        rows = self._database_transaction([(HISTORY_INSERT, history_args), (q, args), (HISTORY_SPAN, [])])
+
+        # the size of the change log comes from the database, so that writers that only make a few changes,
+        # e.g. osmc_setprefs, compact it as well as long running ones
+        span = rows[-1][0][0]
+        if span is not None and span >= HISTORY_LIMIT + HISTORY_COMPACT_EVERY:
+            self.compact_history()
+
+        return rows[1]
+
+    def enable_history(self):
+        ''' Creates the change log, from then on every change to a setting is logged with the value
+            it replaced, the time and the source of the change. Settings written by import_ are not logged.
+        '''
+
+        self._database_transaction([(q, []) for q in HISTORY_SCHEMA])
+
+        self.history_enabled = True
+
+    def _check_history(self):
+
+        q = "SELECT name FROM sqlite_master WHERE type='table' AND name='OSMCHISTORY'"
+
+        return bool(self._database_execution(q, []))
+
+    def compact_history(self, limit=None):
+        ''' Removes the oldest changes from the change log, keeping at most limit (HISTORY_LIMIT by default). '''
+
+        limit = HISTORY_LIMIT if limit is None else limit
+
+        q = 'DELETE FROM OSMCHISTORY WHERE id <= (SELECT MAX(id) FROM OSMCHISTORY) - ?'
+        self._database_execution(q, [limit])
+
+    def history(self, key, limit=None):
+        ''' Returns the logged changes to the setting, oldest first.
+
+        Arguments:
+            key (str): the setting.
+            limit (int, optional): return only the most recent changes.
+
+        Returns:
+            list of dicts with the key, old and new values (None where there was no value), timestamp and source.
+        '''
+
+        q = 'SELECT %s FROM OSMCHISTORY WHERE key=? ORDER BY id DESC LIMIT ?' % HISTORY_COLUMNS
+        r = self._database_execution(q, [key.lower(), -1 if limit is None else limit])
+
+        return [self._history_entry(row) for row in reversed(r)]
+
+    def as_of(self, timestamp):
+        ''' Returns all the settings as they were at the time, as a python dictionary.
+
+        Each setting changed since then has the value it had before its first change after the time.
+
+        Raises:
+            ValueError: when the change log does not go back to the time, as it has been compacted.
+        '''
+
+        # the oldest change kept, the ids are never reused so a first id above 1 means the log has been compacted
+        q = 'SELECT id, timestamp FROM OSMCHISTORY ORDER BY id LIMIT 1'
+        r = self._database_execution(q, [])
+
+        if r and r[0][0] > 1 and timestamp < r[0][1]:
+            raise ValueError('The change log only goes back to %s' % r[0][1])
+
+        settings = self.all_pairs()
+
+        # +key stops sqlite grouping by walking the whole key index, so only the changes after the time are read
+        q = '''SELECT %s FROM OSMCHISTORY WHERE id IN
+            (SELECT MIN(id) FROM OSMCHISTORY WHERE timestamp > ? GROUP BY +key)''' % HISTORY_COLUMNS
+
+        for row in self._database_execution(q, [timestamp]):
+
+            if all(x is None for x in row[1:5]):
+                # the setting did not exist yet
+                settings.pop(row[0], None)
+            else:
+                settings[row[0]] = self._extract_value([row[0:5]])
+
+        return settings
+
+    def _history_entry(self, row):
+
+        old = None if all(x is None for x in row[1:5]) else self._extract_value([row[0:5]])
+        new = self._extract_value([(row[0],) + tuple(row[5:9])])
+
+        return {'key': row[0], 'old': old, 'new': new, 'timestamp': row[9], 'source': row[10]}
 
     def _check_schema(self):
 
@@ -237,16 +692,35 @@ class DBInterface(object):
 
     def _database_execution(self, action, args):
 
+        return self._database_transaction([(action, args)])[-1]
+
+    def _database_transaction(self, statements):
+        ''' Executes the (action, args) statements in one transaction, returning the rows from each. '''
+
         # If the database is locked, retry for 2.5 seconds before throwing an error.
         max_time = 0
         while max_time < 25:
             try:
-                with DatabaseConnection(self.dbpath) as con:
-                    return con.execute(action, args).fetchall()
-
-            except sqlite3.OperationalError:
+                with DatabaseConnection(self.dbpath, self.read_only, self.immutable) as con:
+                    rows = [con.execute(action, args).fetchall() for action, args in statements]
+
+            except sqlite3.OperationalError as e:
+                # a read only connection will not be allowed to write however long it waits
+                if self.read_only and 'readonly' in str(e):
+                    raise
+                if not max_time:
+                    started = time.time()
                 max_time += 1
+                metrics.increment('db_lock_retries')
                 time.sleep(0.1)
 
+            else:
+                # only contended transactions are recorded, an uncontended one costs nothing extra
+                if max_time:
+                    metrics.observe('db_lock_wait_seconds', time.time() - started)
+                return rows
+
         else:
+            metrics.increment('db_lock_failures')
+            metrics.observe('db_lock_wait_seconds', time.time() - started)
             raise sqlite3.OperationalError
@@ -1,9 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import sqlite3
 import sys
 
-from dbinterface import DBInterface
+from dbinterface import DBInterface, metrics
+from settings import Settings
+
+GETPREFS_USAGE = '''Usage: osmc_getprefs [--immutable] [key | --metrics | --help]
+
+  With no key, lists every setting in the preferences database.
+  With a key, prints its value. A key that is not in the database prints its default for
+  the hardware, or "KeyError: Key not found in database" when it has no default either.
+
+  --immutable  reads the database without taking its locks, for when nothing is writing to it
+  --metrics    prints the metrics recorded by the addon
+'''
 
 
 def _get_all_settings(db):
@@ -22,19 +34,54 @@ def _get_all_settings(db):
 
 def _get_setting(key, db):
 
-    try:
-        return db.getsetting(key)
-    except KeyError:
+    # a setting that is not in the database answers with its default for the hardware, see GETPREFS_USAGE
+    missing = object()
+
+    value = Settings(db).get(key, missing)
+
+    if value is missing:
         return "KeyError: Key not found in database"
 
+    return value
+
+
+def _reader(immutable=False):
+
+    # looking settings up never takes a write lock, a database that does not exist yet is created as before
+    try:
+        return DBInterface(read_only=True, immutable=immutable)
+    except sqlite3.OperationalError:
+        return DBInterface()
+
+
+def _get_metrics():
+
+    # what this process has recorded is added first, so that the totals are up to date
+    totals = metrics.flush()
+
+    return metrics.format_metrics(metrics.load() if totals is None else totals)
+
 
 def osmcprefs(whodat, key=None, value=None, *args):
 
-    db = DBInterface()
     whodat = whodat.lower()
 
     if whodat.endswith('osmc_getprefs'):
 
+        # --immutable skips the database locks, for when nothing is writing to it, e.g. at boot; where
+        # sqlite was built without USE_URI the locks are taken anyway, and a warning is printed to stderr
+        immutable = key == '--immutable'
+        if immutable:
+            key = value
+
+        if key == '--help':
+            return GETPREFS_USAGE
+
+        if key == '--metrics':
+            return '\n'.join(_get_metrics())
+
+        db = _reader(immutable)
+
         if key is None:
             return '\n'.join(_get_all_settings(db=db))
 
@@ -43,6 +90,8 @@ def osmcprefs(whodat, key=None, value=None, *args):
 
     elif whodat.endswith('osmc_setprefs'):
 
+        db = DBInterface()
+
         if key is None or value is None:
             return 'Error, no params provided\Example: osmc_setprefs key value'
 
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+from dbinterface import DBInterface
+
+try:
+    from ..common.defaults import DefaultsResolver
+except (ImportError, ValueError):
+    # run as a script, e.g. osmc_getprefs, outside of the addon's packages
+    import imp
+
+    # the defaults import only hardwareversion, which has no imports from the addon, so both are
+    # loaded from their files, hardwareversion under the name the defaults import it by
+    common = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common')
+    imp.load_source('hardwareversion', os.path.join(common, 'hardwareversion.py'))
+    DefaultsResolver = imp.load_source('myosmc_defaults', os.path.join(common, 'defaults.py')).DefaultsResolver
+
+# the tiers a setting can be answered from, in the order they are tried
+TIERS = ('memory', 'db', 'defaults', 'missing')
+
+
+class Settings(DefaultsResolver):
+    ''' One place to read settings from, instead of a try/except KeyError around
+    DBInterface.getsetting and a fall back to the defaults.
+
+    A DefaultsResolver that reads the database one key at a time rather than all at once,
+    for callers that only look a few settings up. A setting is answered from the first tier that has it:
+        memory:   values already read from the database.
+        db:       the preferences database, whose values are then kept in memory.
+        defaults: the defaults for the hardware, see common.defaults.flat_defaults.
+
+    Keys that are not in the database are remembered, so after the first miss a
+    setting that only has a default is answered without querying the database.
+    preload() reads the whole database at once, as the DefaultsResolver does.
+
+    The memory tier is not told about writes made by other processes, e.g. osmc_setprefs;
+    call refresh() when the database has changed.
+
+    Attributes:
+        hits: the number of lookups answered by each tier, 'missing' counts the lookups no tier answered.
+    '''
+
+    def __init__(self, db=None, hardware_id=None, defaults=None):
+        '''
+        Arguments:
+            db (DBInterface, optional): the preferences database, a new DBInterface by default.
+            hardware_id (str, optional): the hardware overlay of the defaults, defaults to the detected hardware.
+            defaults (mapping, optional): the defaults to use instead of flat_defaults(hardware_id).
+        '''
+
+        super(Settings, self).__init__(DBInterface() if db is None else db, hardware_id, defaults)
+
+        self._memory = {}
+        self._not_in_db = set()
+
+        self.hits = dict((tier, 0) for tier in TIERS)
+
+    def _preloaded(self):
+
+        # the values of the DefaultsResolver are only read by preload()
+        return self._user is not None
+
+    def get(self, key, default=None):
+        ''' Returns the value of the setting, or default when no tier has it. '''
+
+        # the database stores its keys in lowercase
+        db_key = key.lower()
+
+        try:
+            value = self._memory[db_key]
+        except KeyError:
+            pass
+        else:
+            self.hits['memory'] += 1
+            return value
+
+        if not self._preloaded() and db_key not in self._not_in_db:
+            try:
+                value = self.db.getsetting(db_key)
+            except KeyError:
+                self._not_in_db.add(db_key)
+            else:
+                self._memory[db_key] = value
+                self.hits['db'] += 1
+                return value
+
+        try:
+            value = self.defaults[key]
+        except KeyError:
+            self.hits['missing'] += 1
+            return default
+
+        self.hits['defaults'] += 1
+        return value
+
+    def set(self, key, value, datatype=None):
+        ''' Stores the setting in the database; see DBInterface.setsetting. '''
+
+        self.db.setsetting(key, value, datatype)
+
+        db_key = key.lower()
+        self._not_in_db.discard(db_key)
+
+        # the value is read back, so that it has the type the database returns
+        if self._preloaded():
+            self._memory[db_key] = self.db.getsetting(db_key)
+        else:
+            self._memory.pop(db_key, None)
+
+    def preload(self):
+        ''' Reads every setting in the database into memory with one query. Until the next
+            refresh(), keys that are not in memory go straight to the defaults.
+        '''
+
+        self.refresh()
+        self._memory = self._user_values()
+
+    def refresh(self):
+        ''' Forgets everything read from the database. '''
+
+        super(Settings, self).refresh()
+
+        self._memory = {}
+        self._not_in_db.clear()
+
+    invalidate = refresh
+
+    def hit_ratios(self):
+        ''' Returns the fraction of lookups answered by each tier. '''
+
+        total = sum(self.hits.values())
+
+        return dict((tier, float(count) / total if total else 0.0) for tier, count in self.hits.iteritems())
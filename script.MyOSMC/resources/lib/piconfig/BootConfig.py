@@ -0,0 +1,539 @@
+import operator
+import os
+import re
+
+from ConfigFileInterface import ConfigFileInterface, ConfigChanged, NOT_SETTINGS
+from ..common import metrics
+from ..common.filelock import read_lock, write_lock
+
+BOOT_FOLDER = '/boot'
+
+CONFIG_TXT = 'config.txt'
+CMDLINE_TXT = 'cmdline.txt'
+
+# the parameters of the cmdline.txt are named with this prefix in the merged view, e.g. cmdline.root
+CMDLINE_PREFIX = 'cmdline.'
+
+# the number of threads reading the files
+READ_THREADS = 4
+
+# lists the files of a group commit while they are being replaced, see BootConfig.commit
+JOURNAL_NAME = '.bootconfig.journal'
+
+# the new content of a file is written next to it, with this suffix, before it replaces the file
+NEW_SUFFIX = '.new'
+
+# an include line of the config.txt, the file named is relative to the boot partition
+INCLUDE_PATTERN = re.compile(r'^include\s+(\S+)', re.IGNORECASE)
+
+
+class ConfigFile(object):
+	''' A boot file in the format of the config.txt, i.e. the config.txt and the files it includes. '''
+
+	def __init__(self, path, folder):
+
+		self.path = path
+		self.folder = folder
+
+		self.interface = ConfigFileInterface(path)
+
+		self.exists = False
+		self.text = ''
+		self.doc = []
+
+	def read(self):
+
+		try:
+			self.doc = self.interface.read_config_txt()
+			self.exists = True
+		except IOError:
+			# the firmware skips a missing file, it is created when a setting is written to it
+			self.doc = self.interface.parse_config_lines([])
+			self.exists = False
+
+		# the doc runs from the bottom of the file up, and ends with the settings that are not in the file
+		self.text = ''.join(x['original'] for x in reversed(self.doc) if x['original'] != 'NULL')
+
+		return self
+
+	def entries(self):
+		''' Yields the settings, as ('setting', name, value), and the includes, as ('include', path),
+			from the top of the file down, which is the order the firmware reads them.
+		'''
+
+		for config_line in reversed(self.doc):
+
+			if config_line['original'] == 'NULL':
+				continue
+
+			setting = config_line['setting']
+
+			if setting.name == 'passthrough':
+				included = INCLUDE_PATTERN.match(config_line['clean'])
+				if included:
+					yield 'include', os.path.normpath(os.path.join(self.folder, included.group(1)))
+
+			elif setting.name not in NOT_SETTINGS:
+				yield 'setting', setting.name, setting.current_config_value
+
+	def includes(self):
+
+		return [entry[1] for entry in self.entries() if entry[0] == 'include']
+
+	def defaults(self):
+		''' Returns the values of the settings that are not in the file. '''
+
+		return dict((x['setting'].name, x['setting'].current_config_value) for x in self.doc if x['original'] == 'NULL')
+
+	def names(self):
+
+		return set(self.doc.lines)
+
+	def render(self, changes):
+		''' Returns the content of the file with the changes, {name: value}, made. '''
+
+		self.interface.update_settings(self.doc, changes)
+
+		if not self.doc.dirty:
+			return self.text
+
+		return ''.join(self.interface.render_config_txt(self.doc))
+
+
+class CmdlineFile(object):
+	''' The cmdline.txt, the kernel command line: one line of parameters separated by spaces.
+		A parameter is either key=value, or a flag, which has the value None in the merged view.
+	'''
+
+	def __init__(self, path):
+
+		self.path = path
+
+		self.exists = False
+		self.text = ''
+		self.params = []
+		self.errors = []
+
+	def read(self):
+
+		try:
+			with read_lock(self.path):
+				with open(self.path, 'r') as f:
+					self.text = f.read()
+			self.exists = True
+		except IOError:
+			self.text = ''
+			self.exists = False
+
+		lines = [x for x in self.text.splitlines() if x.strip()]
+
+		self.params = lines[0].split() if lines else []
+
+		# the firmware only passes the first line to the kernel
+		self.errors = ['%s has more than one line, only the first is used' % self.path] if len(lines) > 1 else []
+
+		return self
+
+	def includes(self):
+
+		return []
+
+	def settings(self):
+
+		return dict((CMDLINE_PREFIX + key, value) for key, value in (self._split(x) for x in self.params))
+
+	def _split(self, param):
+
+		key, equals, value = param.partition('=')
+
+		return key, value if equals else None
+
+	def render(self, changes):
+		''' Returns the content of the file with the changes, {name: value}, made.
+			A value of None sets a flag, and False removes the parameter.
+		'''
+
+		params = list(self.params)
+		keys = [self._split(x)[0] for x in params]
+
+		for name, value in sorted(changes.iteritems()):
+			key = name[len(CMDLINE_PREFIX):]
+
+			if value is False:
+				param = None
+			elif value is None:
+				param = key
+			else:
+				param = '%s=%s' % (key, value)
+
+			if key not in keys:
+				if param is not None:
+					params.append(param)
+					keys.append(key)
+				continue
+
+			index = keys.index(key)
+
+			if param is None:
+				del params[index]
+				del keys[index]
+			else:
+				params[index] = param
+
+		# an unchanged command line is returned as it was read, with its spacing
+		if params == self.params:
+			return self.text
+
+		return ' '.join(params) + '\n'
+
+
+class BootConfig(object):
+	''' The boot files of the device, managed as one group: the config.txt, the files it includes,
+	any vendor include files and the cmdline.txt.
+
+	The files are read and validated concurrently, and presented as one merged view of the settings, in
+	which a setting has the value the firmware would see. A write changes each setting in the file that
+	holds it, only the files whose content changes are written, and they are replaced together; after a
+	crash either all of them or none of them have changed. A write locks the files, see common.filelock, and
+	is refused with ConfigChanged if another process has changed any of them since they were read.
+
+	Attributes:
+		settings: the merged view, {name: value}; the parameters of the cmdline.txt are named cmdline.<key>.
+		sources: the file that holds each setting in the merged view, settings at their defaults have none.
+		errors: the problems found when the files were last read.
+	'''
+
+	def __init__(self, folder=BOOT_FOLDER, includes=None, threads=READ_THREADS, backups=False):
+		'''
+		Arguments:
+			folder (str): the boot partition.
+			includes (list, optional): vendor include files, relative to folder, managed even if the config.txt does not include them.
+			threads (int): the number of threads reading the files.
+			backups (bool): whether the content a write replaces is backed up, see common.openwithbackup.
+		'''
+
+		self.folder = folder
+		self.threads = threads
+		self.backups = backups
+
+		self.config_path = self._path(CONFIG_TXT)
+		self.cmdline_path = self._path(CMDLINE_TXT)
+		self.includes = [self._path(x) for x in includes or []]
+
+		self.files = {}
+		self.settings = {}
+		self.sources = {}
+		self.errors = []
+
+	def _path(self, name):
+
+		return os.path.normpath(os.path.join(self.folder, name))
+
+	def _journal_path(self):
+
+		return self._path(JOURNAL_NAME)
+
+	@metrics.timed('boot_read_seconds')
+	def read(self):
+		''' Reads and validates every file of the group, returning the merged view of the settings. '''
+
+		journal = self._journal_path()
+
+		# the shared lock on the journal is held while the files are read, so that no commit lands
+		# between the reads of two of them
+		journal_lock = read_lock(journal)
+		journal_lock.acquire()
+
+		try:
+			# a commit that was interrupted is finished before anything is read, which takes the
+			# exclusive lock, so the shared one is let go for it
+			while os.path.exists(journal):
+				journal_lock.release()
+				self.recover()
+				journal_lock.acquire()
+
+			self._discard_new()
+
+			self._read_files()
+
+		finally:
+			journal_lock.release()
+
+		self._merge()
+
+		return self.settings
+
+	def _read_files(self):
+
+		# deferred, the pool is only needed when the files are read
+		from multiprocessing.pool import ThreadPool
+
+		pool = ThreadPool(self.threads)
+
+		try:
+			files = {}
+			pending = [ConfigFile(self.config_path, self.folder), CmdlineFile(self.cmdline_path)]
+			pending.extend(ConfigFile(x, self.folder) for x in self.includes)
+
+			while pending:
+
+				for fyle in pool.map(operator.methodcaller('read'), pending):
+					files[fyle.path] = fyle
+
+				# the files included by those just read are read next
+				included = set(x for fyle in pending for x in fyle.includes())
+				pending = [ConfigFile(x, self.folder) for x in sorted(included) if x not in files]
+
+		finally:
+			pool.close()
+			pool.join()
+
+		self.files = files
+
+	def _merge(self):
+
+		config = self.files[self.config_path]
+
+		self.settings = config.defaults()
+		self.sources = {}
+		self.errors = []
+
+		visited = set()
+
+		self._walk(self.config_path, visited)
+
+		# vendor includes the config.txt does not include come after everything it does
+		for path in self.includes:
+			self._walk(path, visited)
+
+		cmdline = self.files[self.cmdline_path]
+
+		for name, value in cmdline.settings().iteritems():
+			self.settings[name] = value
+			self.sources[name] = self.cmdline_path
+
+		self.errors.extend(cmdline.errors)
+
+	def _walk(self, path, visited):
+
+		# a file included more than once is only read the first time, which also stops include loops
+		if path in visited:
+			return
+
+		visited.add(path)
+
+		fyle = self.files[path]
+
+		if not fyle.exists:
+			self.errors.append('%s does not exist' % path)
+
+		for entry in fyle.entries():
+
+			if entry[0] == 'include':
+				self._walk(entry[1], visited)
+			else:
+				self.settings[entry[1]] = entry[2]
+				self.sources[entry[1]] = path
+
+	def write(self, new_settings):
+		''' Changes the settings, {name: value}, each in the file that holds it, and commits the files
+			whose content changes as one group. Settings that no file holds are added to the config.txt.
+
+			Returns the paths of the files written.
+
+			Raises:
+				KeyError: for a name that is neither a setting of the config.txt nor a cmdline.txt parameter;
+					nothing is written.
+				ConfigChanged: when another process has changed one of the files; nothing is written. The
+					files are read again, so writing the same settings again makes them on top of those changes.
+		'''
+
+		known = self.files[self.config_path].names()
+
+		changes = {}
+
+		for name, value in new_settings.iteritems():
+
+			if name.startswith(CMDLINE_PREFIX):
+				path = self.cmdline_path
+			elif name in known:
+				path = self.sources.get(name, self.config_path)
+			else:
+				raise KeyError(name)
+
+			changes.setdefault(path, {})[name] = value
+
+		try:
+			contents = {}
+
+			for path, file_changes in changes.iteritems():
+				fyle = self.files[path]
+				text = fyle.render(file_changes)
+
+				if text != fyle.text:
+					contents[path] = text
+
+			if contents:
+				self.commit(contents)
+
+		finally:
+			# the changed files are read again, so that the view is of what is on disk
+			for path in changes:
+				self.files[path].read()
+
+			self._merge()
+
+		return sorted(contents)
+
+	@metrics.timed('boot_commit_seconds')
+	def commit(self, contents):
+		''' Replaces the files with the new contents, {path: text}, as one group.
+
+		Each new content is written and synced next to its file first. Then the journal, which lists
+		the files, is written; that is the point the group is committed. Then the files are renamed
+		into place and the journal removed. recover() finishes the renames of a commit that was
+		interrupted after its journal was written, and discards the new contents of one that was not.
+
+		The journal and the files are locked for the commit, always in that order so that two commits
+		cannot each hold a lock the other waits for, and each file must still be as it was read.
+		'''
+
+		paths = sorted(contents)
+
+		locks = [write_lock(self._journal_path())] + [write_lock(x) for x in paths]
+
+		try:
+			for lock in locks:
+				lock.acquire()
+
+			for path in paths:
+				self._check_unchanged(path)
+
+			self._commit(paths, contents)
+
+		finally:
+			for lock in reversed(locks):
+				lock.release()
+
+	def _check_unchanged(self, path):
+
+		# a file the group has not read has nothing to compare with
+		fyle = self.files.get(path)
+		if fyle is None:
+			return
+
+		try:
+			with open(path, 'r') as f:
+				current = f.read()
+		except IOError:
+			current = ''
+
+		if current != fyle.text:
+			metrics.increment('config_write_conflicts')
+			raise ConfigChanged(path, current)
+
+	def _commit(self, paths, contents):
+
+		for path in paths:
+			_write_synced(path + NEW_SUFFIX, contents[path])
+
+		if self.backups:
+			# deferred, the backups are only needed when writing
+			from ..common.openwithbackup import backup_content
+
+			for path in paths:
+				fyle = self.files.get(path)
+				if fyle is not None and fyle.exists:
+					backup_content(path, fyle.text)
+
+		journal = self._journal_path()
+
+		_write_synced(journal + NEW_SUFFIX, ''.join(x + '\n' for x in paths))
+		os.rename(journal + NEW_SUFFIX, journal)
+		_sync_folder(self.folder)
+
+		self._finish(paths)
+
+	def _finish(self, paths):
+
+		for path in paths:
+			if os.path.exists(path + NEW_SUFFIX):
+				os.rename(path + NEW_SUFFIX, path)
+
+		for folder in set(os.path.dirname(x) for x in paths):
+			_sync_folder(folder)
+
+		os.remove(self._journal_path())
+
+	def recover(self):
+		''' Completes a commit that was interrupted after it was committed, or discards the new contents
+			left by one that was interrupted before, for the files of the group that have been read.
+			Returns the paths of the files whose replacement was completed.
+		'''
+
+		journal = self._journal_path()
+
+		# without a journal there is nothing to finish, and a shared lock keeps commits out as well
+		with read_lock(journal):
+			if not os.path.exists(journal):
+				self._discard_new()
+				return []
+
+		# a commit in another process is not mistaken for an interrupted one
+		with write_lock(journal):
+			return self._recover()
+
+	def _recover(self):
+
+		journal = self._journal_path()
+
+		try:
+			with open(journal, 'r') as f:
+				paths = [x.rstrip('\n') for x in f if x.strip()]
+		except IOError:
+			paths = None
+
+		if paths is not None:
+			self._finish(paths)
+			return paths
+
+		self._discard_new()
+
+		return []
+
+	def _discard_new(self):
+
+		journal = self._journal_path()
+
+		# without the journal the commit never happened, the new contents it left behind are removed
+		candidates = set([self.config_path, self.cmdline_path, journal] + self.includes + self.files.keys())
+
+		for path in candidates:
+			try:
+				os.remove(path + NEW_SUFFIX)
+			except OSError:
+				pass
+
+
+def _write_synced(path, text):
+
+	with open(path, 'w') as f:
+		f.write(text)
+		f.flush()
+		os.fsync(f.fileno())
+
+
+def _sync_folder(folder):
+
+	# makes the renames in the folder durable; not every file system can sync a folder
+	try:
+		fd = os.open(folder, os.O_RDONLY)
+	except OSError:
+		return
+
+	try:
+		os.fsync(fd)
+	except OSError:
+		pass
+	finally:
+		os.close(fd)
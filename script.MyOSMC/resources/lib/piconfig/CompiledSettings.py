@@ -0,0 +1,191 @@
+'''
+Precompiled form of MASTER_SETTINGS.
+
+Running this module as a script is the build step: it validates MASTER_SETTINGS and
+writes MasterSettings.compiled, a marshalled copy of the settings keyed by the sha1
+of MasterSettings.py. At runtime load_master_settings() reads the artifact in one go,
+and falls back to importing the literal when the artifact is missing or was built
+from a different MasterSettings.py.
+
+	python CompiledSettings.py
+'''
+
+import marshal
+import os
+import re
+
+
+PICONFIG_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+SOURCE_FILE = os.path.join(PICONFIG_FOLDER, 'MasterSettings.py')
+ARTIFACT_FILE = os.path.join(PICONFIG_FOLDER, 'MasterSettings.compiled')
+
+# bumped whenever the layout of the artifact changes
+ARTIFACT_VERSION = 2
+
+REQUIRED_ATTRIBUTES = ['type', 'default', 'sprssDef', 'stub', 'valid', 'patterns']
+
+# defaults that mean the setting is absent from the config.txt, rather than a value to validate
+UNSET_DEFAULTS = ['', '0', 0, 'false', 'off']
+
+_loaded = None
+
+
+def source_hash(source_file=SOURCE_FILE):
+
+	import hashlib
+
+	with open(source_file, 'rb') as f:
+		return hashlib.sha1(f.read()).hexdigest()
+
+
+def validate(master_settings):
+	''' Checks every entry in MASTER_SETTINGS, and returns a list of the problems found.
+		An empty list means the settings are good to compile.
+	'''
+
+	from piSettings import CLASS_LIBRARY
+
+	errors = []
+
+	for name, attributes in sorted(master_settings.iteritems()):
+
+		missing = [x for x in REQUIRED_ATTRIBUTES if x not in attributes]
+		if missing:
+			errors.append('%s: missing %s' % (name, ', '.join(missing)))
+			continue
+
+		piClass = CLASS_LIBRARY.get(attributes['type'])
+		if piClass is None:
+			errors.append('%s: unknown type %r' % (name, attributes['type']))
+			continue
+
+		if '%s' not in attributes['stub']:
+			errors.append('%s: stub has no %%s' % name)
+
+		for pattern_pair in attributes['patterns']:
+			for key in ('id_pattern', 'ext_pattern'):
+				try:
+					compiled = re.compile(pattern_pair[key], re.IGNORECASE)
+				except KeyError:
+					errors.append('%s: pattern without %s' % (name, key))
+					continue
+				except re.error as e:
+					errors.append('%s: %s does not compile (%s)' % (name, key, e))
+					continue
+
+				if key == 'ext_pattern' and compiled.groups < 1:
+					errors.append('%s: ext_pattern has no group to extract the value' % name)
+
+		setting = piClass(name=name)
+		setting.set_valid_values(attributes['valid'])
+
+		defaults = attributes['default']
+		defaults = defaults.values() if isinstance(defaults, dict) else [defaults]
+
+		for default in defaults:
+			if default in UNSET_DEFAULTS:
+				continue
+			try:
+				setting._validate(default)
+			except NotImplementedError:
+				pass
+			except (ValueError, TypeError, IndexError):
+				errors.append('%s: default %r is not valid' % (name, default))
+
+	return errors
+
+
+def compile_settings(master_settings):
+	''' Reduces MASTER_SETTINGS to the plain tuples that _generate_list_of_settings consumes:
+		(name, type, stub, default, valid, ((id_pattern, ext_pattern), ...), suppress_defaults)
+	'''
+
+	compiled = []
+
+	for name, attributes in sorted(master_settings.iteritems()):
+
+		patterns = tuple((x['id_pattern'], x['ext_pattern']) for x in attributes['patterns'])
+
+		compiled.append((name, attributes['type'], attributes['stub'], attributes['default'],
+						attributes['valid'], patterns, attributes['sprssDef']))
+
+	return compiled
+
+
+def write_artifact(master_settings, digest, artifact_file=ARTIFACT_FILE):
+
+	payload = (ARTIFACT_VERSION, digest, compile_settings(master_settings))
+
+	tmp_file = artifact_file + '.tmp'
+
+	with open(tmp_file, 'wb') as f:
+		marshal.dump(payload, f, 2)
+
+	os.rename(tmp_file, artifact_file)
+
+
+def read_artifact(digest, artifact_file=ARTIFACT_FILE):
+	''' Returns the compiled settings from the artifact, or None if it is missing, unreadable
+		or was built from a different MasterSettings.py.
+	'''
+
+	try:
+		with open(artifact_file, 'rb') as f:
+			version, artifact_digest, compiled = marshal.loads(f.read())
+	except (IOError, EOFError, ValueError, TypeError):
+		return None
+
+	if version != ARTIFACT_VERSION or artifact_digest != digest:
+		return None
+
+	return compiled
+
+
+def load_master_settings():
+	''' Returns the compiled settings, from the artifact when it matches MasterSettings.py and
+		from the literal otherwise. The result is kept for the life of the process.
+	'''
+
+	global _loaded
+
+	if _loaded is None:
+
+		try:
+			compiled = read_artifact(source_hash())
+		except IOError:
+			compiled = None
+
+		if compiled is None:
+			from MasterSettings import MASTER_SETTINGS
+			compiled = compile_settings(MASTER_SETTINGS)
+
+		_loaded = compiled
+
+	return _loaded
+
+
+def build():
+
+	from MasterSettings import MASTER_SETTINGS
+
+	errors = validate(MASTER_SETTINGS)
+
+	if errors:
+		print '\n'.join(errors)
+		return 1
+
+	digest = source_hash()
+
+	write_artifact(MASTER_SETTINGS, digest)
+
+	print 'Wrote %s settings to %s (%s)' % (len(MASTER_SETTINGS), ARTIFACT_FILE, digest)
+
+	return 0
+
+
+if __name__ == "__main__":
+
+	import sys
+
+	sys.exit(build())
@@ -1,14 +1,115 @@
 import re
-from MasterSettings import MASTER_SETTINGS
 from piSettings import PassThrough, CLASS_LIBRARY
+from ..common import metrics
+from ..common.filelock import read_lock, write_lock, LOCK_TIMEOUT
+from ..common.profiling import profiled
+
+# the names of the settings on lines of the config.txt that do not hold a setting
+NOT_SETTINGS = ('passthrough', 'dupe')
+
+
+class ConfigChanged(Exception):
+	''' Raised when a write finds the config.txt changed since it was read, by another process; nothing is written.
+	ConfigFileInterface.rebase makes the same changes on top of the current config.txt.
+
+	Attributes:
+		current: the content of the config.txt the write found.
+	'''
+
+	def __init__(self, location, current):
+
+		super(ConfigChanged, self).__init__('%s has changed since it was read' % location)
+
+		self.current = current
+
+
+class ConfigDoc(list):
+	''' The final doc: the config_lines of a config.txt from the bottom of the file up, followed by
+	the settings that are not in the file. It is a list of config_lines, with an index of them.
+
+	Attributes:
+		lines: the config_lines of each setting, by name; passthrough and dupe lines are not indexed.
+		dirty: the names of the settings whose values have been changed since the doc was read.
+		applied: the Kodi values last given to update_settings, by name.
+		base: the content of the config.txt the doc was read from, or last wrote to it.
+	'''
+
+	def __init__(self, config_lines=(), base=None):
+
+		super(ConfigDoc, self).__init__(config_lines)
+
+		self.lines = {}
+		self.dirty = set()
+		self.applied = {}
+		self.base = base
+
+		for config_line in self:
+			name = config_line['setting'].name
+
+			if name not in NOT_SETTINGS:
+				self.lines.setdefault(name, []).append(config_line)
+
+
+class ConfigPlan(object):
+	''' What writing new settings to the config.txt would do, see ConfigFileInterface.plan.
+
+	Attributes:
+		lines: the lines of the new config.txt, in file order.
+		contents: the new config.txt, exactly as ConfigFileInterface.apply writes it.
+		base: the current config.txt, which the plan was made from.
+		diff: the lines that differ, in file order, as (line number, old line, new line). The line number
+			is in the current config.txt; an added line has None for both, a removed line has a new line of None.
+		changed: the names of the settings whose values change.
+		suppressed: the names of the settings left out of the config.txt because they would be at their defaults.
+		failures: {name: value} of the new values that failed validation.
+		settings: the new settings, {name: Kodi value}, the plan was made for.
+	'''
+
+	def __init__(self, rendered, changed, failures, settings=None):
+
+		# rendered runs from the bottom of the config.txt up
+		rendered = list(rendered)[::-1]
+
+		self.lines = [line for config_line, line, suppressed in rendered if line is not None]
+		self.contents = ''.join(self.lines)
+
+		self.changed = changed
+		self.suppressed = set(config_line['setting'].name for config_line, line, suppressed in rendered if suppressed)
+		self.failures = failures
+		self.settings = settings or {}
+
+		base = []
+		self.diff = []
+
+		for config_line, line, suppressed in rendered:
+
+			original = None if config_line['original'] == 'NULL' else config_line['original']
+
+			if original is not None:
+				base.append(original)
+
+			if line != original:
+				self.diff.append((None if original is None else len(base), original, line))
+
+		self.base = ''.join(base)
 
 
 class ConfigFileInterface(object):
+	''' Reads and writes a config.txt.
 
-	def __init__(self, location='/boot/config.txt'):
+	The settings page, the service and the shell tools can all write the config.txt, so a read holds a shared
+	lock on it and a write an exclusive one, see common.filelock. A write also checks that the config.txt is
+	as it was read, raising ConfigChanged rather than overwriting the changes of another process.
+	'''
+
+	def __init__(self, location='/boot/config.txt', OpenWithBackup=None, lock_timeout=LOCK_TIMEOUT):
 
 		self.location = location
 		self.OpenWithBackup = OpenWithBackup
+		self.lock_timeout = lock_timeout
+
+		# the doc from the last read of the config.txt, which plan() works from
+		self.final_doc = None
 
 
 	def _clean_this_line(self, original_line):
@@ -108,26 +209,31 @@ class ConfigFileInterface(object):
 			Builds the library of Settings instances. These are used against each line in the 
 			config.txt, with the first match being assigned as the Setting for that line.
 		'''
+		# the settings come from the precompiled artifact when it is current, see CompiledSettings
+		from CompiledSettings import load_master_settings
+
 		_settings = []
 
-		for key, attributes in MASTER_SETTINGS.iteritems():
+		for name, typ, stub, default, valid, patterns, suppress_defaults in load_master_settings():
 
-			typ = attributes['type']
 			piClass = CLASS_LIBRARY[typ]
-			setting = piClass(name=key)
+			setting = piClass(name=name)
 
-			setting.set_stub(attributes['stub'])
-			setting.set_default_value(attributes['default'])
-			setting.set_valid_values(attributes['valid'])
+			setting.set_stub(stub)
+			setting.set_default_value(default)
+			setting.set_valid_values(valid)
+			setting.suppress_defaults = suppress_defaults
 
-			for x in attributes['patterns']:
-				setting.add_pattern(x['id_pattern'], x['ext_pattern'])
+			for id_pattern, ext_pattern in patterns:
+				setting.add_pattern(id_pattern, ext_pattern)
 
 			_settings.append(setting)
 
 		return _settings
 
 
+	@profiled('read_config_txt')
+	@metrics.timed('config_read_seconds')
 	def read_config_txt(self):
 		'''
 		Reads the config.txt found at the provided location and produces a list of config_lines.
@@ -138,63 +244,279 @@ class ConfigFileInterface(object):
 		- a piSetting instance that has the retrieved validated value
 
 		The final doc contains what will eventually be written to the new config.txt
+
+		Raises:
+			LockTimeout: when a write to the config.txt holds it for longer than the lock timeout.
 		'''
 
+		with read_lock(self.location, self.lock_timeout):
+			with open(self.location, 'r') as f:
+				dirty_doc = f.readlines()
+
+		self.final_doc = self.parse_config_lines(dirty_doc)
+
+		return self.final_doc
+
+
+	def parse_config_lines(self, dirty_doc):
+		''' Produces the final doc from the lines of a config.txt, see read_config_txt. '''
+
 		# first step is to use the Master_Settings information to create a list of piSetting instances
 		_settings = self._generate_list_of_settings()
 
-		with open(self.location, 'r') as f:
-			dirty_doc = f.readlines()
-
 		clean_doc = self._clean_this_doc( dirty_doc )
 
 		clean_doc = self._assign_settings_to_doc( clean_doc, _settings )
 
 		final_doc = self._append_unmatched_settings_to_doc(clean_doc, _settings)
 
-		return final_doc
+		return ConfigDoc(final_doc, ''.join(dirty_doc))
 
 
-	def write_config_txt(self, final_doc, OpenWithBackup=None):
-		''' Backs up the existing config.txt
-		Runs through the final doc producing a list of lines to write back to a new config.txt
+	def _render(self, final_doc, dirty, new_values=None):
+		''' Yields (config_line, new line, suppressed) for each config_line of the final doc, from the
+		bottom up. The new line is None when the line is left out of the new config.txt, and suppressed is
+		set when that is because the setting would be at its default.
+		Only the settings in dirty can differ from their original lines. Their new values are those set on
+		the settings by update_settings, or new_values, {name: config.txt value}, when that is given.
 		'''
 
-		new_lines = []
-
 		for config_line in final_doc:
 			setting = config_line['setting']
 
+			# settings that were not found in the config.txt have no original line
+			original = None if config_line['original'] == 'NULL' else config_line['original']
+
+			# lines of settings that have not been changed are replicated as they are, duplicates are
+			# commented out whenever the config.txt is rewritten
+			if setting.name not in dirty and (setting.name != 'dupe' or not dirty):
+				yield config_line, original, False
+				continue
+
+			if new_values is None or setting.name == 'dupe':
+				new_value = setting.new_value
+			else:
+				new_value = new_values.get(setting.name)
+
 			# settings that are the default values, and where defaults are suppressed should be ignored
 			# (i.e. dont write them to the new config.txt)
-			if setting.isDefault and setting.suppress_defaults:
+			if setting.suppress_defaults and str(new_value) == str(setting.default_value):
+				yield config_line, None, True
 				continue
 
 			# settings that are not changed should just have the original line replicated in the new config.txt
-			if not setting.isChanged:
-				new_lines.append(config_line['original'])
+			if new_value is None or str(new_value) == str(setting.current_config_value):
+				yield config_line, original, False
+				continue
+
+			# settings that are switched off are left out of the new config.txt
+			if new_value == 'NULLSETTING':
+				yield config_line, None, False
+				continue
+
+			# lines for which the values have changed are made from the stub of the piSetting
+			new_line = setting.stub % new_value
+			yield config_line, new_line if new_line.endswith('\n') else new_line + '\n', False
 
-			# lines for which the values have changed should have the final_line brought in from the piSetting
-			new_lines.append(setting.final_line)
+
+	def render_config_txt(self, final_doc):
+		''' Runs through the final doc producing the lines of the new config.txt, in file order.
+		Only the settings in the dirty set of the doc can differ from their original lines.
+		'''
+
+		new_lines = [line for config_line, line, suppressed in self._render(final_doc, final_doc.dirty) if line is not None]
 
 		# reverse the lines back to the original order
-		new_lines = new_lines[::-1]
+		return new_lines[::-1]
+
+
+	@profiled('write_config_txt')
+	@metrics.timed('config_write_seconds')
+	def write_config_txt(self, final_doc, OpenWithBackup=None):
+		''' Backs up the existing config.txt
+		Writes the lines produced by render_config_txt to the new config.txt
+		Nothing is written when no setting has been changed; returns whether the config.txt was written.
+
+		Raises:
+			ConfigChanged: when the config.txt is not as the doc was read, see rebase.
+			LockTimeout: when the config.txt is locked for longer than the lock timeout.
+		'''
+
+		if not final_doc.dirty:
+			return False
+
+		new_lines = self.render_config_txt(final_doc)
 
-		if self.OpenWithBackup:
-			with self.OpenWithBackup(self.location, 'w') as f:
-				f.writelines(new_lines)
+		OpenWithBackup = OpenWithBackup or self.OpenWithBackup
+
+		with write_lock(self.location, self.lock_timeout):
+
+			self._check_unchanged(final_doc.base)
+
+			if OpenWithBackup:
+				with OpenWithBackup(self.location, 'w') as f:
+					f.writelines(new_lines)
+			else:
+				with open(self.location, 'w') as f:
+					f.writelines(new_lines)
+
+		# the doc can be written again, its changes are now in the config.txt
+		final_doc.base = ''.join(new_lines)
+
+		return True
+
+
+	def _check_unchanged(self, base):
+		''' Raises ConfigChanged when the content of the config.txt is not base. Called with the write lock held.
+		The content is compared, rather than the modification time, which the FAT boot partition keeps to
+		two seconds. A doc that was not read from a file, with no base, is not checked.
+		'''
+
+		if base is None:
+			return
+
+		try:
+			with open(self.location, 'r') as f:
+				current = f.read()
+		except IOError:
+			# a missing config.txt reads as empty, as it does to the firmware
+			current = ''
+
+		if current != base:
+			metrics.increment('config_write_conflicts')
+			raise ConfigChanged(self.location, current)
+
+
+	def rebase(self, pending, conflict=None):
+		''' Makes the changes of pending, a doc that write_config_txt or a plan that apply refused with
+		ConfigChanged, on top of the current config.txt, returning a new doc or plan with them.
+		Only the settings pending changed are carried over, the changes of the other process are kept.
+		The current config.txt is taken from the conflict, so it is parsed but not read again.
+		'''
+
+		if conflict is None:
+			final_doc = self.read_config_txt()
 		else:
-			with open(self.location, 'w') as f:
-				f.writelines(new_lines)
+			final_doc = self.parse_config_lines(conflict.current.splitlines(True))
+			self.final_doc = final_doc
+
+		if isinstance(pending, ConfigPlan):
+			return self.plan(dict((name, pending.settings[name]) for name in pending.changed), final_doc)
+
+		return self.update_settings(final_doc, dict((name, pending.applied[name]) for name in pending.dirty))
+
+
+	def plan(self, new_settings, final_doc=None):
+		''' Works out what writing the new settings, {name: Kodi value}, would do, without changing the
+		doc or writing anything. The doc is the one last read by read_config_txt unless one is given, so
+		the config.txt is only read when it has not been read yet.
+		New values that fail validation are reported in the plan, and leave their settings as they are.
+
+		Returns a ConfigPlan, which apply() writes.
+		'''
+
+		if final_doc is None:
+			final_doc = self.read_config_txt() if self.final_doc is None else self.final_doc
+
+		new_values = {}
+		failures = {}
+
+		for name, value in new_settings.iteritems():
+
+			config_lines = final_doc.lines.get(name)
+
+			if not config_lines:
+				continue
+
+			try:
+				new_values[name] = self._validated(config_lines[0]['setting'], value)
+			except (ValueError, TypeError, IndexError):
+				failures[name] = value
+
+		changed = set(name for name, value in new_values.iteritems()
+			if any(str(value) != str(x['setting'].current_config_value) for x in final_doc.lines[name]))
+
+		return ConfigPlan(self._render(final_doc, changed, new_values), changed, failures, new_settings)
+
+
+	def _validated(self, setting, value):
+		''' Returns the config.txt value of the Kodi value, raising ValueError (or TypeError, IndexError)
+		when it is not a valid value for the setting.
+		'''
+
+		config_value = setting.convert_to_piconfig_setting(value)
+
+		# values that switch the setting off or return it to its default need no checking
+		if config_value in (None, 'NULLSETTING') or str(config_value) == str(setting.default_value):
+			return config_value
+
+		try:
+			setting._validate(config_value)
+		except NotImplementedError:
+			pass
+
+		return config_value
+
+
+	@metrics.timed('config_write_seconds')
+	def apply(self, plan, OpenWithBackup=None):
+		''' Writes the config.txt exactly as the plan previewed it; nothing is written when the plan
+		changes nothing. The plan's lines are parsed to become the doc last read, without reading them back.
+
+		Returns whether the config.txt was written.
+
+		Raises:
+			ConfigChanged: when the config.txt is not the one the plan was made from, see rebase.
+			LockTimeout: when the config.txt is locked for longer than the lock timeout.
+		'''
+
+		if plan.contents == plan.base:
+			return False
+
+		OpenWithBackup = OpenWithBackup or self.OpenWithBackup
+
+		with write_lock(self.location, self.lock_timeout):
+
+			self._check_unchanged(plan.base)
+
+			with (OpenWithBackup or open)(self.location, 'w') as f:
+				f.write(plan.contents)
+
+		self.final_doc = self.parse_config_lines(plan.lines)
+
+		return True
 
 
 	def update_settings(self, final_doc, new_settings):
+		''' Sets the new values, {name: Kodi value}, on the settings in the doc, recording the names of
+		those that now differ from the config.txt in the dirty set of the doc.
+		Only the settings named are touched, and a value that was already applied is not converted again.
+		Names that are not settings in the doc are ignored.
+		'''
 
-		for config_line in final_doc:
-			
-			setting = config_line['setting']
+		for name, value in new_settings.iteritems():
+
+			config_lines = final_doc.lines.get(name)
+
+			if not config_lines:
+				continue
+
+			if name in final_doc.applied and final_doc.applied[name] == value:
+				continue
+
+			# recorded only once the value has been converted, so that a value that fails to convert is tried
+			# again, and lines converted before the failure are not taken for the value applied before
+			final_doc.applied.pop(name, None)
+
+			for config_line in config_lines:
+				config_line['setting'].set_new_value(value)
+
+			final_doc.applied[name] = value
 
-			setting.set_new_value( new_settings[ setting.name ] )
+			if any(x['setting'].isChanged() for x in config_lines):
+				final_doc.dirty.add(name)
+			else:
+				final_doc.dirty.discard(name)
 
 		return final_doc
 
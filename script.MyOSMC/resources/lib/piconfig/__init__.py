@@ -1,3 +1,3 @@
-from ConfigFileInterface import ConfigFileInterface
-from MASTER_SETTINGS import MASTER_SETTINGS
+from ConfigFileInterface import ConfigFileInterface, ConfigChanged
+from BootConfig import BootConfig
 from piSettings import CLASS_LIBRARY
@@ -1,5 +1,18 @@
 import re
 
+# compiled patterns are shared between all the setting instances, and every read of
+# the config.txt, so each pattern is only compiled once per process
+_COMPILED_PATTERNS = {}
+
+
+def compile_pattern(pattern):
+
+	try:
+		return _COMPILED_PATTERNS[pattern]
+	except KeyError:
+		compiled = _COMPILED_PATTERNS[pattern] = re.compile(pattern, re.IGNORECASE)
+		return compiled
+
 
 class piSetting(object):
 
@@ -41,10 +54,11 @@ class piSetting(object):
 				name=self.name, dflt=self.default_value, curr=self.current_config_value)
 
 	def isChanged(self):
-		return 	self.current_config_value == self.new_value
+		# there is no new value until one is set; values compare as text, which is how they are written
+		return self.new_value is not None and str(self.current_config_value) != str(self.new_value)
 
 	def isDefault(self):
-		return self.default_value == self.new_value
+		return str(self.default_value) == str(self.new_value)
 
 	def set_stub(self, value):
 		self.stub = value
@@ -61,8 +75,8 @@ class piSetting(object):
 		self.valid_values = valid_values
 
 	def add_pattern(self, id_pattern, ext_pattern):
-		id_pattern = re.compile(id_pattern, re.IGNORECASE)
-		ext_pattern = re.compile(ext_pattern, re.IGNORECASE)
+		id_pattern = compile_pattern(id_pattern)
+		ext_pattern = compile_pattern(ext_pattern)
 		self.patterns.append((id_pattern, ext_pattern))
 
 	def set_current_config_value(self, value):
@@ -74,6 +88,10 @@ class piSetting(object):
 	def final_line(self):
 		return self.stub % self.new_value
 
+	def convert_to_piconfig_setting(self, value):
+		# the values of most settings are the same in the config.txt and Kodi
+		return value
+
 	def _validate(self, *args, **kwargs):
 		''' Invalid values should raise a ValueError '''
 		raise NotImplementedError
@@ -316,16 +334,14 @@ class Selection(piSetting):
 
 
 def PiVersion():
-	''' Determines the version of Pi currently being used '''
-
-	with open('/proc/cpuinfo', 'r') as f:
+	''' Determines the version of Pi currently being used.
+		The hardware is only detected once per process, see common.hardwareversion.
+	'''
 
-		cpu_count = sum([1 for x in f.readlines() if x.startswith('processor')])
+	# imported here so that piSettings itself can be used outside of Kodi, e.g. by CompiledSettings
+	from ..common.hardwareversion import hardware_profile
 
-	if cpu_count == 1:
-		return 'PiB'
-	else:
-		return 'Pi2'
+	return hardware_profile().pi_version
 
 
 
@@ -1,146 +1,505 @@
 from glob import glob
+import hashlib
+import json
+import multiprocessing
 import os
 from pprint import pprint
-import re
-import xml.etree.ElementTree as ET
+import time
 
-cwd = os.getcwd()
-dest_folder = cwd[:-4]
+try:
+	import xml.etree.cElementTree as ET
+except ImportError:
+	import xml.etree.ElementTree as ET
+
+raw_folder = os.path.dirname(os.path.abspath(__file__))
+dest_folder = os.path.join(os.path.dirname(raw_folder), '1080i')
 
 include_file = 'Includes.xml'
 colours_file = 'defaults.xml'
 control_file = 'ControlDefaults.xml'
 
-fyles = glob('*.xml')
+# The colour stage used to pass re.MULTILINE (8) as the count argument of re.subn, so no
+# more than 8 occurrences of a colour were replaced per format in each file. The cap is kept
+# so that the built skin is unchanged; raise it to replace every occurrence.
+COLOUR_REPLACEMENT_CAP = 8
+
+# the stages timed by build_skin, in the order they run
+STAGES = ['parse', 'includes', 'control_defaults', 'colours', 'serialize']
+
+# the files used by every window; a change to any of them rebuilds the whole skin, as does a change to this script
+SHARED_FILES = [include_file, colours_file, control_file]
+BUILDER = 'insert_inclusions.py'
+
+# the manifest of the inputs of the last build, kept with the built files
+MANIFEST_FILE = '.build_manifest.json'
+MANIFEST_VERSION = 1
+
+# files changed this close to the last build are hashed again, even if their mtime and size are unchanged
+RACY_SECONDS = 2
+
+# the fewest files worth starting another process for
+MIN_FILES_PER_PROCESS = 16
+
+
+def window_files(folder=raw_folder):
+	''' Returns the names of the skin files to build; every xml in the folder apart from
+		the includes, colours and control defaults.
+	'''
+
+	fyles = [os.path.basename(x) for x in glob(os.path.join(folder, '*.xml'))]
+
+	for special in SHARED_FILES:
+		if special in fyles:
+			fyles.remove(special)
+
+	return sorted(fyles)
+
+
+def _colour_counter(record):
+	''' Returns take(name, format), which counts a replacement of the colour in the record and
+		returns True, or returns False once COLOUR_REPLACEMENT_CAP replacements of the colour
+		in that format have been made.
+	'''
+
+	taken = {}
 
-fyles.remove(include_file)
-fyles.remove(colours_file)
-fyles.remove(control_file)
+	def take(name, format):
+		count = taken.get((name, format), 0)
+		if count >= COLOUR_REPLACEMENT_CAP:
+			return False
+		taken[(name, format)] = count + 1
+		record[name] = record.get(name, 0) + 1
+		return True
 
-def get_inclusion(child):
+	return take
 
-	return "".join([ ET.tostring(e) for e in child.getchildren() ] )
 
+def clone(element):
+	''' A deep copy of the element; cheaper than copy.deepcopy, as the text and attributes are strings. '''
 
-def process_Includes_file():
-	tree = ET.parse(include_file)
+	copied = ET.Element(element.tag, dict(element.attrib))
+	copied.text = element.text
+	copied.tail = element.tail
+
+	for child in element:
+		copied.append(clone(child))
+
+	return copied
+
+
+def load_control_defaults(folder=raw_folder):
+	''' Returns {type: (tags, templates)} for each control type in the control defaults, where
+		templates are copies of the default elements of the type, and tags the set of their tags.
+	'''
+
+	tree = ET.parse(os.path.join(folder, control_file))
 	root = tree.getroot()
 
-	inclusions = { child.attrib['name']: get_inclusion(child) for child in root}
+	control_defaults = {}
+
+	for child in root:
+		templates = [clone(x) for x in child]
+		control_defaults[child.attrib['type']] = (frozenset(x.tag for x in templates), templates)
+
+	return control_defaults
+
+
+def apply_control_defaults(root, control_defaults):
+	''' Appends the default elements for its type to every control, unless the control already
+		has a child with the same tag. Each default is a new copy of the template, so that no
+		element is shared between controls.
+	'''
+
+	# the controls are listed before any defaults are appended
+	for control in list(root.iter('control')):
+
+		try:
+			tags, templates = control_defaults[control.get('type')]
+		except KeyError:
+			continue
+
+		existing = tags.intersection(child.tag for child in control)
+
+		if len(existing) == len(tags):
+			continue
+
+		control.extend([clone(x) for x in templates if x.tag not in existing])
 
-	replacement_record = {}
 
-	for fyle in fyles:
+def load_include_definitions(folder=raw_folder):
 
-		new_fyle = os.path.join(dest_folder, fyle)
+	tree = ET.parse(os.path.join(folder, include_file))
 
-		with open(fyle, 'r') as f:
+	return { child.attrib['name']: child for child in tree.getroot()}
 
-			replacement_record[fyle] = {}
 
-			contents = ''.join(f.readlines())
+def _include_reference(element, definitions):
+	''' Returns the name of the include an element refers to, or None. '''
 
-			# number of times to run through the file replacing includes
-			# this is essentially the max number of nesting we will allow
-			for _ in range(5):
-			
-				for include_tag, guts in inclusions.iteritems():
+	if element.tag != 'include' or element.attrib or len(element):
+		return None
 
-					string = '<include>\s*' + include_tag + '.*</include>'
+	name = (element.text or '').strip()
 
-					contents, count =  re.subn(string, guts, contents, re.MULTILINE)
-					
-					replacement_record[fyle][include_tag] = count
+	return name if name in definitions else None
 
-		with open(new_fyle, 'w') as f:
-			f.write(contents)
 
-	pprint(replacement_record)
+def expand_tree_includes(parent, resolved, usage, record):
+	''' Replaces the include references below parent with copies of the resolved includes,
+		keeping the whitespace around each reference, and counts the includes used in the record.
+	'''
 
+	index = 0
 
-def process_colours_file():
+	while index < len(parent):
 
-	tree = ET.parse(colours_file)
+		child = parent[index]
+
+		name = _include_reference(child, resolved)
+
+		if name is None:
+			expand_tree_includes(child, resolved, usage, record)
+			index += 1
+			continue
+
+		for used, count in usage[name].iteritems():
+			record[used] = record.get(used, 0) + count
+
+		replacement = [clone(x) for x in resolved[name]]
+
+		# the text after the reference follows the last included element
+		tail = child.tail or ''
+
+		if replacement:
+			replacement[-1].tail = (replacement[-1].tail or '') + tail
+		elif index == 0:
+			parent.text = (parent.text or '') + tail
+		else:
+			parent[index - 1].tail = (parent[index - 1].tail or '') + tail
+
+		parent[index:index + 1] = replacement
+
+		index += len(replacement)
+
+
+def resolve_include_trees(definitions):
+	''' Every include definition with its nested includes expanded, deepest first, so that every
+		include can be substituted into a window in a single pass, and the number of times each
+		include is used by it (itself included).
+
+		Raises:
+			ValueError: when includes include each other in a cycle.
+	'''
+
+	resolved = {}
+	usage = {}
+
+	def resolve(name, stack):
+
+		if name in resolved:
+			return
+
+		if name in stack:
+			raise ValueError('Include cycle: %s' % ' > '.join(stack + [name]))
+
+		definition = clone(definitions[name])
+
+		for child in definition.iter('include'):
+			nested = _include_reference(child, definitions)
+			if nested is not None:
+				resolve(nested, stack + [name])
+
+		counts = {}
+		expand_tree_includes(definition, resolved, usage, counts)
+		counts[name] = counts.get(name, 0) + 1
+
+		resolved[name] = definition
+		usage[name] = counts
+
+	for name in definitions:
+		resolve(name, [])
+
+	return resolved, usage
+
+
+def load_colours(folder=raw_folder):
+
+	tree = ET.parse(os.path.join(folder, colours_file))
 	root = tree.getroot()
 
-	colours = { child.attrib['name']: child.text for child in root}
+	return { child.attrib['name']: child.text for child in root}
+
 
-	replacement_record = {}
+def apply_colours(root, colours, record):
+	''' Replaces colour names with their codes, where the name (or $VAR[name]) is the whole text
+		before a closing tag, or the whole value of a colordiffuse attribute.
 
-	pprint(colours)
+		colordiffuse="$VAR[name]" is left alone; the colour stage that the skin was first built
+		with never matched it. Occurrences are counted in document order, for COLOUR_REPLACEMENT_CAP.
+	'''
 
-	for fyle in fyles:
+	take = _colour_counter(record)
 
-		fyle = os.path.join(dest_folder, fyle)
+	def substitute(text):
+		if text in colours:
+			return colours[text] if take(text, 'text') else text
+		if text.startswith('$VAR[') and text.endswith(']') and text[5:-1] in colours:
+			return colours[text[5:-1]] if take(text[5:-1], 'var') else text
+		return text
 
-		with open(fyle, 'r') as f:
+	def walk(element, is_last_child):
 
-			replacement_record[fyle] = {}
+		value = element.get('colordiffuse')
+		if value in colours and take(value, 'attribute'):
+			element.set('colordiffuse', colours[value])
 
-			contents = ''.join(f.readlines())
+		# only text that runs up to a closing tag is replaced
+		if not len(element) and element.text is not None:
+			element.text = substitute(element.text)
 
-			for colour_name, colour_code in colours.iteritems():
+		for index, child in enumerate(element):
+			walk(child, index == len(element) - 1)
 
-				replacement_record[fyle][colour_name] = 0
+		if is_last_child and element.tail is not None:
+			element.tail = substitute(element.tail)
 
-				formats = [
-						('>','</', '>','</'),
-						('>\$VAR\[','\]</', '>','</'),
-						('colordiffuse="$VAR[',']"', 'colordiffuse="','"'),
-						('colordiffuse="','"','colordiffuse="','"')
+	walk(root, False)
 
-				]
 
-				for (left, right, repleft, repright) in formats:
+def load_skin(folder=raw_folder):
+	''' Loads what every window is built from: the resolved includes, the control defaults and the colours. '''
 
-					string = left + colour_name + right
+	definitions = load_include_definitions(folder)
+	resolved, usage = resolve_include_trees(definitions)
 
-					contents, count =  re.subn(string, repleft + colour_code + repright, contents, re.MULTILINE)
-					
-					replacement_record[fyle][colour_name] += count
+	return {
+		'definitions': definitions,
+		'resolved': resolved,
+		'usage': usage,
+		'control_defaults': load_control_defaults(folder),
+		'colours': load_colours(folder),
+		}
 
-		with open(fyle, 'w') as f:
-			f.write(contents)
 
-	pprint(replacement_record)
+def build_window(fyle, skin, folder=raw_folder, dest=dest_folder):
+	''' Builds one window file, parsing it once, applying the includes, control defaults and colours
+		to the tree, and serializing it once.
 
+		Returns:
+			the replacement records of the includes and colours, and the time taken by each stage in seconds.
+	'''
 
-def insert_control_defaults():
+	record = {'includes': dict((name, 0) for name in skin['definitions']),
+				'colours': dict((name, 0) for name in skin['colours'])}
 
-	tree = ET.parse(control_file)
+	timings = {}
+
+	start = time.time()
+	tree = ET.parse(os.path.join(folder, fyle))
 	root = tree.getroot()
+	timings['parse'] = time.time() - start
+
+	start = time.time()
+	expand_tree_includes(root, skin['resolved'], skin['usage'], record['includes'])
+	timings['includes'] = time.time() - start
+
+	start = time.time()
+	apply_control_defaults(root, skin['control_defaults'])
+	timings['control_defaults'] = time.time() - start
+
+	start = time.time()
+	apply_colours(root, skin['colours'], record['colours'])
+	timings['colours'] = time.time() - start
+
+	start = time.time()
+	tree.write(os.path.join(dest, fyle))
+	timings['serialize'] = time.time() - start
+
+	return record, timings
+
+
+# the skin loaded by each process of the pool
+_worker = {}
+
+
+def _start_worker(folder, dest):
+
+	_worker.update({'skin': load_skin(folder), 'folder': folder, 'dest': dest})
+
+
+def _build_in_worker(fyle):
+
+	return fyle, build_window(fyle, _worker['skin'], _worker['folder'], _worker['dest'])
+
+
+def build_skin(folder=raw_folder, dest=dest_folder, fyles=None, processes=1):
+	''' Builds the window files, each with build_window.
+
+		With more than one process, the files are shared out over a multiprocessing pool, in which
+		each process loads the skin once. The pool is only used when there are more files than
+		MIN_FILES_PER_PROCESS for each process, as starting it costs more than building a few files.
+
+		Returns:
+			the replacement records of the includes and colours for each file, and the time taken
+			by each stage in seconds, summed over all the processes.
+	'''
+
+	fyles = window_files(folder) if fyles is None else fyles
+
+	if processes is None:
+		processes = multiprocessing.cpu_count()
+
+	processes = min(processes, len(fyles) // MIN_FILES_PER_PROCESS)
+
+	if processes > 1:
+		pool = multiprocessing.Pool(processes, _start_worker, (folder, dest))
+		try:
+			results = pool.map(_build_in_worker, fyles, chunksize=max(1, len(fyles) // (processes * 4)))
+		finally:
+			pool.close()
+			pool.join()
+	else:
+		skin = load_skin(folder)
+		results = [(fyle, build_window(fyle, skin, folder, dest)) for fyle in fyles]
+
+	timings = dict((stage, 0.0) for stage in STAGES)
+	records = {}
+
+	for fyle, (record, window_timings) in results:
+		records[fyle] = record
+		for stage, seconds in window_timings.iteritems():
+			timings[stage] += seconds
+
+	return records, timings
+
+
+def _hash_file(path):
+
+	with open(path, 'rb') as f:
+		return hashlib.sha1(f.read()).hexdigest()
+
+
+def scan_inputs(folder=raw_folder, previous=None):
+	''' Returns {name: [mtime, size, hash]} for the window files, the shared files and this script.
+
+		The hash of a file is reused from the previous scan when its mtime and size are unchanged,
+		unless the mtime is too close to the time of the previous scan to rule out a later change
+		within the same tick of the clock.
+	'''
+
+	previous = previous or {'inputs': {}, 'time': 0}
+
+	paths = dict((fyle, os.path.join(folder, fyle)) for fyle in window_files(folder))
+	paths.update((fyle, os.path.join(folder, fyle)) for fyle in SHARED_FILES)
+	paths[BUILDER] = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+
+	inputs = {}
+
+	for name, path in paths.iteritems():
+
+		try:
+			st = os.stat(path)
+		except OSError:
+			continue
+
+		known = previous['inputs'].get(name)
+
+		if known is not None and known[:2] == [st.st_mtime, st.st_size] and st.st_mtime < previous['time'] - RACY_SECONDS:
+			inputs[name] = known
+		else:
+			inputs[name] = [st.st_mtime, st.st_size, _hash_file(path)]
+
+	return inputs
+
+
+def _input_hash(inputs, name):
+
+	return inputs[name][2] if name in inputs else None
+
+
+def load_manifest(path):
+
+	try:
+		with open(path, 'r') as f:
+			manifest = json.load(f)
+	except (IOError, ValueError):
+		return None
+
+	if manifest.get('version') != MANIFEST_VERSION:
+		return None
+
+	return manifest
+
+
+def save_manifest(path, manifest):
+
+	temp = path + '.tmp'
+
+	with open(temp, 'w') as f:
+		json.dump(manifest, f, sort_keys=True)
+
+	os.rename(temp, path)
+
+
+def incremental_build(folder=raw_folder, dest=dest_folder, processes=None):
+	''' Builds only the windows whose output is out of date, going by the manifest of input hashes
+		kept in the destination folder. Every window is rebuilt when one of the shared files, or this
+		script, has changed. The outputs of windows that no longer exist are removed.
+
+		Returns:
+			the names of the files built, and the records and timings of build_skin.
+	'''
+
+	manifest_path = os.path.join(dest, MANIFEST_FILE)
+
+	previous = load_manifest(manifest_path)
+
+	started = time.time()
+	inputs = scan_inputs(folder, previous)
+
+	shared = [_input_hash(inputs, x) for x in SHARED_FILES + [BUILDER]]
 
-	control_defaults = { child.attrib['type']: child.getchildren() for child in root}
+	fyles = window_files(folder)
 
-	print control_defaults.keys()
+	if previous is None or previous['shared'] != shared:
+		stale = fyles
+	else:
+		stale = [x for x in fyles if _input_hash(previous['inputs'], x) != _input_hash(inputs, x)
+										or not os.path.isfile(os.path.join(dest, x))]
 
-	replacement_record = {}
+	records, timings = build_skin(folder, dest, stale, processes) if stale else ({}, dict((x, 0.0) for x in STAGES))
 
-	for fyle in fyles:
+	if previous is not None:
+		for fyle in previous['built']:
+			if fyle not in fyles and os.path.isfile(os.path.join(dest, fyle)):
+				os.remove(os.path.join(dest, fyle))
 
-		fyle = os.path.join(dest_folder, fyle)	
+	save_manifest(manifest_path, {
+		'version': MANIFEST_VERSION,
+		'time': started,
+		'shared': shared,
+		'inputs': inputs,
+		'built': fyles,
+		})
 
-		print fyle
+	return stale, records, timings
 
-		tree = ET.parse(fyle)
 
-		for element in tree.getiterator():
+if __name__ == "__main__":
 
-			try:
-				typ = element.attrib['type']
-			except:
-				continue
+	import sys
 
-			existing_tags = [x.tag for x in element.getchildren()]
+	if '--all' in sys.argv:
+		records, timings = build_skin()
+		pprint(records)
 
-			default_lms = control_defaults.get(typ, [])
+		for stage in STAGES:
+			print '%-20s %8.2f ms' % (stage, timings[stage] * 1000)
 
-			for dlm in default_lms:
-				if dlm.tag not in existing_tags:
-					element.append(dlm)
-		
-		tree.write(fyle)
+	else:
+		built, records, timings = incremental_build()
+		pprint(records)
+		print 'built %s of %s windows' % (len(built), len(window_files()))
 
-process_Includes_file()
-insert_control_defaults()
-process_colours_file()
+		for stage in STAGES:
+			print '%-20s %8.2f ms' % (stage, timings[stage] * 1000)
@@ -19,10 +19,10 @@
 #  http://www.gnu.org/copyleft/gpl.html
 #
 
+# the addon modules are imported on first use, keeping start up quick.
+# tests/test_import_time.py holds the start up import budget.
 import xbmc
 import xbmcaddon
-import xbmcgui
-
 
 __addon__        = xbmcaddon.Addon()
 __addonid__      = __addon__.getAddonInfo('id')
@@ -31,4 +31,12 @@ __setting__      = __addon__.getSetting
 
 
 if __name__ == "__main__":
-	pass
+
+	from resources.lib.common.openwithbackup import flush_pending_backups
+
+	# complete any backups that were handed off, but not written, before Kodi last exited
+	flush_pending_backups()
+
+	from resources.lib.SettingsService import SettingsService
+
+	SettingsService(push=__addon__.setSetting).run(monitor=xbmc.Monitor())
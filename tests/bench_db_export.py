@@ -0,0 +1,101 @@
+''' Benchmark of the memory used by exporting and importing the preferences database.
+
+    python bench_db_export.py [keys ...]
+
+Each operation runs in a fresh process, so that its peak resident memory can be reported
+on its own. all_pairs() holds every setting in memory at once, export and import_ should
+use the same memory whatever the size of the database.
+'''
+import env
+import os
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from lib.database import DBInterface
+
+SIZES = [100000, 1000000]
+
+OPERATIONS = ['baseline', 'all_pairs', 'export jsonl', 'export binary', 'import jsonl', 'import binary']
+
+
+def populate(dbpath, keys):
+
+    os.environ['DBPATH'] = dbpath
+    DBInterface()
+
+    def rows():
+        for index in xrange(keys):
+            kind = index % 4
+            yield ('key%07d' % index,
+                   index % 2 if kind == 0 else None,
+                   index if kind == 1 else None,
+                   index / 3.0 if kind == 2 else None,
+                   'value %s' % index if kind == 3 else None)
+
+    con = sqlite3.connect(dbpath)
+    con.executemany('INSERT INTO OSMCSETTINGS VALUES (?,?,?,?,?)', rows())
+    con.commit()
+    con.close()
+
+
+def run(operation, dbpath, export_path):
+    ''' Runs the operation in this process, and returns the seconds taken. '''
+
+    os.environ['DBPATH'] = dbpath
+    db = DBInterface()
+
+    name, _, fmt = operation.partition(' ')
+
+    start = time.time()
+
+    if name == 'all_pairs':
+        db.all_pairs()
+    elif name == 'export':
+        with open(export_path + fmt, 'wb') as f:
+            db.export(f, format=fmt)
+    elif name == 'import':
+        with open(export_path + fmt, 'rb') as f:
+            db.import_(f, mode='replace', format=fmt)
+
+    return time.time() - start
+
+
+def measure(operation, dbpath, export_path):
+
+    output = subprocess.check_output([sys.executable, __file__, '--child', operation, dbpath, export_path])
+
+    seconds, max_rss = output.split()
+
+    return float(seconds), int(max_rss)
+
+
+if __name__ == '__main__':
+
+    if sys.argv[1:2] == ['--child']:
+        seconds = run(*sys.argv[2:5])
+        print('%s %s' % (seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+        sys.exit(0)
+
+    sizes = [int(x) for x in sys.argv[1:]] or SIZES
+
+    for keys in sizes:
+
+        folder = tempfile.mkdtemp()
+
+        try:
+            dbpath = os.path.join(folder, 'preferences.db')
+            populate(dbpath, keys)
+
+            print('%s keys' % keys)
+
+            for operation in OPERATIONS:
+                seconds, max_rss = measure(operation, dbpath, os.path.join(folder, 'export.'))
+                print('  %-15s %8.2f s %8.1f MB peak' % (operation, seconds, max_rss / 1024.0))
+
+        finally:
+            shutil.rmtree(folder)
@@ -0,0 +1,84 @@
+''' Benchmark of the change log of the preferences database.
+
+    python bench_db_history.py
+
+Measures the time of a setsetting with and without the change log, and the time of
+history(key) and as_of(timestamp) as the log grows to LOG_SIZES changes. The changes
+are spread over KEYS keys, so history(key) returns more changes as the log grows; as_of
+reads only the changes after the timestamp, the last KEYS / 2 here.
+'''
+import env
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from lib.database import DBInterface
+
+WRITES = 500
+KEYS = 1000
+LOG_SIZES = [1000, 10000, 100000]
+
+
+def bench_writes(folder, history):
+
+    os.environ['DBPATH'] = os.path.join(folder, 'writes_%s.db' % history)
+    db = DBInterface(history=history)
+
+    start = time.time()
+    for index in range(WRITES):
+        db.setsetting('key%s' % (index % KEYS), index)
+
+    return (time.time() - start) / WRITES
+
+
+def fill_log(dbpath, changes):
+
+    con = sqlite3.connect(dbpath)
+    con.executemany('INSERT INTO OSMCHISTORY (key, old_int, new_int, timestamp, source) VALUES (?,?,?,?,?)',
+                    (('key%s' % (index % KEYS), index - KEYS, index, float(index), 'bench') for index in xrange(changes)))
+    con.commit()
+    con.close()
+
+
+def bench_lookups(folder, changes, number=20):
+
+    os.environ['DBPATH'] = os.path.join(folder, 'log_%s.db' % changes)
+    db = DBInterface(history=True)
+
+    for index in range(KEYS):
+        db.setsetting('key%s' % index, index)
+
+    fill_log(db.dbpath, changes)
+
+    start = time.time()
+    for _ in range(number):
+        db.history('key1')
+    history = (time.time() - start) / number
+
+    start = time.time()
+    for _ in range(number):
+        db.as_of(changes - KEYS / 2)
+    as_of = (time.time() - start) / number
+
+    return history, as_of
+
+
+if __name__ == '__main__':
+
+    folder = tempfile.mkdtemp()
+
+    try:
+        without = bench_writes(folder, False)
+        with_log = bench_writes(folder, True)
+
+        print('setsetting, no change log      %8.3f ms' % (without * 1000))
+        print('setsetting, change log         %8.3f ms  (+%.3f ms)' % (with_log * 1000, (with_log - without) * 1000))
+
+        for changes in LOG_SIZES:
+            history, as_of = bench_lookups(folder, changes)
+            print('%7s changes: history(key) %8.3f ms, as_of %8.3f ms' % (changes, history * 1000, as_of * 1000))
+
+    finally:
+        shutil.rmtree(folder)
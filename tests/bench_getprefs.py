@@ -0,0 +1,68 @@
+''' Benchmark of looking a setting up, as osmc_getprefs does.
+
+    python bench_getprefs.py
+
+Times opening the database and reading one setting read-write, which is how osmc_getprefs opened
+it before, read only, and immutable. Then times the same while another connection holds the write
+lock of a commit for HOLD seconds, which a read only lookup waits out like any reader, and an
+immutable one does not.
+'''
+import env
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import timeit
+
+from lib.database import DBInterface
+
+KEYS = 1000
+HOLD = 0.05
+
+
+def lookup(**kwargs):
+
+    DBInterface(**kwargs).getsetting('key500')
+
+
+def timing(kwargs, number=500):
+
+    return min(timeit.repeat(lambda: lookup(**kwargs), number=number, repeat=3)) / number
+
+
+def locked_timing(dbpath, kwargs):
+
+    writer = sqlite3.connect(dbpath, isolation_level=None, check_same_thread=False)
+    writer.execute('BEGIN EXCLUSIVE')
+
+    release = threading.Timer(HOLD, writer.execute, ['ROLLBACK'])
+    release.start()
+
+    try:
+        start = time.time()
+        lookup(**kwargs)
+        return time.time() - start
+    finally:
+        release.join()
+        writer.close()
+
+
+if __name__ == '__main__':
+
+    folder = tempfile.mkdtemp()
+
+    try:
+        os.environ['DBPATH'] = os.path.join(folder, 'getprefs.db')
+
+        DBInterface(preload=dict(('key%s' % index, index) for index in range(KEYS)))
+
+        modes = [('read-write', {}), ('read only', {'read_only': True}), ('immutable', {'immutable': True})]
+
+        for name, kwargs in modes:
+            print('%-12s lookup %8.1f us, under a %d ms write lock %8.1f ms' % (
+                name, timing(kwargs) * 1e6, HOLD * 1000, locked_timing(os.environ['DBPATH'], kwargs) * 1000))
+
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,33 @@
+''' Benchmark of the start up imports of the addon.
+
+    python bench_import_time.py
+
+Imports each entry point in a fresh interpreter, as tests/test_import_time.py does, and reports the
+time each took, slowest first, against BUDGET_SECONDS for all of them, then the modules pulled in.
+Exits with 1 when the imports are over budget, so that it can fail a build.
+'''
+import env
+import sys
+
+from test_import_time import measure_imports
+
+# generous, as machines vary; a normal run takes a fraction of this
+BUDGET_SECONDS = 0.25
+
+
+if __name__ == '__main__':
+
+    result = measure_imports()
+
+    for name, seconds in sorted(result['timings'].items(), key=lambda x: x[1], reverse=True):
+        print('%-20s %8.2f ms' % (name, seconds * 1000))
+
+    total = sum(result['timings'].values())
+    over = total >= BUDGET_SECONDS
+    print('%-20s %8.2f ms, budget %.2f ms%s' % ('total', total * 1000, BUDGET_SECONDS * 1000,
+                                                 ', OVER BUDGET' if over else ''))
+
+    print('\n'.join(result['modules']))
+
+    if over:
+        sys.exit(1)
@@ -0,0 +1,71 @@
+''' Benchmark of the MASTER_SETTINGS start up and per-read costs.
+
+    python bench_master_settings.py
+
+Cold start compares importing the literal with loading the precompiled artifact, each
+in a fresh interpreter. Per read times _generate_list_of_settings, which runs on every
+read of the config.txt, with and without the shared pattern cache.
+'''
+import env
+import os
+import re
+import subprocess
+import sys
+import timeit
+
+import lib.piconfig.piSettings as piSettings
+from lib.piconfig import ConfigFileInterface
+
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+COLD_START = {
+    'literal': 'from lib.piconfig.MasterSettings import MASTER_SETTINGS; '
+               'from lib.piconfig.CompiledSettings import compile_settings; compile_settings(MASTER_SETTINGS)',
+    'artifact': 'from lib.piconfig.CompiledSettings import load_master_settings; load_master_settings()',
+}
+
+COLD_START_SCRIPT = '''
+import sys, time
+sys.path.insert(0, %r)
+import env
+start = time.time()
+%s
+print(time.time() - start)
+'''
+
+
+def cold_start(statement, runs=20):
+
+    script = COLD_START_SCRIPT % (TESTS_FOLDER, statement)
+
+    timings = [float(subprocess.check_output([sys.executable, '-c', script], cwd=TESTS_FOLDER)) for _ in range(runs)]
+
+    return min(timings)
+
+
+def per_read(number=200):
+
+    interface = ConfigFileInterface()
+
+    cached = min(timeit.repeat(interface._generate_list_of_settings, number=number, repeat=3)) / number
+
+    # compiling every pattern afresh, as add_pattern did before the shared cache
+    def uncached():
+        piSettings._COMPILED_PATTERNS.clear()
+        re.purge()
+        interface._generate_list_of_settings()
+
+    uncached = min(timeit.repeat(uncached, number=number, repeat=3)) / number
+
+    return cached, uncached
+
+
+if __name__ == '__main__':
+
+    for name, statement in sorted(COLD_START.items()):
+        print('cold start, %-10s %8.3f ms' % (name, cold_start(statement) * 1000))
+
+    cached, uncached = per_read()
+    print('per read, cached      %8.3f ms' % (cached * 1000))
+    print('per read, uncompiled  %8.3f ms' % (uncached * 1000))
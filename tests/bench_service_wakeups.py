@@ -0,0 +1,66 @@
+''' Measures the idle cost of the settings service, as wakeups per hour.
+
+    python bench_service_wakeups.py [seconds]
+
+The service is run against a temporary config.txt and preferences database, once
+with inotify and once with the mtime polling fallback, with the polling interval
+shortened so that the difference shows within a short run.
+'''
+import env
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from mock import patch
+
+from lib.SettingsService import SettingsService
+from lib.common.filewatcher import FileWatcher
+from lib.database import DBInterface
+
+
+def measure(seconds, use_inotify, poll_interval=1):
+
+    tmp = tempfile.mkdtemp()
+
+    try:
+        os.environ['DBPATH'] = os.path.join(tmp, 'preferences.db')
+
+        config = os.path.join(tmp, 'config.txt')
+        with open(config, 'w') as f:
+            f.write('start_x=1\n')
+
+        db = DBInterface()
+        watcher = FileWatcher([config, db.dbpath], poll_interval=poll_interval, use_inotify=use_inotify)
+
+        service = SettingsService(lambda key, value: None, location=config, db=db, watcher=watcher)
+
+        with patch('sys.stdout'):
+            runner = threading.Thread(target=service.run)
+            runner.start()
+
+            # let the start up reads settle, then count only the idle wakeups
+            time.sleep(0.5)
+            before = watcher.wakeups
+            time.sleep(seconds)
+            idle_wakeups = watcher.wakeups - before
+
+            service.stop()
+            runner.join()
+
+        return idle_wakeups * 3600.0 / seconds, service.parses
+
+    finally:
+        del os.environ['DBPATH']
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    for name, use_inotify in (('inotify', True), ('polling (1s)', False)):
+        per_hour, parses = measure(seconds, use_inotify)
+        print('%-15s %10.0f wakeups/hour   parses: %s' % (name, per_hour, parses))
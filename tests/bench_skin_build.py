@@ -0,0 +1,239 @@
+''' Benchmark of the skin build, over every window xml in skins/Default/1080i_raw.
+
+    python bench_skin_build.py
+
+The include expansion is compared with the first approach, which ran a separate
+uncompiled re.subn per include, five times over every file; the tree expansion is timed
+with the parse of each file.
+
+The colour substitution is compared with the first approach, which ran a re.subn
+per colour and format over every file; again the tree is timed with its parse.
+
+The control defaults are compared with the previous approach, which walked every
+element and appended the same default elements to every control, on windows of
+CONTROLS controls; the time per control should stay flat as the windows grow.
+
+The whole build is timed with build_skin, which parses and serializes each file once,
+along with the time it spends in each stage.
+
+The incremental build is measured on a synthetic skin of WINDOWS copies of the raw
+windows: a full build, serially and in a pool, a rebuild with nothing changed, and a
+rebuild after one window has changed.
+'''
+import env
+import os
+import re
+import shutil
+import tempfile
+import time
+import timeit
+
+from test_insert_inclusions import build, RAW_FOLDER
+
+
+def legacy_expand_includes(contents, inclusions):
+
+    for _ in range(5):
+        for include_tag, guts in inclusions.iteritems():
+            contents, count = re.subn('<include>\s*' + include_tag + '.*</include>', guts, contents, re.MULTILINE)
+
+    return contents
+
+
+def bench_includes(number=50):
+
+    definitions = build.load_include_definitions()
+    inclusions = dict((name, ''.join(build.ET.tostring(x) for x in child)) for name, child in definitions.iteritems())
+
+    contents = []
+    for fyle in build.window_files():
+        with open(os.path.join(RAW_FOLDER, fyle), 'r') as f:
+            contents.append(f.read())
+
+    def legacy():
+        for c in contents:
+            legacy_expand_includes(c, inclusions)
+            re.purge()
+
+    def tree():
+        resolved, usage = build.resolve_include_trees(definitions)
+        for c in contents:
+            build.expand_tree_includes(build.ET.fromstring(c), resolved, usage, {})
+
+    return [(name, min(timeit.repeat(fn, number=number, repeat=3)) / number)
+            for name, fn in (('includes, legacy', legacy), ('includes, tree', tree))]
+
+
+def legacy_replace_colours(contents, colours):
+
+    formats = [('>', '</', '>', '</'),
+               ('>\$VAR\[', '\]</', '>', '</'),
+               ('colordiffuse="$VAR[', ']"', 'colordiffuse="', '"'),
+               ('colordiffuse="', '"', 'colordiffuse="', '"')]
+
+    record = {}
+
+    for colour_name, colour_code in colours.iteritems():
+        record[colour_name] = 0
+        for (left, right, repleft, repright) in formats:
+            contents, count = re.subn(left + colour_name + right, repleft + colour_code + repright, contents, re.MULTILINE)
+            record[colour_name] += count
+
+    return contents, record
+
+
+def bench_colours(number=50):
+
+    skin = build.load_skin()
+    colours = skin['colours']
+
+    # the windows as the colours find them, with the includes and control defaults applied
+    contents = []
+    for fyle in build.window_files():
+        root = build.ET.parse(os.path.join(RAW_FOLDER, fyle)).getroot()
+        build.expand_tree_includes(root, skin['resolved'], skin['usage'], {})
+        build.apply_control_defaults(root, skin['control_defaults'])
+        contents.append(build.ET.tostring(root))
+
+    for c in contents:
+        root = build.ET.fromstring(c)
+        record = dict((name, 0) for name in colours)
+        build.apply_colours(root, colours, record)
+        assert build.ET.tostring(root) == legacy_replace_colours(c, colours)[0]
+        assert record == legacy_replace_colours(c, colours)[1]
+
+    def legacy():
+        for c in contents:
+            legacy_replace_colours(c, colours)
+
+    def tree():
+        for c in contents:
+            build.apply_colours(build.ET.fromstring(c), colours, {})
+
+    return [(name, min(timeit.repeat(fn, number=number, repeat=3)) / number)
+            for name, fn in (('colours, legacy', legacy), ('colours, tree', tree))]
+
+
+CONTROLS = [100, 1000, 10000]
+
+
+def legacy_apply_control_defaults(root, control_defaults):
+
+    for element in root.getiterator():
+        try:
+            typ = element.attrib['type']
+        except:
+            continue
+
+        existing_tags = [x.tag for x in element.getchildren()]
+
+        for dlm in control_defaults.get(typ, []):
+            if dlm.tag not in existing_tags:
+                element.append(dlm)
+
+
+def bench_control_defaults(sizes=CONTROLS, number=5):
+
+    control_defaults = build.load_control_defaults()
+    legacy_defaults = dict((typ, templates) for typ, (tags, templates) in control_defaults.iteritems())
+
+    control = ('<control type="%s"><posx>0</posx><label>x</label><animation effect="fade" type="Visible" />'
+               '<visible>true</visible></control>')
+    types = sorted(control_defaults) + ['image', 'group']
+
+    results = []
+
+    for size in sizes:
+        window = '<window><controls>%s</controls></window>' % ''.join(control % types[i % len(types)] for i in range(size))
+
+        for name, apply in (('legacy', legacy_apply_control_defaults), ('indexed', build.apply_control_defaults)):
+            defaults = legacy_defaults if apply is legacy_apply_control_defaults else control_defaults
+            seconds = min(timeit.repeat(lambda: apply(build.ET.fromstring(window), defaults), number=number, repeat=3)) / number
+            parse = min(timeit.repeat(lambda: build.ET.fromstring(window), number=number, repeat=3)) / number
+            results.append(('defaults, %s, each of %s' % (name, size), (seconds - parse) / size))
+
+    return results
+
+
+def bench_build(number=20):
+
+    dest = tempfile.mkdtemp()
+
+    try:
+        results = [('build', min(timeit.repeat(lambda: build.build_skin(dest=dest), number=number, repeat=3)) / number)]
+
+        totals = dict((stage, 0.0) for stage in build.STAGES)
+        for _ in range(number):
+            records, timings = build.build_skin(dest=dest)
+            for stage, seconds in timings.iteritems():
+                totals[stage] += seconds
+
+        results += [('  ' + stage, totals[stage] / number) for stage in build.STAGES]
+
+    finally:
+        shutil.rmtree(dest)
+
+    return results
+
+
+WINDOWS = 300
+
+
+def synthetic_skin(folder, windows=WINDOWS):
+
+    raw = build.window_files()
+
+    for fyle in build.SHARED_FILES:
+        shutil.copy(os.path.join(RAW_FOLDER, fyle), folder)
+
+    for index in range(windows):
+        shutil.copy(os.path.join(RAW_FOLDER, raw[index % len(raw)]), os.path.join(folder, 'Window%03d.xml' % index))
+
+
+def bench_incremental(windows=WINDOWS):
+
+    folder = tempfile.mkdtemp()
+    dest = tempfile.mkdtemp()
+
+    def timed(name, fn):
+        start = time.time()
+        fn()
+        results.append((name, time.time() - start))
+
+    results = []
+
+    try:
+        synthetic_skin(folder, windows)
+
+        timed('%s windows, serial' % windows, lambda: build.build_skin(folder, dest, processes=1))
+        timed('%s windows, pool of %s' % (windows, build.multiprocessing.cpu_count()),
+              lambda: build.build_skin(folder, dest, processes=None))
+
+        timed('incremental, first build', lambda: build.incremental_build(folder, dest))
+        timed('incremental, nothing changed', lambda: build.incremental_build(folder, dest))
+
+        with open(os.path.join(folder, 'Window000.xml'), 'a') as f:
+            f.write('\n')
+
+        timed('incremental, one changed', lambda: build.incremental_build(folder, dest))
+
+        # once the files are older than the last build, their mtime and size are trusted
+        time.sleep(build.RACY_SECONDS + 1)
+        build.incremental_build(folder, dest)
+        timed('incremental, nothing changed*', lambda: build.incremental_build(folder, dest))
+
+    finally:
+        shutil.rmtree(folder)
+        shutil.rmtree(dest)
+
+    return results
+
+
+if __name__ == '__main__':
+
+    print('%s window files' % len(build.window_files()))
+
+    for name, seconds in bench_includes() + bench_colours() + bench_control_defaults() + bench_build() + bench_incremental():
+        print('%-30s %8.3f ms' % (name, seconds * 1000))
+
+    print('* without hashing, after the files have settled')
@@ -0,0 +1,75 @@
+''' Benchmark of applying changes to a parsed config.txt.
+
+    python bench_update_settings.py
+
+Times update_settings and render_config_txt for one changed setting, given either just that
+setting or every setting (as the settings page does), against converting every setting,
+which is what update_settings did before the doc was indexed, and the plan of one
+setting, which the settings page can make on every keypress.
+'''
+import env
+import os
+import sys
+import timeit
+
+from StringIO import StringIO
+
+from lib.piconfig import ConfigFileInterface
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'script.MyOSMC', 'resources', 'lib',
+                      'piconfig', 'samples', 'config_05.txt')
+
+
+def parse():
+
+    # the parse prints every line it assigns
+    stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        interface = ConfigFileInterface(SAMPLE)
+        return interface, interface.read_config_txt()
+    finally:
+        sys.stdout = stdout
+
+
+def timing(statement, number=2000):
+
+    return min(timeit.repeat(statement, number=number, repeat=3)) / number
+
+
+if __name__ == '__main__':
+
+    interface, doc = parse()
+
+    every = dict((name, str(lines[0]['setting'].current_config_value)) for name, lines in doc.lines.items())
+
+    values = ['128', '144']
+
+    def one_setting():
+        values.reverse()
+        interface.update_settings(doc, {'gpu_mem_1024': values[0]})
+        interface.render_config_txt(doc)
+
+    def every_setting():
+        values.reverse()
+        every['gpu_mem_1024'] = values[0]
+        interface.update_settings(doc, every)
+        interface.render_config_txt(doc)
+
+    def convert_all():
+        values.reverse()
+        every['gpu_mem_1024'] = values[0]
+        for config_lines in doc.lines.values():
+            for config_line in config_lines:
+                setting = config_line['setting']
+                setting.set_new_value(every[setting.name])
+        interface.render_config_txt(doc)
+
+    def plan():
+        values.reverse()
+        interface.plan({'gpu_mem_1024': values[0]}, doc)
+
+    print('%d settings, %d lines' % (len(doc.lines), len(doc)))
+    print('one setting given      %8.1f us' % (timing(one_setting) * 1e6))
+    print('every setting given    %8.1f us' % (timing(every_setting) * 1e6))
+    print('converting every one   %8.1f us' % (timing(convert_all) * 1e6))
+    print('plan of one setting    %8.1f us' % (timing(plan) * 1e6))
@@ -9,6 +9,7 @@
 
 import os
 import sys
+import tempfile
 
 from mock import Mock
 
@@ -22,3 +23,6 @@ sys.modules['xbmc'] = Mock()
 sys.modules['xbmcaddon'] = Mock()
 sys.modules['xbmcgui'] = Mock()
 sys.modules['xbmccvfs'] = Mock()
+
+# keeps the metrics recorded while testing out of the real metrics file
+os.environ.setdefault('METRICSPATH', os.path.join(tempfile.gettempdir(), 'myosmc_test_metrics.json'))
@@ -0,0 +1,256 @@
+import env
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from mock import patch
+
+from lib.common.filelock import LockTimeout, write_lock
+from lib.common.openwithbackup import list_backups
+from lib.piconfig.BootConfig import BootConfig, CmdlineFile, JOURNAL_NAME, NEW_SUFFIX
+from lib.piconfig.ConfigFileInterface import ConfigChanged
+
+
+class BootConfigTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+        self._write('config.txt', 'gpu_mem_1024=256\ninclude extra.txt\nstart_x=1\n')
+        self._write('extra.txt', 'start_x=0\nhdmi_group=1\ninclude nested.txt\n')
+        self._write('nested.txt', 'hdmi_mode=4\n')
+        self._write('vendor.txt', 'arm_freq=800\n')
+        self._write('cmdline.txt', 'root=/dev/mmcblk0p2 quiet osmcdev=rbp2\n')
+
+    def _write(self, name, content):
+
+        with open(os.path.join(self.folder, name), 'w') as f:
+            f.write(content)
+
+    def _read(self, name):
+
+        with open(os.path.join(self.folder, name), 'r') as f:
+            return f.read()
+
+    def _path(self, name):
+
+        return os.path.join(self.folder, name)
+
+    def test_merged_view(self):
+
+        boot = BootConfig(self.folder, includes=['vendor.txt'])
+        settings = boot.read()
+
+        # the config.txt sets start_x after its include, so its value is the one the firmware sees
+        self.assertEqual(str(settings['start_x']), '1')
+        self.assertEqual(boot.sources['start_x'], self._path('config.txt'))
+
+        self.assertEqual(str(settings['hdmi_group']), '1')
+        self.assertEqual(boot.sources['hdmi_group'], self._path('extra.txt'))
+
+        # found in the second round of reads, as it is included by an included file
+        self.assertEqual(boot.sources['hdmi_mode'], self._path('nested.txt'))
+
+        self.assertEqual(str(settings['arm_freq']), '800')
+        self.assertEqual(boot.sources['arm_freq'], self._path('vendor.txt'))
+
+        self.assertEqual(settings['cmdline.root'], '/dev/mmcblk0p2')
+        self.assertIsNone(settings['cmdline.quiet'])
+
+        # settings in none of the files have their defaults, and no source
+        self.assertIn('gpu_mem_512', settings)
+        self.assertNotIn('gpu_mem_512', boot.sources)
+
+        self.assertEqual(boot.errors, [])
+
+    def test_threads(self):
+
+        self.assertEqual(BootConfig(self.folder, threads=1).read(), BootConfig(self.folder, threads=4).read())
+
+    def test_errors(self):
+
+        self._write('extra.txt', 'include missing.txt\n')
+        self._write('cmdline.txt', 'root=/dev/mmcblk0p2\nquiet\n')
+
+        boot = BootConfig(self.folder)
+        boot.read()
+
+        self.assertEqual(len(boot.errors), 2)
+        self.assertIn('%s does not exist' % self._path('missing.txt'), boot.errors)
+
+    def test_include_loop(self):
+
+        self._write('nested.txt', 'include extra.txt\n')
+
+        boot = BootConfig(self.folder)
+        boot.read()
+
+        self.assertEqual(boot.sources['hdmi_group'], self._path('extra.txt'))
+
+    def test_write_changed_files_only(self):
+
+        boot = BootConfig(self.folder)
+        boot.read()
+
+        written = boot.write({'hdmi_group': '2', 'cmdline.quiet': False, 'cmdline.splash': None, 'gpu_mem_1024': '256'})
+
+        self.assertEqual(written, [self._path('cmdline.txt'), self._path('extra.txt')])
+
+        self.assertEqual(self._read('config.txt'), 'gpu_mem_1024=256\ninclude extra.txt\nstart_x=1\n')
+        self.assertEqual(self._read('extra.txt'), 'start_x=0\nhdmi_group=2\ninclude nested.txt\n')
+        self.assertEqual(self._read('cmdline.txt'), 'root=/dev/mmcblk0p2 osmcdev=rbp2 splash\n')
+
+        self.assertEqual(str(boot.settings['hdmi_group']), '2')
+        self.assertNotIn('cmdline.quiet', boot.settings)
+
+        # nothing is left behind by the commit
+        self.assertEqual(sorted(x for x in os.listdir(self.folder) if x.endswith(NEW_SUFFIX) or x == JOURNAL_NAME), [])
+
+        # writing the same values again changes nothing
+        self.assertEqual(boot.write({'hdmi_group': '2'}), [])
+
+    def test_write_new_setting_to_config_txt(self):
+
+        boot = BootConfig(self.folder)
+        boot.read()
+
+        self.assertEqual(boot.write({'hdmi_safe': 'true'}), [self._path('config.txt')])
+        self.assertIn('hdmi_safe=1\n', self._read('config.txt'))
+        self.assertEqual(boot.sources['hdmi_safe'], self._path('config.txt'))
+
+    def test_write_unknown_setting(self):
+
+        boot = BootConfig(self.folder)
+        boot.read()
+
+        with self.assertRaises(KeyError):
+            boot.write({'hdmi_group': '2', 'no_such_setting': '1'})
+
+        self.assertEqual(self._read('extra.txt'), 'start_x=0\nhdmi_group=1\ninclude nested.txt\n')
+
+    def test_interrupted_commit_is_finished(self):
+
+        boot = BootConfig(self.folder)
+        boot.read()
+
+        # the journal is written, but only the first of the files is renamed into place
+        with patch('os.rename', side_effect=self._renames_until(1)):
+            with self.assertRaises(OSError):
+                boot.write({'hdmi_group': '2', 'cmdline.quiet': False})
+
+        self.assertTrue(os.path.exists(self._path(JOURNAL_NAME)))
+
+        settings = BootConfig(self.folder).read()
+
+        self.assertEqual(str(settings['hdmi_group']), '2')
+        self.assertNotIn('cmdline.quiet', settings)
+        self.assertFalse(os.path.exists(self._path(JOURNAL_NAME)))
+
+    def test_uncommitted_contents_are_discarded(self):
+
+        boot = BootConfig(self.folder)
+        boot.read()
+
+        # the new contents are written, but the journal is not
+        with patch('os.rename', side_effect=self._renames_until(0)):
+            with self.assertRaises(OSError):
+                boot.write({'hdmi_group': '2', 'cmdline.quiet': False})
+
+        self.assertTrue(os.path.exists(self._path('extra.txt' + NEW_SUFFIX)))
+
+        boot = BootConfig(self.folder)
+        settings = boot.read()
+
+        self.assertEqual(str(settings['hdmi_group']), '1')
+        self.assertIn('cmdline.quiet', settings)
+
+        # the leftovers of the files it has read are removed
+        self.assertEqual(boot.recover(), [])
+        self.assertFalse(os.path.exists(self._path('extra.txt' + NEW_SUFFIX)))
+
+    def test_read_keeps_commits_out(self):
+
+        journal = self._path(JOURNAL_NAME)
+        read = CmdlineFile.read
+        committed = []
+
+        def commit_while_reading(fyle):
+            # a commit takes the exclusive lock on the journal before it changes anything
+            try:
+                with write_lock(journal, timeout=0):
+                    committed.append(fyle.path)
+            except LockTimeout:
+                pass
+            return read(fyle)
+
+        with patch.object(CmdlineFile, 'read', commit_while_reading):
+            BootConfig(self.folder, threads=1).read()
+
+        self.assertEqual(committed, [])
+
+    def test_read_without_journal_takes_no_exclusive_lock(self):
+
+        # the package exports the class under the name of its module
+        module = sys.modules[BootConfig.__module__]
+
+        with patch.object(module, 'write_lock', wraps=module.write_lock) as exclusive:
+            BootConfig(self.folder).read()
+
+        self.assertFalse(exclusive.called)
+
+    def _renames_until(self, count):
+
+        # lets the journal and count files be renamed into place, then fails like a power cut
+        rename = os.rename
+        allowed = [count]
+
+        def renamer(source, destination):
+            if not source.endswith(JOURNAL_NAME + NEW_SUFFIX):
+                if not allowed[0]:
+                    raise OSError('power cut')
+                allowed[0] -= 1
+            elif count == 0:
+                raise OSError('power cut')
+            rename(source, destination)
+
+        return renamer
+
+    def test_changed_file_is_not_written(self):
+
+        boot = BootConfig(self.folder)
+        boot.read()
+
+        # another process changes one of the files after they were read
+        self._write('extra.txt', 'start_x=0\nhdmi_group=1\narm_freq=900\ninclude nested.txt\n')
+
+        with self.assertRaises(ConfigChanged):
+            boot.write({'hdmi_group': '2', 'cmdline.quiet': False})
+
+        # none of the group is written
+        self.assertIn('quiet', self._read('cmdline.txt'))
+        self.assertEqual(sorted(x for x in os.listdir(self.folder) if x.endswith(NEW_SUFFIX) or x == JOURNAL_NAME), [])
+
+        # the files were read again, so the same write now goes on top of the change
+        self.assertEqual(boot.write({'hdmi_group': '2', 'cmdline.quiet': False}),
+                         [self._path('cmdline.txt'), self._path('extra.txt')])
+        self.assertEqual(self._read('extra.txt'), 'start_x=0\nhdmi_group=2\narm_freq=900\ninclude nested.txt\n')
+
+    def test_backups(self):
+
+        backups = os.path.join(self.folder, 'backups')
+
+        with patch.dict(os.environ, {'BACKUPPATH': backups}):
+            boot = BootConfig(self.folder, backups=True)
+            boot.read()
+            boot.write({'hdmi_group': '2'})
+
+            self.assertEqual(len(list_backups(self._path('extra.txt'))), 1)
+            self.assertEqual(list_backups(self._path('config.txt')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
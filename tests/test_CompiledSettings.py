@@ -0,0 +1,93 @@
+import env
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+import lib.piconfig.CompiledSettings as CompiledSettings
+from lib.piconfig.CompiledSettings import validate, compile_settings, write_artifact, read_artifact, \
+    load_master_settings, source_hash, ARTIFACT_FILE
+from lib.piconfig.MasterSettings import MASTER_SETTINGS
+
+
+def good_setting(**changes):
+    setting = {
+        "type": "range",
+        "default": "5",
+        "sprssDef": True,
+        "stub": "thing=%s",
+        "valid": [1, 10],
+        "patterns": [{"id_pattern": r"\s*thing\s*=", "ext_pattern": r"\s*thing\s*=\s*(\d+)"}],
+    }
+    setting.update(changes)
+    return {'thing': setting}
+
+
+class ValidateTest(unittest.TestCase):
+
+    def test_master_settings_valid(self):
+        self.assertEqual(validate(MASTER_SETTINGS), [])
+
+    def test_good_setting(self):
+        self.assertEqual(validate(good_setting()), [])
+
+    def test_unknown_type(self):
+        self.assertEqual(len(validate(good_setting(type='nonsense'))), 1)
+
+    def test_missing_attribute(self):
+        settings = good_setting()
+        del settings['thing']['stub']
+        self.assertEqual(len(validate(settings)), 1)
+
+    def test_bad_pattern(self):
+        patterns = [{"id_pattern": r"\s*thing(\s*=", "ext_pattern": r"\s*thing\s*=\s*\d+"}]
+        self.assertEqual(len(validate(good_setting(patterns=patterns))), 2)
+
+    def test_bad_default(self):
+        self.assertEqual(len(validate(good_setting(default='50'))), 1)
+        self.assertEqual(len(validate(good_setting(type='range_var', default={'PiB': 5, 'Pi2': 50}))), 1)
+
+    def test_unset_default(self):
+        self.assertEqual(validate(good_setting(default='')), [])
+
+
+class ArtifactTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.tmp = tempfile.mkdtemp()
+        self.artifact = os.path.join(self.tmp, 'MasterSettings.compiled')
+        CompiledSettings._loaded = None
+
+    def tearDown(self):
+
+        CompiledSettings._loaded = None
+        shutil.rmtree(self.tmp)
+
+    def test_shipped_artifact_is_current(self):
+        self.assertIsNotNone(read_artifact(source_hash()),
+                             msg='MasterSettings.compiled is stale, run CompiledSettings.py to rebuild it')
+
+    def test_round_trip(self):
+        write_artifact(MASTER_SETTINGS, 'digest', artifact_file=self.artifact)
+        self.assertEqual(read_artifact('digest', artifact_file=self.artifact), compile_settings(MASTER_SETTINGS))
+
+    def test_hash_mismatch(self):
+        write_artifact(MASTER_SETTINGS, 'digest', artifact_file=self.artifact)
+        self.assertIsNone(read_artifact('other', artifact_file=self.artifact))
+
+    def test_missing_artifact(self):
+        self.assertIsNone(read_artifact('digest', artifact_file=self.artifact))
+
+    def test_fallback_to_literal(self):
+        with patch.object(CompiledSettings, 'ARTIFACT_FILE', self.artifact):
+            with patch('lib.piconfig.CompiledSettings.read_artifact', return_value=None):
+                self.assertEqual(load_master_settings(), compile_settings(MASTER_SETTINGS))
+
+    def test_loaded_once(self):
+        with patch('lib.piconfig.CompiledSettings.read_artifact', wraps=read_artifact) as reader:
+            load_master_settings()
+            load_master_settings()
+            self.assertEqual(reader.call_count, 1)
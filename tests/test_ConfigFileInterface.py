@@ -0,0 +1,323 @@
+import env
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from lib.piconfig.ConfigFileInterface import ConfigFileInterface, ConfigDoc, ConfigChanged
+from lib.piconfig.piSettings import piSetting
+
+CONFIG = '''# a comment
+gpu_mem_1024=256
+hdmi_group=1
+some_unknown_line=3
+start_x=0
+start_x=1
+'''
+
+
+class ConfigFixture(object):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+        self.location = os.path.join(self.folder, 'config.txt')
+
+        with open(self.location, 'w') as f:
+            f.write(CONFIG)
+
+        self.interface = ConfigFileInterface(self.location)
+        self.doc = self.interface.read_config_txt()
+
+    def _read(self):
+
+        with open(self.location, 'r') as f:
+            return f.read()
+
+
+class UpdateSettingsTest(ConfigFixture, unittest.TestCase):
+
+    def test_index(self):
+
+        self.assertIsInstance(self.doc, ConfigDoc)
+
+        self.assertEqual([x['original'] for x in self.doc.lines['gpu_mem_1024']], ['gpu_mem_1024=256\n'])
+
+        # settings not in the file are indexed on their appended line
+        self.assertEqual([x['original'] for x in self.doc.lines['gpu_mem_512']], ['NULL'])
+
+        self.assertNotIn('passthrough', self.doc.lines)
+        self.assertNotIn('dupe', self.doc.lines)
+
+        self.assertEqual(self.doc.dirty, set())
+
+    def test_partial_update_with_passthrough_and_dupe_lines(self):
+
+        with patch.object(piSetting, 'set_new_value', autospec=True, side_effect=piSetting.set_new_value) as converted:
+            self.interface.update_settings(self.doc, {'gpu_mem_1024': '128', 'not_a_setting': '1'})
+
+        self.assertEqual(converted.call_count, 1)
+        self.assertEqual(self.doc.dirty, set(['gpu_mem_1024']))
+
+    def test_unchanged_values_are_not_dirty(self):
+
+        self.interface.update_settings(self.doc, {'gpu_mem_1024': '256', 'hdmi_group': '1'})
+
+        self.assertEqual(self.doc.dirty, set())
+
+        # a setting changed and then changed back is clean again
+        self.interface.update_settings(self.doc, {'gpu_mem_1024': '128'})
+        self.interface.update_settings(self.doc, {'gpu_mem_1024': '256'})
+
+        self.assertEqual(self.doc.dirty, set())
+
+    def test_repeated_values_are_not_converted(self):
+
+        self.interface.update_settings(self.doc, {'gpu_mem_1024': '128'})
+
+        with patch.object(piSetting, 'set_new_value') as converted:
+            self.interface.update_settings(self.doc, {'gpu_mem_1024': '128'})
+
+        self.assertFalse(converted.called)
+        self.assertEqual(self.doc.dirty, set(['gpu_mem_1024']))
+
+    def test_failed_conversion_is_retried(self):
+
+        with patch.object(piSetting, 'set_new_value', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                self.interface.update_settings(self.doc, {'gpu_mem_1024': '128'})
+
+        self.assertNotIn('gpu_mem_1024', self.doc.applied)
+
+        # the same value is converted again, rather than taken as applied
+        self.interface.update_settings(self.doc, {'gpu_mem_1024': '128'})
+
+        self.assertEqual(self.doc.applied['gpu_mem_1024'], '128')
+        self.assertEqual(self.doc.dirty, set(['gpu_mem_1024']))
+
+    def test_clean_doc_is_not_written(self):
+
+        self.interface.update_settings(self.doc, {'gpu_mem_1024': '256'})
+
+        with patch('__builtin__.open') as opened:
+            self.assertFalse(self.interface.write_config_txt(self.doc))
+
+        self.assertFalse(opened.called)
+
+    def test_only_dirty_settings_are_rewritten(self):
+
+        self.interface.update_settings(self.doc, {'gpu_mem_1024': '128', 'hdmi_group': '1'})
+
+        self.assertTrue(self.interface.write_config_txt(self.doc))
+
+        # the duplicate start_x is commented out, and the other lines are as they were
+        self.assertEqual(self._read(), CONFIG.replace('gpu_mem_1024=256', 'gpu_mem_1024=128')
+                                             .replace('start_x=0', '#start_x=0'))
+
+
+class PlanTest(ConfigFixture, unittest.TestCase):
+
+    def test_plan_without_io(self):
+
+        with patch('__builtin__.open') as opened:
+            plan = self.interface.plan({'gpu_mem_1024': '128'})
+
+        self.assertFalse(opened.called)
+
+        self.assertEqual(plan.base, CONFIG)
+        self.assertEqual(plan.contents, CONFIG.replace('gpu_mem_1024=256', 'gpu_mem_1024=128')
+                                              .replace('start_x=0', '#start_x=0'))
+        self.assertEqual(plan.diff, [(2, 'gpu_mem_1024=256\n', 'gpu_mem_1024=128\n'), (5, 'start_x=0\n', '#start_x=0\n')])
+        self.assertEqual(plan.changed, set(['gpu_mem_1024']))
+
+        # the cached doc is left as it was
+        self.assertEqual(self.doc.dirty, set())
+        self.assertIsNone(self.doc.lines['gpu_mem_1024'][0]['setting'].new_value)
+
+    def test_plan_reads_once(self):
+
+        interface = ConfigFileInterface(self.location)
+
+        with patch.object(interface, 'read_config_txt', wraps=interface.read_config_txt) as reader:
+            interface.plan({'gpu_mem_1024': '128'})
+            interface.plan({'gpu_mem_1024': '144'})
+
+        self.assertEqual(reader.call_count, 1)
+
+    def test_plan_matches_update_and_write(self):
+
+        new_settings = {'gpu_mem_1024': '128', 'hdmi_safe': 'true', 'start_x': 'true'}
+
+        plan = self.interface.plan(new_settings)
+
+        self.interface.update_settings(self.doc, new_settings)
+
+        self.assertEqual(plan.lines, self.interface.render_config_txt(self.doc))
+        self.assertIn((None, None, 'hdmi_safe=1\n'), plan.diff)
+
+    def test_suppressed_defaults(self):
+
+        with open(self.location, 'w') as f:
+            f.write('gpu_mem_1024=128\n')
+
+        self.interface.read_config_txt()
+
+        plan = self.interface.plan({'gpu_mem_1024': '256'})
+
+        self.assertEqual(plan.suppressed, set(['gpu_mem_1024']))
+        self.assertEqual(plan.contents, '')
+        self.assertEqual(plan.diff, [(1, 'gpu_mem_1024=128\n', None)])
+
+    def test_validation_failures(self):
+
+        plan = self.interface.plan({'gpu_mem_1024': '999', 'hdmi_group': '1'})
+
+        self.assertEqual(plan.failures, {'gpu_mem_1024': '999'})
+        self.assertEqual(plan.changed, set())
+        self.assertEqual(plan.contents, CONFIG)
+        self.assertEqual(plan.diff, [])
+
+    def test_apply(self):
+
+        plan = self.interface.plan({'gpu_mem_1024': '128'})
+
+        self.assertTrue(self.interface.apply(plan))
+        self.assertEqual(self._read(), plan.contents)
+
+        # the written file is the new cached doc, so a plan of the same values changes nothing
+        plan = self.interface.plan({'gpu_mem_1024': '128'})
+
+        self.assertEqual(plan.diff, [])
+
+        with patch('__builtin__.open') as opened:
+            self.assertFalse(self.interface.apply(plan))
+
+        self.assertFalse(opened.called)
+
+
+def write_concurrently(location, name, value, use_plan, read, start, conflicts):
+
+    interface = ConfigFileInterface(location)
+
+    # every process reads the same config.txt before any of them writes
+    doc = interface.read_config_txt()
+    read.put(name)
+    start.wait(10)
+
+    pending = interface.plan({name: value}) if use_plan else interface.update_settings(doc, {name: value})
+    count = 0
+
+    while True:
+        try:
+            if use_plan:
+                interface.apply(pending)
+            else:
+                interface.write_config_txt(pending)
+            break
+        except ConfigChanged as conflict:
+            count += 1
+            pending = interface.rebase(pending, conflict)
+
+    conflicts.put(count)
+
+
+class ConcurrencyTest(ConfigFixture, unittest.TestCase):
+
+    def _change_elsewhere(self):
+
+        with open(self.location, 'w') as f:
+            f.write(CONFIG.replace('hdmi_group=1', 'hdmi_group=2'))
+
+    def test_changed_doc_is_not_written(self):
+
+        self.interface.update_settings(self.doc, {'gpu_mem_1024': '128'})
+
+        self._change_elsewhere()
+
+        with self.assertRaises(ConfigChanged) as raised:
+            self.interface.write_config_txt(self.doc)
+
+        self.assertEqual(raised.exception.current, self._read())
+        self.assertIn('hdmi_group=2', self._read())
+
+        # the changes of both writers are kept
+        doc = self.interface.rebase(self.doc, raised.exception)
+
+        self.assertEqual(doc.dirty, set(['gpu_mem_1024']))
+        self.assertTrue(self.interface.write_config_txt(doc))
+        self.assertIn('gpu_mem_1024=128', self._read())
+        self.assertIn('hdmi_group=2', self._read())
+
+    def test_changed_plan_is_not_applied(self):
+
+        plan = self.interface.plan({'gpu_mem_1024': '128', 'hdmi_group': '1'})
+
+        self._change_elsewhere()
+
+        with self.assertRaises(ConfigChanged) as raised:
+            self.interface.apply(plan)
+
+        # the current config.txt is parsed from the conflict, not read again
+        with patch('__builtin__.open') as opened:
+            plan = self.interface.rebase(plan, raised.exception)
+
+        self.assertFalse(opened.called)
+        self.assertEqual(plan.changed, set(['gpu_mem_1024']))
+
+        self.assertTrue(self.interface.apply(plan))
+        self.assertEqual(self._read(), CONFIG.replace('gpu_mem_1024=256', 'gpu_mem_1024=128')
+                                             .replace('hdmi_group=1', 'hdmi_group=2')
+                                             .replace('start_x=0', '#start_x=0'))
+
+    def test_doc_can_be_written_again(self):
+
+        self.interface.update_settings(self.doc, {'gpu_mem_1024': '128'})
+        self.assertTrue(self.interface.write_config_txt(self.doc))
+
+        self.interface.update_settings(self.doc, {'hdmi_group': '2'})
+        self.assertTrue(self.interface.write_config_txt(self.doc))
+
+        self.assertIn('gpu_mem_1024=128', self._read())
+        self.assertIn('hdmi_group=2', self._read())
+
+    def test_processes_do_not_lose_updates(self):
+
+        changes = [('gpu_mem_1024', '128', 'gpu_mem_1024=128\n'), ('hdmi_group', '2', 'hdmi_group=2\n'),
+                   ('hdmi_safe', 'true', 'hdmi_safe=1\n'), ('arm_freq', '800', 'arm_freq=800\n')]
+
+        read = multiprocessing.Queue()
+        start = multiprocessing.Event()
+        conflicts = multiprocessing.Queue()
+
+        processes = [multiprocessing.Process(target=write_concurrently,
+                                             args=(self.location, name, value, index % 2, read, start, conflicts))
+                     for index, (name, value, line) in enumerate(changes)]
+
+        for process in processes:
+            process.start()
+
+        for process in processes:
+            read.get(timeout=30)
+
+        start.set()
+
+        for process in processes:
+            process.join(30)
+            self.assertEqual(process.exitcode, 0)
+
+        # they all wrote over the same config.txt, so every write but the first found it changed
+        self.assertGreaterEqual(sum(conflicts.get(timeout=1) for process in processes), len(processes) - 1)
+
+        lines = self._read().splitlines(True)
+
+        for name, value, line in changes:
+            self.assertIn(line, lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
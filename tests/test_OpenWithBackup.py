@@ -1,12 +1,274 @@
 import env
+import multiprocessing
 import os
+import shutil
+import tempfile
 import unittest
 
-from lib.common.openwithbackup import OpenWithBackup
+from mock import patch
 
+from lib.common.openwithbackup import OpenWithBackup, flush_pending_backups, wait_for_backups, list_backups, \
+    restore, backup_content
+from lib.common.retention import KeepLastPolicy
 
-class OpenWithBackupTest(unittest.TestCase):
+
+def _remove(args):
+    os.remove(args[-1])
+
+
+def _flush_concurrently(start):
+
+    start.wait(10)
+    flush_pending_backups()
+
+
+def _back_up_concurrently(golden_file, name, start):
+
+    start.wait(10)
+
+    for number in range(10):
+        backup_content(golden_file, '%s %s\n' % (name, number), retention=KeepLastPolicy(100))
+
+
+class BackupFolderFixture(object):
 
     def setUp(self):
 
-        pass
+        self.tmp = tempfile.mkdtemp()
+
+        self.backup_path = os.path.join(self.tmp, 'backups')
+        os.environ['BACKUPPATH'] = self.backup_path
+
+        self.golden_file = os.path.join(self.tmp, 'config.txt')
+        with open(self.golden_file, 'w') as f:
+            f.write('original\n')
+
+        patcher = patch('subprocess.call', side_effect=_remove)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+
+        del os.environ['BACKUPPATH']
+        shutil.rmtree(self.tmp)
+
+    def _backups(self):
+
+        return sorted(x for x in os.listdir(self.backup_path) if '_backup' in x)
+
+
+class OpenWithBackupTest(BackupFolderFixture, unittest.TestCase):
+
+    def test_backup_of_previous_content(self):
+        with OpenWithBackup(self.golden_file, 'w') as f:
+            f.write('changed\n')
+
+        with open(self.golden_file, 'r') as f:
+            self.assertEqual(f.read(), 'changed\n')
+
+        backups = self._backups()
+        self.assertEqual(len(backups), 1)
+        self.assertTrue(backups[0].startswith('config.txt_backup'))
+
+        with open(os.path.join(self.backup_path, backups[0]), 'r') as f:
+            self.assertEqual(f.read(), 'original\n')
+
+    def test_no_backup_for_new_file(self):
+        with OpenWithBackup(os.path.join(self.tmp, 'new.txt'), 'w') as f:
+            f.write('new\n')
+
+        self.assertEqual(self._backups(), [])
+
+    def test_retention_policy_applied(self):
+        os.makedirs(self.backup_path)
+        for stamp in range(20170101000000, 20170101000010):
+            with open(os.path.join(self.backup_path, 'config.txt_backup%s' % stamp), 'w') as f:
+                f.write('old\n')
+
+        with OpenWithBackup(self.golden_file, 'w', retention=KeepLastPolicy(3)) as f:
+            f.write('changed\n')
+
+        backups = self._backups()
+        self.assertEqual(len(backups), 3)
+        self.assertIn('config.txt_backup20170101000009', backups)
+
+
+class BackgroundBackupTest(BackupFolderFixture, unittest.TestCase):
+
+    def test_background_backup(self):
+        with OpenWithBackup(self.golden_file, 'w', background=True) as f:
+            f.write('changed\n')
+
+        wait_for_backups()
+
+        backups = self._backups()
+        self.assertEqual(len(backups), 1)
+
+        with open(os.path.join(self.backup_path, backups[0]), 'r') as f:
+            self.assertEqual(f.read(), 'original\n')
+
+        self.assertEqual(os.listdir(os.path.join(self.backup_path, 'pending')), [])
+
+    def test_background_retention(self):
+        os.makedirs(self.backup_path)
+        for stamp in range(20170101000000, 20170101000010):
+            with open(os.path.join(self.backup_path, 'config.txt_backup%s' % stamp), 'w') as f:
+                f.write('old\n')
+
+        with OpenWithBackup(self.golden_file, 'w', background=True, retention=KeepLastPolicy(3)) as f:
+            f.write('changed\n')
+
+        wait_for_backups()
+
+        self.assertEqual(len(self._backups()), 3)
+
+    def test_pending_flushed_on_start(self):
+        owb = OpenWithBackup(self.golden_file)
+        owb.tmp_content = ['spooled\n']
+        spool_fn = owb._spool_backup('20170101000000')
+
+        self.assertTrue(os.path.isfile(spool_fn))
+
+        flush_pending_backups()
+
+        self.assertFalse(os.path.isfile(spool_fn))
+
+        with open(os.path.join(self.backup_path, 'config.txt_backup20170101000000'), 'r') as f:
+            self.assertEqual(f.read(), 'spooled\n')
+
+    def test_failed_store_keeps_spool_file(self):
+        with patch.object(OpenWithBackup, '_store_backup', return_value=False):
+            with OpenWithBackup(self.golden_file, 'w', background=True) as f:
+                f.write('changed\n')
+
+            wait_for_backups()
+
+        # the disk was full, so the pre-edit content is kept to be retried
+        pending = os.listdir(os.path.join(self.backup_path, 'pending'))
+        self.assertEqual(len(pending), 1)
+        self.assertEqual(self._backups(), [])
+
+        flush_pending_backups()
+
+        self.assertEqual(os.listdir(os.path.join(self.backup_path, 'pending')), [])
+
+        with open(os.path.join(self.backup_path, self._backups()[0]), 'r') as f:
+            self.assertEqual(f.read(), 'original\n')
+
+
+    def test_flushed_by_two_processes(self):
+        owb = OpenWithBackup(self.golden_file)
+        for number in range(50):
+            owb.tmp_content = ['spooled %s\n' % number]
+            owb._spool_backup('201701010000%02d' % number)
+
+        start = multiprocessing.Event()
+
+        # the processes are forked with a policy that keeps every backup, so that none is hidden by pruning
+        with patch('lib.common.openwithbackup.policy_for', return_value=KeepLastPolicy(100)):
+            processes = [multiprocessing.Process(target=_flush_concurrently, args=(start,)) for _ in range(2)]
+            for process in processes:
+                process.start()
+
+        start.set()
+        for process in processes:
+            process.join(30)
+
+        # each spooled backup is written once, and neither process fails on the other's removals
+        self.assertEqual([x.exitcode for x in processes], [0, 0])
+        self.assertEqual(len(self._backups()), 50)
+        self.assertEqual([x for x in os.listdir(os.path.join(self.backup_path, 'pending')) if x.endswith('.pending')], [])
+
+
+class ListRestoreTest(BackupFolderFixture, unittest.TestCase):
+
+    def _edit(self, content):
+        with OpenWithBackup(self.golden_file, 'w') as f:
+            f.write(content)
+
+    def _read(self):
+        with open(self.golden_file, 'r') as f:
+            return f.read()
+
+    def test_list_backups(self):
+        self._edit('first\n')
+        self._edit('second\n')
+
+        backups = list_backups(self.golden_file)
+        self.assertEqual(len(backups), 2)
+        self.assertEqual([x['size'] for x in backups], [9, 6])
+        self.assertLess(backups[0]['version'], backups[1]['version'])
+        for backup in backups:
+            self.assertEqual(sorted(backup.keys()), ['hash', 'size', 'timestamp', 'version'])
+
+    def test_list_backups_from_index_only(self):
+        self._edit('first\n')
+
+        with patch('lib.common.backupindex.BackupIndex._describe') as describe:
+            list_backups(self.golden_file)
+            self.assertFalse(describe.called)
+
+    def test_index_rebuilt_from_legacy_backups(self):
+        os.makedirs(self.backup_path)
+        with open(os.path.join(self.backup_path, 'config.txt_backup20170101000000'), 'w') as f:
+            f.write('legacy\n')
+
+        backups = list_backups(self.golden_file)
+        self.assertEqual([(x['version'], x['size']) for x in backups], [('20170101000000', 7)])
+
+    def test_restore(self):
+        self._edit('first\n')
+        self._edit('second\n')
+
+        oldest = list_backups(self.golden_file)[0]['version']
+        restore(self.golden_file, oldest)
+
+        self.assertEqual(self._read(), 'original\n')
+
+        # the replaced content is kept as the newest backup
+        newest = list_backups(self.golden_file)[-1]['version']
+        with open(os.path.join(self.backup_path, 'config.txt_backup' + newest), 'r') as f:
+            self.assertEqual(f.read(), 'second\n')
+
+    def test_restore_unknown_version(self):
+        self._edit('first\n')
+        with self.assertRaises(KeyError):
+            restore(self.golden_file, '19990101000000')
+
+    def test_restore_corrupt_backup(self):
+        self._edit('first\n')
+        version = list_backups(self.golden_file)[0]['version']
+        with open(os.path.join(self.backup_path, 'config.txt_backup' + version), 'w') as f:
+            f.write('tampered\n')
+
+        with self.assertRaises(IOError):
+            restore(self.golden_file, version)
+        self.assertEqual(self._read(), 'first\n')
+
+    def test_backups_from_two_processes(self):
+        start = multiprocessing.Event()
+
+        processes = [multiprocessing.Process(target=_back_up_concurrently, args=(self.golden_file, name, start))
+                     for name in ('page', 'service')]
+        for process in processes:
+            process.start()
+
+        start.set()
+        for process in processes:
+            process.join(30)
+
+        # every backup is in the index, none is left on disk without an entry for retention to prune
+        versions = [x['version'] for x in list_backups(self.golden_file)]
+        self.assertEqual(len(versions), 20)
+        self.assertEqual(sorted('config.txt_backup' + x for x in versions), self._backups())
+
+    def test_identical_content_deduplicated(self):
+        self._edit('original\n')
+        self._edit('original\n')
+
+        backups = list_backups(self.golden_file)
+        self.assertEqual(len(backups), 2)
+        self.assertEqual(backups[0]['hash'], backups[1]['hash'])
+
+        first, second = [os.path.join(self.backup_path, 'config.txt_backup' + x['version']) for x in backups]
+        self.assertTrue(os.path.samefile(first, second))
@@ -0,0 +1,43 @@
+import env
+import unittest
+
+from mock import Mock, patch
+
+from lib import PiSettingsPage
+from lib.common.filelock import LockTimeout
+from lib.piconfig.ConfigFileInterface import ConfigChanged
+
+
+class PageLauncherTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.launcher = PiSettingsPage.PageLauncher(gui=None)
+        self.launcher.config_interface = Mock()
+
+        self.write = self.launcher.config_interface.write_config_txt
+
+    def test_retries_until_written(self):
+
+        self.write.side_effect = [ConfigChanged('/boot/config.txt', ''), LockTimeout('locked'), None]
+
+        with patch.object(PiSettingsPage, 'log') as log:
+            self.launcher.run()
+
+        self.assertEqual(self.write.call_count, 3)
+        self.assertEqual(self.launcher.config_interface.rebase.call_count, 1)
+        self.assertFalse(log.called)
+
+    def test_gives_up(self):
+
+        self.write.side_effect = LockTimeout('locked')
+
+        with patch.object(PiSettingsPage, 'log') as log:
+            self.launcher.run()
+
+        self.assertEqual(self.write.call_count, PiSettingsPage.WRITE_ATTEMPTS)
+        self.assertEqual(log.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+import env
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from mock import patch
+from sqlite3 import OperationalError
+
+from lib.SettingsService import SettingsService, declared_settings
+from test_dbinterface import FreshDatabase
+
+
+class SettingsServiceTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.tmp = tempfile.mkdtemp()
+        os.environ['DBPATH'] = os.path.join(self.tmp, 'preferences.db')
+
+        self.config = os.path.join(self.tmp, 'config.txt')
+        self._write_config('start_x=1\ngpu_mem_1024=256\n')
+
+        self.pushed = []
+
+        patcher = patch('sys.stdout')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+
+        del os.environ['DBPATH']
+        shutil.rmtree(self.tmp)
+
+    def _write_config(self, content):
+
+        with open(self.config + '.tmp', 'w') as f:
+            f.write(content)
+        os.rename(self.config + '.tmp', self.config)
+
+    def _push(self, key, value):
+
+        self.pushed.append((key, value))
+
+    def _service(self, db):
+
+        return SettingsService(self._push, location=self.config, db=db,
+                               declared=['start_x', 'gpu_mem_1024', 'passthrough', 'mykey', 'myosmc_profile'])
+
+    def test_initial_push(self):
+        with FreshDatabase(preload={'mykey': 'myvalue'}) as db:
+            service = self._service(db)
+            service.refresh_config()
+            service.refresh_db()
+
+            pushed = dict(self.pushed)
+            self.assertEqual(pushed['gpu_mem_1024'], '256')
+            self.assertEqual(pushed['mykey'], 'myvalue')
+            self.assertNotIn('passthrough', pushed)
+
+    def test_only_changes_pushed(self):
+        with FreshDatabase() as db:
+            service = self._service(db)
+            service.refresh_config()
+
+            self.pushed = []
+            self._write_config('start_x=1\ngpu_mem_1024=128\n')
+            self.assertEqual(service.refresh_config(), {'gpu_mem_1024': '128'})
+            self.assertEqual(self.pushed, [('gpu_mem_1024', '128')])
+
+    def test_profiling_key(self):
+        with FreshDatabase() as db:
+            with patch.dict(os.environ):
+                os.environ.pop('MYOSMC_PROFILE', None)
+
+                service = self._service(db)
+                service.refresh_db()
+                self.assertNotIn('MYOSMC_PROFILE', os.environ)
+
+                db.setsetting('myosmc_profile', 'sample')
+                service.refresh_db()
+                self.assertEqual(os.environ['MYOSMC_PROFILE'], 'sample')
+
+    def test_only_declared_settings_pushed(self):
+        with FreshDatabase(preload={'mykey': 'myvalue', 'myosmc_internal': 'value'}) as db:
+            service = SettingsService(self._push, location=self.config, db=db, declared=['mykey'])
+            service.refresh_config()
+
+            # internal keys are still read, e.g. to switch profiling, but not pushed
+            self.assertEqual(service.refresh_db(), {'mykey': 'myvalue', 'myosmc_internal': 'value'})
+            self.assertEqual(self.pushed, [('mykey', 'myvalue')])
+
+    def test_declared_settings(self):
+        settings_xml = os.path.join(self.tmp, 'settings.xml')
+        with open(settings_xml, 'w') as f:
+            f.write('<settings><category label="x"><setting id="mykey" type="text"/></category></settings>')
+
+        self.assertEqual(declared_settings(settings_xml), set(['mykey']))
+        self.assertEqual(declared_settings(os.path.join(self.tmp, 'missing.xml')), set())
+
+    def test_run_survives_failed_refresh(self):
+        with FreshDatabase() as db:
+            service = self._service(db)
+
+            with patch.object(db, 'all_pairs', side_effect=[OperationalError('database is locked'), {'mykey': 'myvalue'}]):
+                runner = threading.Thread(target=service.run)
+                runner.start()
+                try:
+                    time.sleep(0.2)
+                    db.setsetting('mykey', 'myvalue')
+
+                    deadline = time.time() + 5
+                    while ('mykey', 'myvalue') not in self.pushed and time.time() < deadline:
+                        time.sleep(0.05)
+                finally:
+                    service.stop()
+                    runner.join(5)
+
+            self.assertFalse(runner.is_alive())
+            self.assertIn(('mykey', 'myvalue'), self.pushed)
+
+    def test_run_reacts_to_changes(self):
+        with FreshDatabase() as db:
+            service = self._service(db)
+
+            runner = threading.Thread(target=service.run)
+            runner.start()
+            try:
+                time.sleep(0.2)
+                self.pushed = []
+
+                self._write_config('start_x=1\ngpu_mem_1024=128\n')
+                db.setsetting('mykey', 'myvalue')
+
+                deadline = time.time() + 5
+                while len(self.pushed) < 2 and time.time() < deadline:
+                    time.sleep(0.05)
+            finally:
+                service.stop()
+                runner.join(5)
+
+            self.assertFalse(runner.is_alive())
+            self.assertIn(('gpu_mem_1024', '128'), self.pushed)
+            self.assertIn(('mykey', 'myvalue'), self.pushed)
+
+    def test_idle_service_does_not_reparse(self):
+        with FreshDatabase() as db:
+            service = self._service(db)
+
+            runner = threading.Thread(target=service.run)
+            runner.start()
+            time.sleep(0.5)
+            service.stop()
+            runner.join(5)
+
+            self.assertEqual(service.parses, {'config': 1, 'db': 1})
+
+            # sqlite opens the database for writing even to read it, so the service's own first read
+            # wakes the watcher once (without a re-parse); the other wakeup is the stop
+            self.assertLessEqual(service.watcher.wakeups, 2)
+
+    def test_abort_from_monitor(self):
+        class Monitor(object):
+            def waitForAbort(self):
+                time.sleep(0.2)
+
+        with FreshDatabase() as db:
+            service = self._service(db)
+
+            runner = threading.Thread(target=service.run, args=(Monitor(),))
+            runner.start()
+            runner.join(5)
+
+            self.assertFalse(runner.is_alive())
@@ -1,6 +1,8 @@
 
 import env
+import io
 import os
+import sqlite3
 import unittest
 
 from mock import patch
@@ -11,13 +13,14 @@ from test_data.test_entries import test_items, test_items_replacements
 
 class FreshDatabase(object):   # pragma: no cover
 
-    def __init__(self, preload=None):
+    def __init__(self, preload=None, history=False):
 
         self.preload = preload
+        self.history = history
 
     def __enter__(self, *args, **kwargs):
 
-        self.db = DBInterface(preload=self.preload)
+        self.db = DBInterface(preload=self.preload, history=self.history)
 
         return self.db
 
@@ -172,3 +175,186 @@ class DBInterfaceTest(unittest.TestCase):
         preload = {1: 'a'}
         with FreshDatabase(preload) as db:
             self.assertEqual(len(db.errors), 1)
+
+    def test_export_import(self):
+        for fmt in ('jsonl', 'binary'):
+            with FreshDatabase(test_items) as db:
+                stream = io.BytesIO()
+                self.assertEqual(db.export(stream, format=fmt), len(test_items))
+                expected = db.all_pairs()
+
+                db._database_execution('DELETE FROM OSMCSETTINGS', [])
+
+                stream.seek(0)
+                self.assertEqual(db.import_(stream, format=fmt), len(test_items))
+                self.assertEqual(db.all_pairs(), expected, msg='%s export changed the settings' % fmt)
+
+    def test_export_import_none(self):
+        with FreshDatabase({'a': None, 'b': 1}) as db:
+            stream = io.BytesIO()
+            db.export(stream)
+
+            # a value edited to null, as well as the stored None, reads back as None
+            export = stream.getvalue().replace('["b", "int", 1]', '["b", "int", null]')
+
+            db.import_(io.BytesIO(export), mode='replace')
+
+            self.assertIsNone(db.getsetting('a'))
+            self.assertIsNone(db.getsetting('b'))
+
+            stream = io.BytesIO()
+            db.export(stream)
+            self.assertEqual(stream.getvalue(), '["a", "str", "None"]\n["b", "str", "None"]\n')
+
+    def test_import_merge_replace(self):
+        with FreshDatabase({'kept': 1, 'changed': 'old'}) as db:
+            export = '["changed", "str", "new"]\n["added", "bool", true]\n'
+
+            db.import_(io.BytesIO(export), mode='merge')
+            self.assertEqual(db.all_pairs(), {'kept': 1, 'changed': 'new', 'added': True})
+
+            db.import_(io.BytesIO('["only", "float", 1.5]\n'), mode='replace')
+            self.assertEqual(db.all_pairs(), {'only': 1.5})
+
+    def test_failed_replace_rolls_back(self):
+        with FreshDatabase({'kept': 1}) as db:
+            with self.assertRaises(ValueError):
+                db.import_(io.BytesIO('["a", "int", 1]\nnot json\n'), mode='replace')
+            self.assertEqual(db.all_pairs(), {'kept': 1})
+
+            with self.assertRaises(ValueError):
+                db.import_(io.BytesIO('["a", "complex", 1]\n'), mode='replace')
+            with self.assertRaises(ValueError):
+                db.import_(io.BytesIO('not binary'), format='binary')
+            with self.assertRaises(ValueError):
+                db.import_(io.BytesIO(''), mode='overwrite')
+
+    def test_history_disabled(self):
+        with FreshDatabase() as db:
+            db.setsetting('a', 1)
+            self.assertFalse(db.history_enabled)
+            self.assertFalse(db._check_history())
+
+    def test_history(self):
+        with FreshDatabase() as db:
+            db.enable_history()
+            db.source = 'test'
+
+            with patch('time.time', side_effect=[100.0, 150.0, 200.0, 300.0]):
+                db.setsetting('a', 1)
+                db.setsetting('a', 1)
+                db.setsetting('a', 'two')
+                db.setsetting('b', True)
+
+            self.assertEqual([(x['old'], x['new'], x['timestamp'], x['source']) for x in db.history('A')],
+                             [(None, 1, 100.0, 'test'), (1, 'two', 200.0, 'test')])
+            self.assertEqual(len(db.history('a', limit=1)), 1)
+
+            # a new interface to the same database logs its changes as well
+            self.assertTrue(DBInterface().history_enabled)
+
+    def test_as_of(self):
+        with FreshDatabase() as db:
+            db.enable_history()
+
+            with patch('time.time', side_effect=[100.0, 200.0, 300.0]):
+                db.setsetting('a', 1)
+                db.setsetting('a', 2)
+                db.setsetting('b', 1.5)
+
+            self.assertEqual(db.as_of(50), {})
+            self.assertEqual(db.as_of(100), {'a': 1})
+            self.assertEqual(db.as_of(250), {'a': 2})
+            self.assertEqual(db.as_of(300), {'a': 2, 'b': 1.5})
+
+    def test_history_compacted_by_short_lived_writers(self):
+        with FreshDatabase(history=True):
+            with patch('lib.database.dbinterface.HISTORY_LIMIT', 5), \
+                    patch('lib.database.dbinterface.HISTORY_COMPACT_EVERY', 3):
+                # one write per interface, as osmc_setprefs makes
+                for value in range(20):
+                    DBInterface().setsetting('a', value)
+
+            changes = [x['new'] for x in DBInterface().history('a')]
+            self.assertLess(len(changes), 5 + 3)
+            self.assertEqual(changes[-1], 19)
+
+    def test_compact_history(self):
+        with FreshDatabase(history=True) as db:
+            with patch('time.time', side_effect=[float(x) for x in range(1, 11)]):
+                for value in range(10):
+                    db.setsetting('a', value)
+
+            db.compact_history(limit=4)
+            self.assertEqual([x['new'] for x in db.history('a')], [6, 7, 8, 9])
+
+            self.assertEqual(db.as_of(8.5), {'a': 7})
+            with self.assertRaises(ValueError):
+                db.as_of(2)
+
+    def test_read_only(self):
+        with FreshDatabase({'a': 1, 'b': 'x'}):
+            reader = DBInterface(read_only=True)
+
+            self.assertEqual(reader.getsetting('a'), 1)
+            self.assertEqual(reader.all_pairs(), {'a': 1, 'b': 'x'})
+
+            # a write fails at once, rather than being retried as if the database were locked
+            with patch('time.sleep') as mock_sleep:
+                with self.assertRaises(OperationalError):
+                    reader.setsetting('a', 2)
+                with self.assertRaises(OperationalError):
+                    reader.import_(io.BytesIO(b'["a", "int", 2]\n'))
+
+            self.assertFalse(mock_sleep.called)
+            self.assertEqual(reader.getsetting('a'), 1)
+
+    def test_read_only_does_not_create(self):
+        with self.assertRaises(OperationalError):
+            DBInterface(read_only=True)
+
+        self.assertFalse(os.path.exists(self.dbpath))
+
+        with self.assertRaises(ValueError):
+            DBInterface(read_only=True, preload={'a': 1})
+
+    def test_read_only_while_locked(self):
+        with FreshDatabase({'a': 1}):
+            writer = sqlite3.connect(self.dbpath)
+            writer.execute('BEGIN IMMEDIATE')
+            writer.execute("UPDATE OSMCSETTINGS SET value_int = 2 WHERE key = 'a'")
+
+            try:
+                # the uncommitted change is not seen, and the reader does not wait for the writer
+                with patch('time.sleep') as mock_sleep:
+                    self.assertEqual(DBInterface(read_only=True).getsetting('a'), 1)
+                    self.assertEqual(DBInterface(immutable=True).getsetting('a'), 1)
+
+                self.assertFalse(mock_sleep.called)
+            finally:
+                writer.rollback()
+                writer.close()
+
+    def test_read_only_without_uri_filenames(self):
+        with FreshDatabase({'a': 1}):
+            with patch('lib.database.dbinterface.URI_FILENAMES', False):
+                reader = DBInterface(read_only=True)
+
+                self.assertEqual(reader.getsetting('a'), 1)
+
+                with patch('time.sleep'):
+                    with self.assertRaises(OperationalError):
+                        reader.setsetting('a', 2)
+
+    def test_immutable_without_uri_filenames(self):
+        with FreshDatabase({'a': 1}):
+            with patch('lib.database.dbinterface.URI_FILENAMES', False):
+                with patch('lib.database.dbinterface._reported_immutable_locks', False):
+                    with patch('sys.stderr', new_callable=io.BytesIO) as stderr:
+                        reader = DBInterface(immutable=True)
+
+                        self.assertEqual(reader.getsetting('a'), 1)
+                        self.assertEqual(reader.getsetting('a'), 1)
+
+        # the locks that are taken anyway are reported once
+        self.assertEqual(stderr.getvalue().count('USE_URI'), 1)
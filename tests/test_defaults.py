@@ -2,9 +2,11 @@ import env
 import os
 import unittest
 
+from mock import Mock, patch
 from sqlite3 import OperationalError
 
-from lib.common.defaults import DEFAULT_DICT
+from lib.common import defaults
+from lib.common.defaults import DEFAULT_DICT, flat_defaults, DefaultsResolver
 
 
 class OsmcprefsTest(unittest.TestCase):
@@ -14,3 +16,71 @@ class OsmcprefsTest(unittest.TestCase):
             DEFAULT_DICT.update(DEFAULT_DICT.get('somekey', {}))
         except:
             self.fail('DEFAULT_DICT failed to act like a dictionary')
+
+
+class FlatDefaultsTest(unittest.TestCase):
+
+    def setUp(self):
+        defaults.clear_cache()
+        self.addCleanup(defaults.clear_cache)
+
+    def test_overlay(self):
+        self.assertEqual(flat_defaults('rPi3')['a'], 'rPi3 special value')
+        self.assertEqual(flat_defaults('vero')['a'], 'standard value')
+        self.assertNotIn('rPi3', flat_defaults('rPi3'))
+        self.assertEqual(flat_defaults('rPi3')['b'], {'sub_setting': 'sub_value'})
+
+    def test_default_dict_untouched(self):
+        flat_defaults('rPi3')
+        self.assertEqual(DEFAULT_DICT['a'], 'standard value')
+        self.assertEqual(DEFAULT_DICT['rPi3'], {'a': 'rPi3 special value'})
+
+    def test_flattened_once(self):
+        self.assertIs(flat_defaults('rPi3'), flat_defaults('rPi3'))
+
+    def test_read_only(self):
+        with self.assertRaises(TypeError):
+            flat_defaults('rPi3')['a'] = 'changed'
+
+
+class DefaultsResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        defaults.clear_cache()
+        self.addCleanup(defaults.clear_cache)
+
+        self.db = Mock()
+        self.db.all_pairs.return_value = {'a': 'user value', 'c': 3}
+
+    def test_layers(self):
+        resolver = DefaultsResolver(self.db, 'rPi3')
+        self.assertEqual(resolver.get('a'), 'user value')
+        self.assertEqual(resolver.get('C'), 3)
+        self.assertEqual(resolver.get('b'), {'sub_setting': 'sub_value'})
+        self.assertEqual(resolver.get('missing', 'fallback'), 'fallback')
+
+        self.assertEqual(DefaultsResolver(None, 'rPi3').get('a'), 'rPi3 special value')
+
+    def test_resolve_many_reads_once(self):
+        resolver = DefaultsResolver(self.db, 'unknown')
+        self.assertEqual(resolver.resolve_many(['a', 'c', 'missing']), {'a': 'user value', 'c': 3, 'missing': None})
+        resolver.get('b')
+        self.assertEqual(self.db.all_pairs.call_count, 1)
+
+    def test_defaults_flattened_on_first_miss(self):
+        resolver = DefaultsResolver(self.db)
+
+        with patch.object(defaults, 'flat_defaults', wraps=defaults.flat_defaults) as flat_defaults:
+            self.assertEqual(resolver.get('a'), 'user value')
+            self.assertFalse(flat_defaults.called)
+
+            resolver.get('b')
+            resolver.get('missing')
+            self.assertEqual(flat_defaults.call_count, 1)
+
+    def test_refresh(self):
+        resolver = DefaultsResolver(self.db, 'unknown')
+        resolver.get('a')
+        self.db.all_pairs.return_value = {}
+        resolver.refresh()
+        self.assertEqual(resolver.get('a'), 'standard value')
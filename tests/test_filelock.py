@@ -0,0 +1,101 @@
+import env
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from lib.common.filelock import FileLock, LockTimeout, read_lock, write_lock
+
+
+def hold(golden_file, shared, held, release):
+
+    with FileLock(golden_file, shared=shared, timeout=None):
+        held.set()
+
+        # a process that is killed must not be waiting on an event, it would be left locked
+        if release is None:
+            time.sleep(10)
+        else:
+            release.wait(10)
+
+
+class FileLockTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+        self.golden_file = os.path.join(self.folder, 'config.txt')
+
+    def _held_elsewhere(self, shared, killed=False):
+
+        # the lock is held by another process until the test ends, or it is killed
+        held = multiprocessing.Event()
+        release = None if killed else multiprocessing.Event()
+
+        process = multiprocessing.Process(target=hold, args=(self.golden_file, shared, held, release))
+        process.start()
+
+        self.addCleanup(process.join)
+        if killed:
+            self.addCleanup(process.terminate)
+        else:
+            self.addCleanup(release.set)
+
+        self.assertTrue(held.wait(10))
+
+        return process
+
+    def test_shared_locks(self):
+
+        self._held_elsewhere(shared=True)
+
+        with read_lock(self.golden_file, timeout=0):
+            pass
+
+        with self.assertRaises(LockTimeout):
+            with write_lock(self.golden_file, timeout=0.1):
+                pass
+
+    def test_exclusive_lock(self):
+
+        self._held_elsewhere(shared=False)
+
+        for lock in (read_lock(self.golden_file, timeout=0), write_lock(self.golden_file, timeout=0)):
+            with self.assertRaises(LockTimeout):
+                with lock:
+                    pass
+
+    def test_released_when_the_process_ends(self):
+
+        process = self._held_elsewhere(shared=False, killed=True)
+        process.terminate()
+        process.join()
+
+        with write_lock(self.golden_file, timeout=1):
+            pass
+
+    def test_locks_in_one_process(self):
+
+        with write_lock(self.golden_file):
+            with self.assertRaises(LockTimeout):
+                with write_lock(self.golden_file, timeout=0):
+                    pass
+
+        # released, so it can be taken again
+        with write_lock(self.golden_file, timeout=0):
+            self.assertTrue(os.path.exists(self.golden_file + '.lock'))
+
+    def test_nothing_to_lock(self):
+
+        lock = FileLock(os.path.join(self.folder, 'missing', 'config.txt'))
+
+        with lock:
+            self.assertIsNone(lock.fd)
+
+
+if __name__ == '__main__':
+    unittest.main()
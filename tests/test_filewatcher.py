@@ -0,0 +1,87 @@
+import env
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from lib.common.filewatcher import FileWatcher
+
+
+class FileWatcherTests(object):
+
+    use_inotify = True
+
+    def setUp(self):
+
+        self.tmp = tempfile.mkdtemp()
+        self.watched = os.path.join(self.tmp, 'config.txt')
+        self.other = os.path.join(self.tmp, 'other.txt')
+
+        self._write(self.watched, 'start\n')
+
+        self.watcher = FileWatcher([self.watched], poll_interval=0.05, use_inotify=self.use_inotify)
+
+    def tearDown(self):
+
+        self.watcher.close()
+        shutil.rmtree(self.tmp)
+
+    def _write(self, fn, content):
+
+        with open(fn, 'w') as f:
+            f.write(content)
+
+    def _later(self, action, delay=0.1):
+
+        timer = threading.Timer(delay, action)
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def test_write_detected(self):
+        self._later(lambda: self._write(self.watched, 'changed content\n'))
+        self.assertEqual(self.watcher.wait(timeout=5), set([self.watched]))
+
+    def test_rename_detected(self):
+        def replace():
+            self._write(self.watched + '.tmp', 'replaced\n')
+            os.rename(self.watched + '.tmp', self.watched)
+
+        self._later(replace)
+        self.assertEqual(self.watcher.wait(timeout=5), set([self.watched]))
+
+    def test_other_files_ignored(self):
+        self._later(lambda: self._write(self.other, 'other\n'))
+        self.assertEqual(self.watcher.wait(timeout=0.5), set())
+
+    def test_stop(self):
+        self._later(self.watcher.stop)
+        start = time.time()
+        self.assertEqual(self.watcher.wait(), set())
+        self.assertLess(time.time() - start, 5)
+
+
+class InotifyFileWatcherTest(FileWatcherTests, unittest.TestCase):
+
+    def test_inotify_in_use(self):
+        self.assertTrue(self.watcher.inotify)
+
+    def test_idle_without_wakeups(self):
+        # the only wakeup while idle is the one from stop()
+        self._later(self.watcher.stop, delay=0.5)
+        self.watcher.wait()
+        self.assertEqual(self.watcher.wakeups, 1)
+
+
+class PollingFileWatcherTest(FileWatcherTests, unittest.TestCase):
+
+    use_inotify = False
+
+    def test_polling_in_use(self):
+        self.assertFalse(self.watcher.inotify)
+
+    def test_idle_wakeups(self):
+        self._later(self.watcher.stop, delay=0.5)
+        self.watcher.wait()
+        self.assertGreater(self.watcher.wakeups, 3)
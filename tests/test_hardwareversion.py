@@ -1,13 +1,100 @@
 import env
 import os
+import shutil
+import tempfile
 import unittest
 
-from lib.common.hardwareversion import hardware_version
+from mock import patch
+
+import lib.common.hardwareversion as hardwareversion
+from lib.common.hardwareversion import hardware_version, hardware_profile, HardwareProfile
+
+
+CPUINFO_PI3 = '''processor	: 0
+model name	: ARMv7 Processor rev 4 (v7l)
+processor	: 1
+processor	: 2
+processor	: 3
+Hardware	: BCM2835
+Revision	: a02082
+'''
+
+CPUINFO_PIB = '''processor	: 0
+model name	: ARMv6-compatible processor rev 7 (v6l)
+Hardware	: BCM2835
+Revision	: 000e
+'''
+
 
 class HardwareVersionTest(unittest.TestCase):
 
+    def setUp(self):
+
+        hardwareversion._profile = None
+
+        self.tmp = tempfile.mkdtemp()
+        self.cpuinfo = os.path.join(self.tmp, 'cpuinfo')
+        self.model = os.path.join(self.tmp, 'model')
+
+        for name, value in (('CPUINFO', self.cpuinfo), ('DEVICE_TREE_MODEL', self.model)):
+            patcher = patch.object(hardwareversion, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+
+        hardwareversion._profile = None
+        shutil.rmtree(self.tmp)
+
+    def _write(self, fn, content):
+
+        with open(fn, 'w') as f:
+            f.write(content)
+
     def test_basic(self):
         try:
             hardware_version()
         except:
             self.fail('hardware_version function failed basic test.')
+
+    def test_pi3(self):
+        self._write(self.cpuinfo, CPUINFO_PI3)
+        self._write(self.model, 'Raspberry Pi 3 Model B Rev 1.2\x00')
+
+        profile = hardware_profile()
+        self.assertEqual(profile.hardware_id, 'rPi3')
+        self.assertEqual(profile.pi_version, 'Pi2')
+        self.assertEqual(profile.cores, 4)
+        self.assertEqual(profile.revision, 'a02082')
+        self.assertEqual(profile.model, 'Raspberry Pi 3 Model B Rev 1.2')
+
+    def test_old_style_revision(self):
+        self._write(self.cpuinfo, CPUINFO_PIB)
+
+        profile = hardware_profile()
+        self.assertEqual(profile.hardware_id, 'rPi1')
+        self.assertEqual(profile.pi_version, 'PiB')
+
+    def test_model_only(self):
+        self._write(self.model, 'Raspberry Pi Zero W Rev 1.1\x00')
+        self.assertEqual(hardware_version(), 'rPi0')
+
+    def test_nothing_detectable(self):
+        profile = hardware_profile()
+        self.assertEqual(profile.hardware_id, 'unknown')
+        self.assertEqual(profile.pi_version, 'Pi2')
+
+    def test_pi_version(self):
+        self.assertEqual(HardwareProfile(cores=1).pi_version, 'PiB')
+        self.assertEqual(HardwareProfile(cores=4).pi_version, 'Pi2')
+
+        # as before the profile, a cpuinfo that lists no processors is not taken for a single core board
+        self.assertEqual(HardwareProfile(cores=0).pi_version, 'Pi2')
+
+    def test_detected_once(self):
+        self._write(self.cpuinfo, CPUINFO_PI3)
+
+        with patch.object(HardwareProfile, 'detect', wraps=HardwareProfile.detect) as detect:
+            for _ in range(5):
+                hardware_version()
+            self.assertEqual(detect.call_count, 1)
@@ -0,0 +1,74 @@
+''' Start up import budget for the addon.
+
+Each entry point is imported in a fresh interpreter, with the xbmc modules mocked
+by env.py, and the modules pulled in are checked against a budget. The time taken
+varies with the machine, it is reported by bench_import_time.py.
+'''
+import env
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+ADDON_FOLDER = os.path.join(os.path.dirname(TESTS_FOLDER), 'script.MyOSMC')
+
+# modules that must not be imported on start up, they are only needed once a page is in use
+DEFERRED_MODULES = [
+    'lib.piconfig.MasterSettings',
+    'subprocess',
+    'Queue',
+    'json',
+    'hashlib',
+]
+
+ENTRY_POINTS = [
+    ('default', "imp.load_source('myosmc_default', os.path.join(addon_folder, 'default.py'))"),
+    ('service', "imp.load_source('myosmc_service', os.path.join(addon_folder, 'service.py'))"),
+    ('PiSettingsPage', "import lib.PiSettingsPage"),
+    ('piconfig', "import lib.piconfig"),
+]
+
+SCRIPT = '''
+import imp, os, sys, time
+sys.path.insert(0, %(tests_folder)r)
+addon_folder = %(addon_folder)r
+sys.path.append(addon_folder)
+import env
+before = set(sys.modules)
+timings = {}
+for name, statement in %(entry_points)r:
+    start = time.time()
+    exec(statement)
+    timings[name] = time.time() - start
+modules = sorted(m for m in set(sys.modules) - before if sys.modules[m] is not None)
+import json
+print(json.dumps({'timings': timings, 'modules': modules}))
+'''
+
+
+def measure_imports():
+
+    script = SCRIPT % {'tests_folder': TESTS_FOLDER, 'addon_folder': ADDON_FOLDER, 'entry_points': ENTRY_POINTS}
+
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=TESTS_FOLDER)
+
+    return json.loads(output.splitlines()[-1])
+
+
+class ImportTimeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.result = measure_imports()
+
+    def test_deferred_modules(self):
+        for module in DEFERRED_MODULES:
+            self.assertNotIn(module, self.result['modules'], msg='%s is imported on start up' % module)
+
+
+if __name__ == '__main__':
+    unittest.main()
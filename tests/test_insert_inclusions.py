@@ -0,0 +1,253 @@
+import env
+import imp
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+
+SKIN_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'script.MyOSMC', 'resources', 'skins', 'Default')
+RAW_FOLDER = os.path.join(SKIN_FOLDER, '1080i_raw')
+BUILT_FOLDER = os.path.join(SKIN_FOLDER, '1080i')
+
+build = imp.load_source('insert_inclusions', os.path.join(RAW_FOLDER, 'insert_inclusions.py'))
+
+
+def definitions(**includes):
+    return dict((name, build.ET.fromstring('<include name="%s">%s</include>' % (name, guts)))
+                for name, guts in includes.iteritems())
+
+
+def expand(window, **includes):
+    resolved, usage = build.resolve_include_trees(definitions(**includes))
+    root = build.ET.fromstring(window)
+    record = {}
+    build.expand_tree_includes(root, resolved, usage, record)
+    return build.ET.tostring(root), record
+
+
+class TreeIncludesTest(unittest.TestCase):
+
+    def test_nested_any_depth(self):
+        resolved, usage = build.resolve_include_trees(definitions(
+            a='<x/><include>b</include>', b='<y/><include>c</include>', c='<include>d</include>', d='<z/>'))
+        self.assertEqual(build.ET.tostring(resolved['a']), '<include name="a"><x /><y /><z /></include>')
+        self.assertEqual(usage['a'], {'a': 1, 'b': 1, 'c': 1, 'd': 1})
+
+    def test_cycle(self):
+        with self.assertRaises(ValueError):
+            build.resolve_include_trees(definitions(a='<include>b</include>', b='<include>a</include>'))
+
+    def test_unknown_include_left_alone(self):
+        resolved, usage = build.resolve_include_trees(definitions(a='<include>unknown</include>'))
+        self.assertEqual(build.ET.tostring(resolved['a']), '<include name="a"><include>unknown</include></include>')
+
+    def test_prefixed_names(self):
+        contents, record = expand('<w><include>TimeLabel</include><include> Time </include></w>',
+                                  Time='<time/>', TimeLabel='<label/>')
+        self.assertEqual(contents, '<w><label /><time /></w>')
+        self.assertEqual(record, {'Time': 1, 'TimeLabel': 1})
+
+    def test_single_pass_record(self):
+        contents, record = expand('<w>' + '<include>outer</include>' * 3 + '</w>',
+                                  outer='<include>inner</include><include>inner</include>', inner='<i/>')
+        self.assertEqual(contents, '<w>' + '<i />' * 6 + '</w>')
+        self.assertEqual(record, {'outer': 3, 'inner': 6})
+
+    def test_whitespace_kept(self):
+        contents, record = expand('<w>\n <include>a</include>\n <include> c </include> end\n <include>b</include></w>',
+                                  a='<x/> <include>b</include>', b='\n<y>t</y>\n', c='')
+        self.assertEqual(contents, '<w>\n <x /> <y>t</y>\n\n  end\n <y>t</y>\n</w>')
+        self.assertEqual(record, {'a': 1, 'b': 2, 'c': 1})
+
+
+class ColoursTest(unittest.TestCase):
+
+    colours = {'Overlay': '11111111', 'OverlayFO': '22222222'}
+
+    def _apply(self, window):
+        root = build.ET.fromstring(window)
+        record = {}
+        build.apply_colours(root, self.colours, record)
+        return build.ET.tostring(root), record
+
+    def test_places(self):
+        contents, record = self._apply('<w><a>Overlay</a><b colordiffuse="OverlayFO">$VAR[OverlayFO]</b>'
+                                       '<c>Overlay<d/>Overlay</c><e colordiffuse="$VAR[Overlay]">Overlay colour</e></w>')
+        self.assertEqual(contents, '<w><a>11111111</a><b colordiffuse="22222222">22222222</b>'
+                                   '<c>Overlay<d />11111111</c><e colordiffuse="$VAR[Overlay]">Overlay colour</e></w>')
+        self.assertEqual(record, {'Overlay': 2, 'OverlayFO': 2})
+
+    def test_cap(self):
+        root = build.ET.fromstring('<w>' + '<a>Overlay</a>' * 10 + '</w>')
+        build.apply_colours(root, self.colours, {})
+        self.assertEqual([x.text for x in root], ['11111111'] * build.COLOUR_REPLACEMENT_CAP + ['Overlay'] * 2)
+
+    def test_cap_per_format(self):
+        contents, record = self._apply('<w>' + '<a>Overlay</a>' * 10 + '<b>$VAR[Overlay]</b></w>')
+        self.assertEqual(contents.count('11111111'), build.COLOUR_REPLACEMENT_CAP + 1)
+        self.assertEqual(record['Overlay'], build.COLOUR_REPLACEMENT_CAP + 1)
+
+
+class ControlDefaultsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.control_defaults = build.load_control_defaults()
+
+    def test_templates(self):
+        tags, templates = self.control_defaults['label']
+        self.assertEqual(tags, frozenset(x.tag for x in templates))
+        self.assertIn('font', tags)
+
+    def test_missing_tags_only(self):
+        root = build.ET.fromstring('<w><control type="label"><font>mine</font></control></w>')
+        build.apply_control_defaults(root, self.control_defaults)
+
+        control = root[0]
+        self.assertEqual([x.text for x in control.findall('font')], ['mine'])
+        self.assertEqual(sorted(x.tag for x in control), sorted(self.control_defaults['label'][0]))
+
+    def test_controls_only(self):
+        root = build.ET.fromstring('<w><animation type="label" /><control type="unknown" /></w>')
+        build.apply_control_defaults(root, self.control_defaults)
+        self.assertEqual([len(x) for x in root], [0, 0])
+
+    def test_no_shared_elements(self):
+        root = build.ET.fromstring('<w><control type="label" /><control type="label" /></w>')
+        build.apply_control_defaults(root, self.control_defaults)
+
+        first, second = root
+        first.find('font').text = 'changed'
+        self.assertNotEqual(second.find('font').text, 'changed')
+        self.assertNotEqual(self.control_defaults['label'][1][0].text, 'changed')
+
+
+class SkinBuildTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dest = tempfile.mkdtemp()
+
+        patcher = patch('sys.stdout')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dest)
+
+    def _assert_matches_built_skin(self):
+
+        for fyle in os.listdir(BUILT_FOLDER):
+            if not os.path.isfile(os.path.join(RAW_FOLDER, fyle)):
+                continue
+
+            with open(os.path.join(BUILT_FOLDER, fyle), 'r') as f:
+                expected = f.read()
+
+            with open(os.path.join(self.dest, fyle), 'r') as f:
+                self.assertEqual(f.read(), expected, msg='%s differs from the built skin' % fyle)
+
+    def test_window_files(self):
+        self.assertEqual(build.window_files(), ['MyOSMC_Settings.xml', 'OSMC_UI_test.xml', 'SettingsCategory.xml'])
+
+    def test_matches_built_skin(self):
+        records, timings = build.build_skin(dest=self.dest)
+
+        self._assert_matches_built_skin()
+        self.assertEqual(sorted(timings), sorted(build.STAGES))
+        self.assertEqual(sorted(records), build.window_files())
+
+    def test_incremental_matches_built_skin(self):
+        built, records, timings = build.incremental_build(dest=self.dest, processes=1)
+
+        self.assertEqual(built, build.window_files())
+        self._assert_matches_built_skin()
+
+    def test_no_includes_left(self):
+        build.build_skin(dest=self.dest)
+
+        with open(os.path.join(self.dest, 'SettingsCategory.xml'), 'r') as f:
+            self.assertNotIn('<include>', f.read())
+
+
+class IncrementalBuildTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.raw = tempfile.mkdtemp()
+        self.dest = tempfile.mkdtemp()
+
+        for fyle in build.window_files() + build.SHARED_FILES:
+            shutil.copy(os.path.join(RAW_FOLDER, fyle), self.raw)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.raw)
+        shutil.rmtree(self.dest)
+
+    def _build(self, processes=1):
+
+        built, records, timings = build.incremental_build(self.raw, self.dest, processes)
+        return built
+
+    def _append(self, fyle, text):
+
+        with open(os.path.join(self.raw, fyle), 'a') as f:
+            f.write(text)
+
+    def test_first_build(self):
+        self.assertEqual(self._build(), build.window_files())
+        self.assertTrue(os.path.isfile(os.path.join(self.dest, build.MANIFEST_FILE)))
+
+    def test_nothing_changed(self):
+        self._build()
+        self.assertEqual(self._build(), [])
+
+    def test_window_changed(self):
+        self._build()
+        self._append('OSMC_UI_test.xml', '\n')
+        self.assertEqual(self._build(), ['OSMC_UI_test.xml'])
+
+    def test_shared_file_changed(self):
+        self._build()
+        self._append(build.colours_file, '\n')
+        self.assertEqual(self._build(), build.window_files())
+
+    def test_output_missing(self):
+        self._build()
+        os.remove(os.path.join(self.dest, 'MyOSMC_Settings.xml'))
+        self.assertEqual(self._build(), ['MyOSMC_Settings.xml'])
+
+    def test_window_removed(self):
+        self._build()
+        os.remove(os.path.join(self.raw, 'OSMC_UI_test.xml'))
+        self.assertEqual(self._build(), [])
+        self.assertFalse(os.path.exists(os.path.join(self.dest, 'OSMC_UI_test.xml')))
+
+    def test_corrupt_manifest(self):
+        self._build()
+        with open(os.path.join(self.dest, build.MANIFEST_FILE), 'w') as f:
+            f.write('{')
+        self.assertEqual(self._build(), build.window_files())
+
+    def test_parallel_matches_serial(self):
+        for index in range(2 * build.MIN_FILES_PER_PROCESS):
+            shutil.copy(os.path.join(RAW_FOLDER, 'SettingsCategory.xml'), os.path.join(self.raw, 'Window%s.xml' % index))
+
+        serial = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, serial)
+
+        serial_records, _ = build.build_skin(self.raw, serial, processes=1)
+        parallel_records, _ = build.build_skin(self.raw, self.dest, processes=2)
+
+        self.assertEqual(parallel_records, serial_records)
+
+        for fyle in build.window_files(self.raw):
+            with open(os.path.join(serial, fyle), 'r') as f:
+                expected = f.read()
+            with open(os.path.join(self.dest, fyle), 'r') as f:
+                self.assertEqual(f.read(), expected)
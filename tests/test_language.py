@@ -1,22 +1,51 @@
 import env
 import os
+import shutil
+import tempfile
 import unittest
 
-from lib.common.language import Translator
+from lib.common.language import Translator, clear_cache, load_strings_po
 
 
 class mock_addon(object):
 
     def __init__(self):
-        pass
+        self.calls = 0
 
     def getLocalizedString(self, id):
-
+        self.calls += 1
         return 'good string'
 
 
+PO_CONTENT = r'''# comment
+msgid ""
+msgstr ""
+"Language: en\n"
+
+msgctxt "#32001"
+msgid "skeleton"
+msgstr ""
+
+msgctxt "#32002"
+msgid "original"
+msgstr "translated"
+
+msgctxt "#32003"
+msgid ""
+"first line "
+"with \"quotes\""
+msgstr ""
+'''
+
+
 class LanguageTest(unittest.TestCase):
 
+    def setUp(self):
+        clear_cache()
+
+    def tearDown(self):
+        clear_cache()
+
     def test_basic(self):
         try:
             m = mock_addon()
@@ -25,3 +54,37 @@ class LanguageTest(unittest.TestCase):
 
         except:
             self.fail('language function failed basic test.')
+
+    def test_cached(self):
+        m = mock_addon()
+        a = Translator(m)
+        for _ in range(5):
+            self.assertEqual(a.lang(1), 'good string')
+        self.assertEqual(m.calls, 1)
+
+    def test_without_kodi(self):
+        self.assertEqual(Translator().lang(32001), 'skeleton')
+
+    def test_without_kodi_unknown_id(self):
+        self.assertEqual(Translator().lang(1), '')
+
+
+class StringsPoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.po_file = os.path.join(self.tmp, 'strings.po')
+        with open(self.po_file, 'w') as f:
+            f.write(PO_CONTENT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_parse(self):
+        strings = load_strings_po(self.po_file)
+        self.assertEqual(strings, {32001: 'skeleton', 32002: 'translated', 32003: 'first line with "quotes"'})
+
+    def test_parsed_once(self):
+        strings = load_strings_po(self.po_file)
+        os.remove(self.po_file)
+        self.assertIs(load_strings_po(self.po_file), strings)
@@ -1,7 +1,13 @@
+import os
+import shutil
+import tempfile
 import unittest
 
 import env
 
+from mock import patch
+
+import lib.common.logger as logger
 from lib.common.logger import Logger
 
 
@@ -33,3 +39,97 @@ class LoggerTest(unittest.TestCase):
             l.log(badstring)
         except:
             self.fail("logger.log() threw an exception to a bad string")
+
+
+class LevelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(logger.set_level, None)
+
+    def test_filtered_before_formatting(self):
+        logger.set_level(logger.LOGINFO)
+        with patch('lib.common.logger.sanitize_string') as mock_sanitize:
+            with patch('lib.common.logger.xbmc') as mock_xbmc:
+                Logger('disme').log('debug %s', 'value')
+                self.assertFalse(mock_sanitize.called)
+                self.assertFalse(mock_xbmc.log.called)
+
+    def test_lazy_arguments(self):
+        logger.set_level(logger.LOGDEBUG)
+        with patch('lib.common.logger.xbmc') as mock_xbmc:
+            Logger('disme').log('read %s settings from %s', 3, 'config.txt', level=logger.LOGINFO)
+            mock_xbmc.log.assert_called_once_with('disme read 3 settings from config.txt', level=logger.LOGINFO)
+
+    def test_bad_arguments(self):
+        logger.set_level(logger.LOGDEBUG)
+        with patch('lib.common.logger.xbmc') as mock_xbmc:
+            Logger('disme').log('no placeholders', 'extra')
+            mock_xbmc.log.assert_called_once_with('disme no placeholders extra', level=logger.LOGDEBUG)
+
+    def test_numeric_arguments(self):
+        self.assertEqual(logger._format('who', 'took %.2f s for %d lines', [0.1234, 5]), 'who took 0.12 s for 5 lines')
+        self.assertEqual(logger._format('who', 'read %s', [u'\xa1']), 'who read \xc2\xa1')
+
+    def test_enabled_for(self):
+        logger.set_level(logger.LOGWARNING)
+        l = Logger('disme')
+        self.assertFalse(l.isEnabledFor(logger.LOGINFO))
+        self.assertTrue(l.isEnabledFor(logger.LOGERROR))
+
+    def test_level_from_kodi(self):
+        with patch('lib.common.logger.xbmc') as mock_xbmc:
+            mock_xbmc.getCondVisibility.return_value = False
+            self.assertEqual(logger.get_level(), logger.LOGNOTICE)
+
+    def test_level_follows_kodi(self):
+        with patch('lib.common.logger.xbmc') as mock_xbmc:
+            with patch('time.time', return_value=100.0) as mock_time:
+                mock_xbmc.getCondVisibility.return_value = False
+                self.assertEqual(logger.get_level(), logger.LOGNOTICE)
+
+                # the setting is kept for a while, then checked again
+                mock_xbmc.getCondVisibility.return_value = True
+                self.assertEqual(logger.get_level(), logger.LOGNOTICE)
+
+                mock_time.return_value = 100.0 + logger.LEVEL_TTL
+                self.assertEqual(logger.get_level(), logger.LOGDEBUG)
+
+
+class BufferedTest(unittest.TestCase):
+
+    def setUp(self):
+        logger.set_level(logger.LOGDEBUG)
+        self.addCleanup(logger.set_level, None)
+
+    def test_buffered_to_kodi(self):
+        with patch('lib.common.logger.xbmc') as mock_xbmc:
+            before = logger.log_stats()['emitted']
+            l = Logger('disme', buffered=True)
+            for x in range(10):
+                l.log('message %s', x)
+            logger.flush()
+
+            logged = '\n'.join(call[0][0] for call in mock_xbmc.log.call_args_list)
+            self.assertEqual(logged.count('disme message'), 10)
+            self.assertEqual(logger.log_stats()['emitted'] - before, 10)
+
+    def test_buffered_to_file(self):
+        tmp = tempfile.mkdtemp()
+        os.environ['MYOSMC_LOG'] = os.path.join(tmp, 'myosmc.log')
+        try:
+            with patch('lib.common.logger.xbmc', None):
+                Logger('disme', buffered=True).log('to file', level=logger.LOGERROR)
+                logger.flush()
+
+            with open(os.environ['MYOSMC_LOG'], 'r') as f:
+                self.assertEqual(f.read(), 'disme to file\n')
+        finally:
+            del os.environ['MYOSMC_LOG']
+            shutil.rmtree(tmp)
+
+    def test_dropped_when_full(self):
+        buf = logger.LogBuffer(size=1)
+        before = logger.log_stats()['dropped']
+        buf.put('disme', 'one', (), logger.LOGDEBUG)
+        buf.put('disme', 'two', (), logger.LOGDEBUG)
+        self.assertEqual(logger.log_stats()['dropped'] - before, 1)
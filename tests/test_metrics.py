@@ -0,0 +1,233 @@
+import env
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from mock import patch
+from sqlite3 import OperationalError
+
+from lib.common import metrics
+from lib.common.openwithbackup import OpenWithBackup
+from lib.common.retention import KeepLastPolicy
+from lib.database.osmcprefs import osmcprefs
+from lib.piconfig.ConfigFileInterface import ConfigFileInterface
+from test_dbinterface import FreshDatabase
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+        self.path = os.path.join(self.folder, 'metrics.json')
+
+        patcher = patch.dict(os.environ, {'METRICSPATH': self.path, 'DBPATH': os.path.join(self.folder, 'test.db')})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # starts from nothing, whatever other tests recorded
+        metrics.registry.take()
+        self.addCleanup(metrics.registry.take)
+
+    def test_counters_and_histograms(self):
+
+        registry = metrics.Registry(flush_interval=None)
+
+        registry.increment('retries')
+        registry.increment('retries', 2)
+        registry.observe('wait_seconds', 0.003)
+        registry.observe('wait_seconds', 10)
+        registry.observe('size_bytes', 2000)
+
+        values = registry.take()
+
+        self.assertEqual(values['counters'], {'retries': 3})
+
+        wait = values['histograms']['wait_seconds']
+        self.assertEqual(wait['bounds'], list(metrics.TIME_BUCKETS))
+        self.assertEqual(wait['counts'], [0, 1, 0, 0, 0, 0, 0, 0, 1])
+        self.assertEqual(wait['count'], 2)
+        self.assertAlmostEqual(wait['sum'], 10.003)
+
+        self.assertEqual(values['histograms']['size_bytes']['bounds'], list(metrics.SIZE_BUCKETS))
+
+        # taken values are gone from the registry
+        self.assertEqual(registry.take(), metrics.empty_totals())
+
+    def test_timed(self):
+
+        registry = metrics.Registry(flush_interval=None)
+
+        @registry.timed('call_seconds')
+        def call():
+            return 'called'
+
+        self.assertEqual(call(), 'called')
+
+        with registry.timed('call_seconds'):
+            pass
+
+        self.assertEqual(registry.take()['histograms']['call_seconds']['count'], 2)
+
+    def test_flush_adds_to_the_totals_of_other_processes(self):
+
+        first = metrics.Registry(flush_interval=None)
+        second = metrics.Registry(flush_interval=None)
+
+        first.increment('retries')
+        first.observe('wait_seconds', 0.2)
+        second.increment('retries', 4)
+        second.observe('wait_seconds', 0.3)
+
+        first.flush()
+        totals = second.flush()
+
+        self.assertEqual(totals, metrics.load())
+        self.assertEqual(totals['counters'], {'retries': 5})
+        self.assertEqual(totals['histograms']['wait_seconds']['count'], 2)
+        self.assertEqual(totals['histograms']['wait_seconds']['counts'][5], 2)
+
+        # nothing recorded since the last flush, so nothing is written
+        self.assertIsNone(second.flush())
+
+    def test_failed_flush_keeps_the_values(self):
+
+        registry = metrics.Registry(flush_interval=None)
+        registry.increment('retries')
+
+        with patch.object(metrics, 'add_to_file', side_effect=IOError):
+            self.assertIsNone(registry.flush())
+
+        self.assertEqual(registry.flush()['counters'], {'retries': 1})
+
+    def test_periodic_flush(self):
+
+        registry = metrics.Registry(flush_interval=60)
+
+        with patch('time.time', return_value=100.0) as mock_time:
+            registry.increment('retries')
+            self.assertEqual(metrics.load()['counters'], {})
+
+            # the first value recorded once the interval has passed flushes, in the thread recording it
+            mock_time.return_value = 160.0
+            registry.observe('config_read_seconds', 0.002)
+
+        self.assertEqual(metrics.load()['counters'], {'retries': 1})
+        self.assertEqual(metrics.load()['histograms']['config_read_seconds']['count'], 1)
+
+        # no thread is left behind to flush later
+        self.assertEqual([x for x in threading.enumerate() if isinstance(x, threading._Timer)], [])
+
+    def test_prometheus_file(self):
+
+        prometheus = os.path.join(self.folder, 'myosmc.prom')
+
+        registry = metrics.Registry(flush_interval=None)
+        registry.increment('db_lock_retries', 3)
+        registry.observe('config_read_seconds', 0.002)
+        registry.observe('config_read_seconds', 0.02)
+
+        with patch.dict(os.environ, {metrics.PROMETHEUS_ENV: prometheus}):
+            registry.flush()
+
+        with open(prometheus) as f:
+            lines = f.read().splitlines()
+
+        self.assertIn('# TYPE myosmc_db_lock_retries_total counter', lines)
+        self.assertIn('myosmc_db_lock_retries_total 3', lines)
+        self.assertIn('# TYPE myosmc_config_read_seconds histogram', lines)
+        self.assertIn('myosmc_config_read_seconds_bucket{le="0.001"} 0', lines)
+        self.assertIn('myosmc_config_read_seconds_bucket{le="0.005"} 1', lines)
+        self.assertIn('myosmc_config_read_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('myosmc_config_read_seconds_count 2', lines)
+
+    @patch('time.sleep')
+    def test_database_lock_retries(self, mock_sleep):
+
+        with FreshDatabase() as db:
+            with self.assertRaises(OperationalError):
+                db._database_execution('SELECT "', [])
+
+        values = metrics.registry.take()
+
+        self.assertEqual(values['counters'], {'db_lock_retries': 25, 'db_lock_failures': 1})
+        self.assertEqual(values['histograms']['db_lock_wait_seconds']['count'], 1)
+
+    def test_config_durations(self):
+
+        location = os.path.join(self.folder, 'config.txt')
+
+        with open(location, 'w') as f:
+            f.write('gpu_mem=256\n')
+
+        interface = ConfigFileInterface(location)
+        doc = interface.read_config_txt()
+        interface.update_settings(doc, {'gpu_mem_1024': '128'})
+        interface.write_config_txt(doc, OpenWithBackup=open)
+
+        histograms = metrics.registry.take()['histograms']
+
+        self.assertEqual(histograms['config_read_seconds']['count'], 1)
+        self.assertEqual(histograms['config_write_seconds']['count'], 1)
+
+    def test_backups(self):
+
+        golden = os.path.join(self.folder, 'config.txt')
+
+        with open(golden, 'w') as f:
+            f.write('original\n')
+
+        backups = os.path.join(self.folder, 'backups')
+        os.makedirs(backups)
+
+        for stamp in range(20170101000000, 20170101000005):
+            with open(os.path.join(backups, 'config.txt_backup%s' % stamp), 'w') as f:
+                f.write('old\n')
+
+        with patch.dict(os.environ, {'BACKUPPATH': backups}):
+            with patch('subprocess.call', side_effect=lambda args: os.remove(args[-1])):
+                with OpenWithBackup(golden, 'w', retention=KeepLastPolicy(3)) as f:
+                    f.write('changed\n')
+
+        values = metrics.registry.take()
+
+        self.assertEqual(values['histograms']['backup_bytes']['sum'], len('original\n'))
+        self.assertEqual(values['counters']['backups_pruned'], 3)
+
+    def test_getprefs_metrics(self):
+
+        metrics.registry.increment('db_lock_retries', 2)
+        metrics.registry.observe('config_read_seconds', 0.5)
+
+        with FreshDatabase():
+            response = osmcprefs('osmc_getprefs', '--metrics')
+
+        self.assertIn('db_lock_retries                  2', response)
+        self.assertRegexpMatches(response, r'config_read_seconds +1 +0.5 +0.5')
+
+        # the values of this process were flushed before printing
+        self.assertEqual(metrics.load()['counters'], {'db_lock_retries': 2})
+
+    def test_getprefs_metrics_as_a_script(self):
+
+        metrics.add_to_file({'counters': {'backups_pruned': 7}, 'histograms': {}}, self.path)
+
+        # osmc_getprefs is a link to the script, which reads its name to know what to do
+        script = os.path.join(self.folder, 'osmc_getprefs')
+        os.symlink(os.path.join(os.path.dirname(os.path.abspath(metrics.__file__)), '..', 'database', 'osmcprefs.py'),
+                   script)
+
+        with FreshDatabase():
+            output = subprocess.check_output([sys.executable, script, '--metrics'])
+
+        self.assertIn('backups_pruned                   7', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
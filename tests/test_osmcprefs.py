@@ -2,8 +2,10 @@ import env
 import os
 import unittest
 
+from mock import call, patch
 from sqlite3 import OperationalError
 
+from lib.database.dbinterface import DBInterface
 from lib.database.osmcprefs import osmcprefs, _get_setting
 from test_data.test_entries import test_items, test_items_replacements
 from test_dbinterface import FreshDatabase
@@ -43,6 +45,23 @@ class OsmcprefsTest(unittest.TestCase):
         with FreshDatabase(preload={'a':'1234'}) as db:
             self.assertEqual(_get_setting('a', db=db), '1234')
 
+    def test__get_setting_default(self):
+
+        with FreshDatabase() as db:
+            self.assertEqual(_get_setting('a', db=db), 'standard value')
+
+    def test__get_setting_in_database_skips_detection(self):
+
+        with FreshDatabase(preload={'a': '1234'}) as db:
+            with patch('lib.common.defaults.flat_defaults') as flat_defaults:
+                self.assertEqual(_get_setting('a', db=db), '1234')
+
+        self.assertFalse(flat_defaults.called)
+
+    def test_osmcprefs_getprefs_help(self):
+
+        self.assertIn('default for\n  the hardware', osmcprefs(*['osmc_getprefs', '--help']))
+
     def test_osmcprefs_getprefs_noargs(self):
 
         with FreshDatabase(preload={'a': '1234'}):
@@ -76,3 +95,15 @@ class OsmcprefsTest(unittest.TestCase):
             with FreshDatabase() as db:
                 self.assertEqual(osmcprefs(*['osmc_setprefs', 'a', str(value)]), 'Set "a" to "%s"' % value)
                 self.assertEqual(osmcprefs(*['osmc_getprefs', 'a']), str(value))
+
+    def test_osmcprefs_getprefs_read_only(self):
+        with FreshDatabase(preload={'a': '1234'}):
+            with patch('lib.database.osmcprefs.DBInterface', wraps=DBInterface) as opened:
+                self.assertEqual(osmcprefs(*['osmc_getprefs', 'a']), '1234')
+                self.assertEqual(osmcprefs(*['osmc_getprefs', '--immutable', 'a']), '1234')
+
+            self.assertEqual(opened.call_args_list, [call(read_only=True, immutable=False), call(read_only=True, immutable=True)])
+
+    def test_osmcprefs_getprefs_creates_missing_database(self):
+        self.assertEqual(osmcprefs(*['osmc_getprefs', 'junk_key']), 'KeyError: Key not found in database')
+        self.assertTrue(os.path.exists(self.dbpath))
@@ -0,0 +1,20 @@
+import env
+import unittest
+
+from mock import patch
+
+from lib.common.hardwareversion import HardwareProfile
+from lib.piconfig.piSettings import PiVersion, RangeValue_VariableDefault
+
+
+class PiVersionTest(unittest.TestCase):
+
+    @patch('lib.common.hardwareversion.hardware_profile', return_value=HardwareProfile(cores=4))
+    def test_multicore(self, mock_profile):
+        self.assertEqual(PiVersion(), 'Pi2')
+
+    @patch('lib.common.hardwareversion.hardware_profile', return_value=HardwareProfile(cores=1))
+    def test_variable_default(self, mock_profile):
+        setting = RangeValue_VariableDefault(name='arm_freq')
+        setting.set_default_value({'PiB': 700, 'Pi2': 900})
+        self.assertEqual(setting.default_value, 700)
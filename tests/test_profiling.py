@@ -0,0 +1,101 @@
+import env
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import patch
+
+from lib.common import profiling
+
+
+def work():
+    total = 0
+    for x in range(20000):
+        total += x
+    return total
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = os.path.join(tempfile.mkdtemp(), 'profiles')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.folder))
+
+        patcher = patch.dict(os.environ, {'PROFILEPATH': self.folder})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _profiled(self, switch, func=work, name='work'):
+
+        with patch.dict(os.environ, {'MYOSMC_PROFILE': switch}):
+            return profiling.profiled(name)(func)
+
+    def _reports(self):
+
+        return sorted(os.listdir(self.folder)) if os.path.isdir(self.folder) else []
+
+    def test_modes(self):
+        self.assertIsNone(profiling.profiling_mode(''))
+        self.assertIsNone(profiling.profiling_mode('False'))
+        self.assertEqual(profiling.profiling_mode('True'), 'cprofile')
+        self.assertEqual(profiling.profiling_mode('sample'), 'sample')
+
+    def test_off_returns_function(self):
+        self.assertIs(self._profiled('0'), work)
+        self.assertEqual(self._reports(), [])
+
+    def test_cprofile(self):
+        self.assertEqual(self._profiled('1')(), work())
+
+        reports = self._reports()
+        self.assertEqual(len(reports), 1)
+        self.assertIn('_work_%s_' % os.getpid(), reports[0])
+        self.assertTrue(reports[0].endswith('.prof'))
+
+        import pstats
+        stats = pstats.Stats(os.path.join(self.folder, reports[0]))
+        self.assertIn('work', [x[2] for x in stats.stats])
+
+    def test_sample(self):
+        def slow():
+            time.sleep(0.1)
+            return 1
+
+        self.assertEqual(self._profiled('sample', slow, 'slow')(), 1)
+
+        reports = self._reports()
+        self.assertEqual(len(reports), 1)
+        self.assertTrue(reports[0].endswith('.folded'))
+
+        with open(os.path.join(self.folder, reports[0])) as f:
+            lines = f.read().splitlines()
+
+        self.assertTrue(lines)
+        self.assertTrue(any('test_profiling.py:slow' in x for x in lines))
+
+    def test_nested_calls_profiled_once(self):
+        inner = self._profiled('1', work, 'inner')
+        outer = self._profiled('1', lambda: inner(), 'outer')
+        outer()
+
+        self.assertEqual(len(self._reports()), 1)
+        self.assertIn('_outer_', self._reports()[0])
+
+    def test_rotation(self):
+        profiled = self._profiled('1')
+
+        with patch.object(profiling, 'PROFILE_KEEP', 3):
+            for _ in range(5):
+                profiled()
+
+        self.assertEqual(len(self._reports()), 3)
+
+    def test_unwritable_folder(self):
+        with open(os.path.join(os.path.dirname(self.folder), 'file'), 'w'):
+            pass
+
+        with patch.dict(os.environ, {'PROFILEPATH': os.path.join(os.path.dirname(self.folder), 'file', 'profiles')}):
+            self.assertEqual(self._profiled('1')(), work())
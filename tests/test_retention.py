@@ -0,0 +1,71 @@
+import env
+import unittest
+
+from lib.common.retention import RetentionPolicy, KeepLastPolicy, HOUR, DAY, WEEK, register_policy, policy_for, \
+    DEFAULT_POLICY, RETENTION_POLICIES
+
+
+NOW = 1500000000.0
+
+
+class RetentionPolicyTest(unittest.TestCase):
+
+    def test_keep_last(self):
+        entries = [(NOW - x, x) for x in range(20)]
+        keep, drop = KeepLastPolicy(keep_last=5).partition(entries, now=NOW)
+        self.assertEqual(keep, [4, 3, 2, 1, 0])
+        self.assertEqual(drop, list(range(19, 4, -1)))
+
+    def test_keep_last_fewer_entries(self):
+        entries = [(NOW - x, x) for x in range(3)]
+        keep, drop = KeepLastPolicy(keep_last=5).partition(entries, now=NOW)
+        self.assertEqual(len(keep), 3)
+        self.assertEqual(drop, [])
+
+    def test_one_per_hour(self):
+        # a backup every minute for the last day
+        entries = [(NOW - x * 60, x) for x in range(24 * 60)]
+        policy = RetentionPolicy(keep_last=0, tiers=[(HOUR, DAY)])
+        keep, drop = policy.partition(entries, now=NOW)
+        self.assertIn(len(keep), (24, 25))
+        self.assertEqual(len(keep) + len(drop), len(entries))
+
+    def test_bounded_storage_reaching_far_back(self):
+        # a backup every 10 minutes for two years
+        entries = [(NOW - x * 600, x) for x in range(6 * 24 * 365 * 2)]
+        keep, drop = RetentionPolicy().partition(entries, now=NOW)
+        self.assertLess(len(keep), 125)
+        oldest_kept = max(keep)
+        self.assertGreater(oldest_kept * 600, 300 * DAY)
+
+    def test_expired_beyond_last_tier(self):
+        entries = [(NOW - 3 * WEEK, 'old'), (NOW, 'new')]
+        policy = RetentionPolicy(keep_last=1, tiers=[(DAY, WEEK)])
+        self.assertEqual(policy.partition(entries, now=NOW), (['new'], ['old']))
+
+    def test_unbounded_last_tier(self):
+        entries = [(NOW - 300 * WEEK, 'ancient'), (NOW, 'new')]
+        policy = RetentionPolicy(keep_last=1, tiers=[(WEEK, None)])
+        self.assertEqual(policy.partition(entries, now=NOW), (['ancient', 'new'], []))
+
+    def test_unknown_age(self):
+        entries = [(None, 'unknown'), (NOW, 'new')]
+        policy = RetentionPolicy(keep_last=1)
+        self.assertEqual(policy.partition(entries, now=NOW), (['new'], ['unknown']))
+
+    def test_survivor_is_stable(self):
+        policy = RetentionPolicy(keep_last=0, tiers=[(HOUR, DAY)])
+        entries = [(NOW - x * 60, x) for x in range(120)]
+        keep_before, _ = policy.partition(entries, now=NOW)
+        entries.append((NOW + 60, 'newer'))
+        keep_after, _ = policy.partition(entries, now=NOW + 60)
+        self.assertEqual(set(keep_before) - set(keep_after), set())
+
+    def test_per_file_registration(self):
+        policy = KeepLastPolicy(3)
+        register_policy('/boot/config.txt', policy)
+        try:
+            self.assertIs(policy_for('/boot/config.txt'), policy)
+            self.assertIs(policy_for('/boot/cmdline.txt'), DEFAULT_POLICY)
+        finally:
+            del RETENTION_POLICIES['/boot/config.txt']
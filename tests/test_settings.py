@@ -0,0 +1,80 @@
+import env
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from lib.database import DBInterface, Settings
+
+
+class SettingsTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+        patcher = patch.dict(os.environ, {'DBPATH': os.path.join(self.folder, 'test.db')})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.db = DBInterface()
+        self.db.setsetting('indb', 5)
+        self.db.setsetting('flag', True)
+
+        self.settings = Settings(self.db, defaults={'fromdefault': 'default value', 'indb': 0})
+
+    def test_tiers(self):
+        self.assertEqual(self.settings.get('indb'), 5)
+        self.assertEqual(self.settings.get('InDB'), 5)
+        self.assertEqual(self.settings.get('fromdefault'), 'default value')
+        self.assertEqual(self.settings.get('nowhere', 'fallback'), 'fallback')
+
+        self.assertEqual(self.settings.hits, {'memory': 1, 'db': 1, 'defaults': 1, 'missing': 1})
+        self.assertEqual(self.settings.hit_ratios()['memory'], 0.25)
+
+    def test_negative_cache(self):
+        with patch.object(self.db, 'getsetting', wraps=self.db.getsetting) as getsetting:
+            for _ in range(5):
+                self.assertEqual(self.settings.get('fromdefault'), 'default value')
+                self.assertIsNone(self.settings.get('nowhere'))
+                self.assertEqual(self.settings.get('indb'), 5)
+
+        self.assertEqual(getsetting.call_count, 3)
+
+    def test_set(self):
+        self.assertEqual(self.settings.get('fromdefault'), 'default value')
+        self.settings.set('fromdefault', 'user value')
+        self.assertEqual(self.settings.get('fromdefault'), 'user value')
+
+        self.settings.set('indb', 7)
+        self.assertEqual(self.settings.get('indb'), 7)
+
+    def test_preload(self):
+        with patch.object(self.db, 'getsetting', wraps=self.db.getsetting) as getsetting:
+            self.settings.preload()
+            self.assertEqual(self.settings.get('flag'), True)
+            self.assertEqual(self.settings.get('fromdefault'), 'default value')
+
+            self.settings.set('new', 'value')
+            self.assertEqual(self.settings.get('new'), 'value')
+            self.assertEqual(self.settings.get('other'), None)
+
+        self.assertEqual(getsetting.call_count, 1)
+
+    def test_invalidate(self):
+        self.assertEqual(self.settings.get('indb'), 5)
+        DBInterface().setsetting('indb', 6)
+        self.assertEqual(self.settings.get('indb'), 5)
+        self.settings.invalidate()
+        self.assertEqual(self.settings.get('indb'), 6)
+
+    def test_resolve_many(self):
+        self.settings.preload()
+        self.assertEqual(self.settings.resolve_many(['indb', 'fromdefault', 'nowhere']),
+                         {'indb': 5, 'fromdefault': 'default value', 'nowhere': None})
+
+    def test_hardware_defaults(self):
+        self.assertEqual(Settings(self.db, hardware_id='rPi3').get('a'), 'rPi3 special value')